@@ -0,0 +1,104 @@
+"""Arduino sintético sobre un pseudo-terminal (sólo POSIX).
+
+Escribe tramas ``D:<seq>,M:<0|1>,S:<servo>`` a un ritmo fijo en el lado
+maestro de un pty; el programa bajo prueba abre el lado esclavo
+(``fake.port``) como si fuera el puerto serie. La distancia es un número de
+secuencia, así quien reciba la muestra puede calcular la latencia con
+``write_times[seq]``. Con ``binary=True`` manda las mismas muestras como
+tramas COBS + CRC (:mod:`porton.binframe`).
+
+Uso suelto, para apuntar a mano la web o el dashboard a un pty::
+
+    python bench/fake_arduino.py --rate 100 [--binary]
+"""
+import argparse
+import os
+import pty
+import sys
+import threading
+import time
+import tty
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from porton.binframe import encode_record  # noqa: E402
+
+# Cada cuánto se despierta el escritor; a ritmos altos escribe varias tramas de golpe
+TICK = 0.001
+
+
+class FakeArduino:
+    """Pty que emite ``rate`` tramas por segundo desde un hilo."""
+
+    def __init__(self, rate, motion_every=50, binary=False):
+        self.rate = rate
+        self.binary = binary
+        self.motion_every = motion_every
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        # write_times[seq] = time.perf_counter() al escribir la trama seq
+        self.write_times = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def frame(self, seq):
+        mov = 1 if self.motion_every and seq % self.motion_every == 0 else 0
+        if self.binary:
+            # la distancia binaria es int16: la secuencia da la vuelta
+            return encode_record(seq, seq % 32768, mov, 90 if mov else 0)
+        return b'D:%d,M:%d,S:%d\n' % (seq, mov, 90 if mov else 0)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def close(self):
+        self.stop()
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    @property
+    def sent(self):
+        return len(self.write_times)
+
+    def _run(self):
+        start = time.perf_counter()
+        seq = 0
+        while not self._stop.is_set():
+            due = int((time.perf_counter() - start) * self.rate)
+            if due > seq:
+                chunk = b''.join(self.frame(s) for s in range(seq, due))
+                os.write(self.master, chunk)
+                now = time.perf_counter()
+                self.write_times.extend([now] * (due - seq))
+                seq = due
+            time.sleep(TICK)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=float, default=10, help='tramas por segundo')
+    parser.add_argument('--binary', action='store_true', help='tramas COBS + CRC en lugar de texto')
+    args = parser.parse_args()
+    fake = FakeArduino(args.rate, binary=args.binary)
+    print(f'Arduino falso en {fake.port} a {args.rate:g} Hz (Ctrl+C para salir)')
+    fake.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.close()
+
+
+if __name__ == '__main__':
+    main()
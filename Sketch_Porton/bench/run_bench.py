@@ -0,0 +1,230 @@
+"""Benchmark de extremo a extremo: pty -> web_app -> N clientes Socket.IO.
+
+Para cada ritmo arranca ``web_app/app.py`` en un subproceso leyendo de un
+Arduino falso (``fake_arduino.py``), conecta ``--clients`` clientes locales y
+mide, por muestra, el tiempo desde que la trama se escribe en el pty hasta
+que el cliente la decodifica. Informa p50/p99/máx de esa latencia, CPU del
+servidor y muestras perdidas, y guarda todo en un JSON para comparar
+versiones::
+
+    pip install -r bench/requirements.txt
+    python bench/run_bench.py --rates 10,100,1000,5000 --clients 4 --duration 10
+
+Sólo POSIX (usa pty y /proc para la CPU).
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import socketio
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_arduino import FakeArduino  # noqa: E402
+from porton.wire import decode_samples  # noqa: E402
+
+# El servidor de desarrollo de app.py, pero arrancado sin el bloque __main__
+SERVER = '''
+import os, sys
+sys.path.insert(0, 'web_app')
+import app as A
+A.start_sensor_thread()
+port = int(os.environ['PORT'])
+try:
+    A.socketio.run(A.app, host='127.0.0.1', port=port, allow_unsafe_werkzeug=True)
+except TypeError:
+    A.socketio.run(A.app, host='127.0.0.1', port=port)
+'''
+
+# Segundos de margen tras parar el pty para que lleguen los últimos lotes
+SETTLE = 1.0
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    i = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[i]
+
+
+def cpu_seconds(pid):
+    """utime + stime de ``pid`` en segundos, leído de /proc."""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def scrape(url):
+    """Métricas sin etiquetas de histograma: ``{'nombre{etiquetas}': valor}``."""
+    with urllib.request.urlopen(url + '/metrics', timeout=2) as resp:
+        text = resp.read().decode()
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            key, _, value = line.rpartition(' ')
+            if '_bucket{' not in key:
+                values[key] = float(value)
+    return values
+
+
+def wait_ready(url, proc, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError('el servidor terminó al arrancar')
+        try:
+            scrape(url)
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('el servidor no respondió a tiempo')
+
+
+class BenchClient:
+    """Cliente Socket.IO que anota el instante de llegada de cada secuencia."""
+
+    def __init__(self, url, write_times):
+        self.write_times = write_times
+        self.latencies = []
+        self.seen = set()
+        self.batches = 0
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('sensor_batch', self._on_batch)
+        self.sio.connect(url, transports=['websocket'])
+
+    def _on_batch(self, payload):
+        now = time.perf_counter()
+        self.batches += 1
+        _, dist, _, _ = decode_samples(payload)
+        for seq in dist:
+            if seq < len(self.write_times) and seq not in self.seen:
+                self.seen.add(seq)
+                self.latencies.append(now - self.write_times[seq])
+
+    def close(self):
+        try:
+            self.sio.disconnect()
+        except Exception:
+            pass
+
+
+def run_rate(rate, args):
+    fake = FakeArduino(rate)
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    tmp = tempfile.mkdtemp(prefix='porton-bench-')
+    env = dict(os.environ, USE_SERIAL='1', SERIAL_PORTS=fake.port, PORT=str(port),
+               HISTORY_DB=os.path.join(tmp, 'bench.sqlite3') if args.history else '',
+               SNAPSHOT_SIZE='0', PYTHONUNBUFFERED='1')
+    log = open(os.path.join(tmp, 'server.log'), 'w')
+    proc = subprocess.Popen([sys.executable, '-c', SERVER], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    clients = []
+    try:
+        wait_ready(url, proc)
+        clients = [BenchClient(url, fake.write_times) for _ in range(args.clients)]
+        before = scrape(url)
+        cpu0, wall0 = cpu_seconds(proc.pid), time.perf_counter()
+        fake.start()
+        time.sleep(args.duration)
+        fake.stop()
+        time.sleep(SETTLE)
+        cpu1, wall1 = cpu_seconds(proc.pid), time.perf_counter()
+        after = scrape(url)
+    finally:
+        for c in clients:
+            c.close()
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        fake.close()
+        log.close()
+
+    sent = fake.sent
+    latencies = sorted(lat for c in clients for lat in c.latencies)
+
+    def delta(name):
+        return after.get(name, 0) - before.get(name, 0)
+
+    def ms(v):
+        return round(v * 1000, 3) if v is not None else None
+
+    return {
+        'rate_hz': rate,
+        'clients': args.clients,
+        'duration_s': args.duration,
+        'sent': sent,
+        'received_per_client': [len(c.seen) for c in clients],
+        'dropped_per_client': [sent - len(c.seen) for c in clients],
+        'batches_per_client': [c.batches for c in clients],
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 0.5)),
+            'p99': ms(percentile(latencies, 0.99)),
+            'max': ms(latencies[-1] if latencies else None),
+        },
+        'server_cpu_pct': round(100 * (cpu1 - cpu0) / (wall1 - wall0), 1),
+        'server': {
+            'samples': delta(f'porton_samples_total{{device="{os.path.basename(fake.port)}"}}'),
+            'emit_dropped': delta('porton_emit_dropped_total'),
+            'window_dropped': delta('porton_window_dropped_total'),
+        },
+        'server_log': log.name,
+    }
+
+
+def git_rev():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rates', default='10,100,1000,5000', help='ritmos en Hz separados por comas')
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10, help='segundos por ritmo')
+    parser.add_argument('--history', action='store_true', help='activar el historial SQLite durante la prueba')
+    parser.add_argument('--output', default=os.path.join(BENCH_DIR, 'results.json'))
+    args = parser.parse_args()
+
+    results = []
+    for rate in (float(r) for r in args.rates.split(',') if r.strip()):
+        res = run_rate(rate, args)
+        lat = res['latency_ms']
+        print(f"{rate:>7g} Hz  p50 {lat['p50']} ms  p99 {lat['p99']} ms  máx {lat['max']} ms  "
+              f"CPU {res['server_cpu_pct']}%  perdidas {res['dropped_per_client']}")
+        results.append(res)
+
+    report = {
+        'git_rev': git_rev(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Resultados en {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,58 +1,151 @@
+import time
+T_INICIO = time.perf_counter() # Referencia del informe de arranque
 import tkinter as tk
 from tkinter import ttk, font
 import serial
 import threading
-import time
 from collections import deque
+import json
+import os
 import sys
 import platform
 
-# Matplotlib para gráficos embebidos en Tkinter
-import matplotlib
-matplotlib.use('TkAgg')
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+# Matplotlib (LivePlot) y NumPy (memoria compartida) tardan casi un segundo en
+# importarse: se cargan después de mostrar la ventana, cuando hacen falta
+from porton.chart_style import COLORS
+from porton.commands import CommandQueue
+from porton.connection import ConnectionManager
+from porton.frames import NO_SERVO, FrameParser
+from porton.ingest import SerialIngest
+from porton.recording import parse_speed, recording_opener, replay_opener
+from porton.rules import RuleEngine, load_rules
 
 # --- CONFIGURACIÓN GLOBAL ---
-PUERTO_SERIAL = 'COM4' # ¡¡ASEGÚRATE DE QUE ESTE SEA TU PUERTO!!
-VELOCIDAD_SERIAL = 9600
-HISTORY_SIZE = 120 # Número de puntos a mostrar en el gráfico
+PUERTO_SERIAL = os.environ.get('PUERTO_SERIAL', 'COM4') # ¡¡ASEGÚRATE DE QUE ESTE SEA TU PUERTO!! (o 'auto', o un glob)
+VELOCIDAD_SERIAL = int(os.environ.get('VELOCIDAD_SERIAL', '9600')) # Hasta 1000000 con el protocolo binario
+GRABACION_DIR = os.environ.get('GRABACION_DIR', '') # Si se define, guarda los bytes crudos del puerto (.prec)
+REPRODUCIR = os.environ.get('REPRODUCIR', '') # Archivo .prec a reproducir en lugar del Arduino
+REPRODUCIR_VELOCIDAD = parse_speed(os.environ.get('REPRODUCIR_VELOCIDAD', '1')) # 1, 10, ... o max
+MEMORIA_COMPARTIDA = os.environ.get('MEMORIA_COMPARTIDA', '') # Portón a leer del demonio (python -m porton.shm_ring) en lugar del puerto
+REGLAS = os.environ.get('REGLAS', '') # Reglas de seguridad (JSON o archivo JSON, ver porton/rules.py); con MEMORIA_COMPARTIDA las aplica el demonio
+HISTORY_SIZE = int(os.environ.get('HISTORIAL_GRAFICO', '1200')) # Muestras que guarda el gráfico; se reducen al ancho en píxeles al dibujar
+UI_TICK_MS = 33 # Refresco fijo de la GUI (~30 FPS), independiente del ritmo serie
+COLA_MAX = 4096 # Muestras pendientes como máximo entre dos ticks
+VIGILAR_CONEXION_MS = 200 # Cada cuánto se refleja en la GUI el estado del gestor de conexión
+CACHE_FUENTE = os.path.join(os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache'),
+                            'porton', 'fuente.json') # Resultado de la prueba de fuentes
 
 # --- PALETA DE COLORES "IMPACTO NEON" ---
 BG_COLOR = "#1e1e1e"       # Un negro más profundo, tipo VS Code
-FRAME_COLOR = "#2a2a2a"    # Fondo de 'tarjetas' (ligeramente más claro)
-TEXT_COLOR = "#d4d4d4"     # Texto principal (blanco suave)
-ACCENT_COLOR = "#00e5ff"   # Acento neon (cian brillante)
-SUCCESS_COLOR = "#4cd964"  # Verde neon
-DANGER_COLOR = "#ff4554"   # Rojo neon
-PLOT_BG_COLOR = "#252526"  # Fondo del gráfico
+# El resto vive en porton/chart_style.py: el gráfico de la web usa los mismos
+FRAME_COLOR = COLORS['frame']     # Fondo de 'tarjetas' (ligeramente más claro)
+TEXT_COLOR = COLORS['text']       # Texto principal (blanco suave)
+ACCENT_COLOR = COLORS['accent']   # Acento neon (cian brillante)
+SUCCESS_COLOR = COLORS['success'] # Verde neon
+DANGER_COLOR = COLORS['danger']   # Rojo neon
+PLOT_BG_COLOR = COLORS['plot_bg'] # Fondo del gráfico
 
 # --- FUENTES ---
 # Usamos fuentes modernas si están disponibles
-try:
-    if platform.system() == "Windows":
-        FONT_FAM = "Segoe UI"
-    elif platform.system() == "Darwin": # macOS
-        FONT_FAM = "Helvetica Neue"
-    else: # Linux/Otros
-        FONT_FAM = "Roboto"
-    # Prueba de que la fuente existe
-    root_test = tk.Tk()
-    font.Font(family=FONT_FAM, size=1)
-    root_test.destroy()
-except tk.TclError:
-    FONT_FAM = "Helvetica" # Fuente de respaldo
-
-FONT_SMALL = (FONT_FAM, 10)
-FONT_NORMAL = (FONT_FAM, 11)
-FONT_BOLD = (FONT_FAM, 12, "bold")
-FONT_TITLE = (FONT_FAM, 20, "bold")
-FONT_STAT_TITLE = (FONT_FAM, 12, "bold")
-FONT_STAT_DATA = (FONT_FAM, 40, "bold")
+if platform.system() == "Windows":
+    FUENTE_PREFERIDA = "Segoe UI"
+elif platform.system() == "Darwin": # macOS
+    FUENTE_PREFERIDA = "Helvetica Neue"
+else: # Linux/Otros
+    FUENTE_PREFERIDA = "Roboto"
+
+
+def _fuente_en_cache():
+    try:
+        with open(CACHE_FUENTE, encoding='utf-8') as f:
+            datos = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return datos.get('fuente') if datos.get('preferida') == FUENTE_PREFERIDA else None
+
+
+def _definir_fuentes(familia):
+    global FONT_FAM, FONT_SMALL, FONT_NORMAL, FONT_BOLD, FONT_TITLE, FONT_STAT_TITLE, FONT_STAT_DATA
+    FONT_FAM = familia
+    FONT_SMALL = (FONT_FAM, 10)
+    FONT_NORMAL = (FONT_FAM, 11)
+    FONT_BOLD = (FONT_FAM, 12, "bold")
+    FONT_TITLE = (FONT_FAM, 20, "bold")
+    FONT_STAT_TITLE = (FONT_FAM, 12, "bold")
+    FONT_STAT_DATA = (FONT_FAM, 40, "bold")
+
+
+def configurar_fuentes(root):
+    """Comprueba si existe la fuente preferida usando la ventana ya creada.
+
+    Listar las fuentes del sistema es lento, así que sólo se hace la primera
+    vez: el resultado queda en CACHE_FUENTE.
+    """
+    familia = _fuente_en_cache()
+    if familia is None:
+        familia = FUENTE_PREFERIDA if FUENTE_PREFERIDA in font.families(root) else "Helvetica" # Fuente de respaldo
+        try:
+            os.makedirs(os.path.dirname(CACHE_FUENTE), exist_ok=True)
+            with open(CACHE_FUENTE, 'w', encoding='utf-8') as f:
+                json.dump({'preferida': FUENTE_PREFERIDA, 'fuente': familia}, f)
+        except OSError:
+            pass # Sin caché: se vuelve a comprobar en el próximo arranque
+    _definir_fuentes(familia)
+
+
+_definir_fuentes(_fuente_en_cache() or FUENTE_PREFERIDA)
+T_MODULOS = time.perf_counter()
+
+# --- Capa "retenida" de los widgets ---
+# Tk redibuja un widget cada vez que se le llama a config()/itemconfig(), aunque
+# el valor no cambie. Los widgets guardan lo último que aplicaron y sólo envían
+# a Tk las diferencias; los de canvas crean sus items una vez y los mutan.
+_SIN_VALOR = object()
+
+
+class RetainedProps:
+    """Opciones ya aplicadas a un widget, item de canvas o variable.
+
+    ``set(**opciones)`` sólo llama a ``aplicar`` con las que han cambiado.
+    """
+    def __init__(self, aplicar):
+        self.aplicar = aplicar
+        self.aplicadas = {}
+
+    def set(self, **opciones):
+        cambios = {k: v for k, v in opciones.items() if self.aplicadas.get(k, _SIN_VALOR) != v}
+        if cambios:
+            self.aplicadas.update(cambios)
+            self.aplicar(**cambios)
+        return bool(cambios)
+
+
+def retained_var(variable):
+    """RetainedProps para una tk.StringVar: ``.set(value=...)``."""
+    return RetainedProps(lambda value: variable.set(value))
+
+
+def retained_item(canvas, item):
+    """RetainedProps para un item de canvas: ``.set(coords=(...), fill=...)``."""
+    def aplicar(coords=None, **opciones):
+        if coords is not None:
+            canvas.coords(item, *coords)
+        if opciones:
+            canvas.itemconfig(item, **opciones)
+    return RetainedProps(aplicar)
+
 
 # --- Nuevos widgets gráficos (antes de la clase principal) ---
 class ServoGauge(ttk.Frame):
-    """Un widget de 'dial' para mostrar el ángulo del servo (0-180)."""
+    """Un widget de 'dial' para mostrar el ángulo del servo (0-180).
+
+    Los tres arcos se crean una sola vez; ``set_angle`` sólo marca el widget
+    como sucio y ``flush`` (una vez por frame) cambia la extensión del arco.
+    """
+    CX, CY = 100, 100
+    R_OUTER = 90
+    R_INNER = 70
+
     def __init__(self, master, style_config, **kwargs):
         super().__init__(master, **kwargs)
         style = ttk.Style()
@@ -61,6 +154,7 @@ class ServoGauge(ttk.Frame):
 
         self.cfg = style_config
         self.angle = 0
+        self._sucio = False
         self.canvas = tk.Canvas(self, width=200, height=110,
                                 bg=self.cfg['frame'],
                                 highlightthickness=0)
@@ -80,26 +174,25 @@ class ServoGauge(ttk.Frame):
                   style="StatTitle.TLabel",
                   background=self.cfg['frame']).place(relx=0.5, rely=0.1, anchor='center')
 
-        self.after(50, self.draw_gauge)
+        self._crear_items()
+        self._r_label = RetainedProps(self.lbl_angle.config)
+        self._r_label.aplicadas['text'] = "0°"
+        self._r_valor = retained_item(self.canvas, self.arc_valor)
+        self._r_valor.aplicadas['extent'] = 0
+
+    def _crear_items(self):
+        """Crea los arcos del dial (una sola vez)."""
+        cx, cy, r_outer, r_inner = self.CX, self.CY, self.R_OUTER, self.R_INNER
 
-    def draw_gauge(self):
-        """Dibuja el widget en el canvas."""
-        self.canvas.delete("all")
-        
-        cx, cy = 100, 100
-        r_outer = 90
-        r_inner = 70
-        
         # Fondo del dial (180 grados)
         self.canvas.create_arc(cx - r_outer, cy - r_outer, cx + r_outer, cy + r_outer,
                                start=180, extent=-180,
                                fill=self.cfg['plot_bg'], width=0)
         
-        # Dial de valor
-        extent_val = -self.angle
-        self.canvas.create_arc(cx - r_outer, cy - r_outer, cx + r_outer, cy + r_outer,
-                               start=180, extent=extent_val,
-                               fill=self.cfg['accent'], width=0)
+        # Dial de valor (se muta en flush)
+        self.arc_valor = self.canvas.create_arc(cx - r_outer, cy - r_outer, cx + r_outer, cy + r_outer,
+                                                start=180, extent=0,
+                                                fill=self.cfg['accent'], width=0)
         
         # Cubierta interior (donut)
         self.canvas.create_arc(cx - r_inner, cy - r_inner, cx + r_inner, cy + r_inner,
@@ -107,15 +200,26 @@ class ServoGauge(ttk.Frame):
                                fill=self.cfg['frame'], width=0)
 
     def set_angle(self, angle):
-        """Actualiza el ángulo del gauge."""
+        """Guarda el ángulo del gauge; se pinta en el próximo flush."""
+        angle = max(0, min(180, int(angle)))
         if angle != self.angle:
-            self.angle = max(0, min(180, int(angle)))
-            self.lbl_angle.config(text=f"{self.angle}°")
-            self.draw_gauge()
+            self.angle = angle
+            self._sucio = True
+
+    def flush(self):
+        """Aplica los cambios pendientes (como mucho una vez por frame)."""
+        if not self._sucio:
+            return
+        self._sucio = False
+        self._r_valor.set(extent=-self.angle)
+        self._r_label.set(text=f"{self.angle}°")
 
 
 class SensorVisuals(ttk.Frame):
-    """Un widget para visualizar el PIR (como un LED) y la Distancia (como una barra)."""
+    """Un widget para visualizar el PIR (como un LED) y la Distancia (como una barra).
+
+    Igual que ServoGauge: los setters guardan el valor y ``flush`` toca Tk.
+    """
     def __init__(self, master, style_config, **kwargs):
         super().__init__(master, **kwargs)
         style = ttk.Style()
@@ -123,6 +227,10 @@ class SensorVisuals(ttk.Frame):
         self.config(style='Sensor.TFrame', width=200, height=150)
         
         self.cfg = style_config
+        self.detectado = False
+        self.cm = None
+        self.max_cm = 150
+        self._sucio = False
 
         ttk.Label(self, text="Sensor Movimiento",
                   style="StatTitle.TLabel",
@@ -152,25 +260,46 @@ class SensorVisuals(ttk.Frame):
                                   background=self.cfg['frame'])
         self.lbl_dist.pack()
 
+        self._r_led = retained_item(self.canvas_mov, self.led)
+        self._r_led.aplicadas.update(fill=self.cfg['plot_bg'], outline=self.cfg['success'])
+        self._r_bar = retained_item(self.canvas_dist, self.dist_bar)
+        self._r_bar.aplicadas['coords'] = (0, 0, 0, 30)
+        self._r_lbl_dist = RetainedProps(self.lbl_dist.config)
+        self._r_lbl_dist.aplicadas['text'] = "-- cm"
+
     def set_movimiento(self, detectado):
-        """Actualiza el color del LED."""
-        if detectado:
-            self.canvas_mov.itemconfig(self.led, fill=self.cfg['danger'],
-                                       outline=self.cfg['danger'])
-        else:
-            self.canvas_mov.itemconfig(self.led, fill=self.cfg['plot_bg'],
-                                       outline=self.cfg['success'])
+        """Guarda el estado del LED."""
+        detectado = bool(detectado)
+        if detectado != self.detectado:
+            self.detectado = detectado
+            self._sucio = True
 
     def set_distancia(self, cm, max_cm=150):
-        """Actualiza la barra de distancia."""
+        """Guarda la distancia de la barra."""
         try:
             cm_val = int(cm)
         except Exception:
             cm_val = 0
-        self.lbl_dist.config(text=f"{cm_val} cm")
-        ancho_barra = (cm_val / max_cm) * 180
-        ancho_barra = max(0, min(180, ancho_barra))
-        self.canvas_dist.coords(self.dist_bar, 0, 0, ancho_barra, 30)
+        if cm_val != self.cm or max_cm != self.max_cm:
+            self.cm = cm_val
+            self.max_cm = max_cm
+            self._sucio = True
+
+    def flush(self):
+        """Aplica los cambios pendientes (como mucho una vez por frame)."""
+        if not self._sucio:
+            return
+        self._sucio = False
+        if self.detectado:
+            self._r_led.set(fill=self.cfg['danger'], outline=self.cfg['danger'])
+        else:
+            self._r_led.set(fill=self.cfg['plot_bg'], outline=self.cfg['success'])
+        if self.cm is not None:
+            self._r_lbl_dist.set(text=f"{self.cm} cm")
+            ancho_barra = (self.cm / self.max_cm) * 180
+            ancho_barra = max(0, min(180, ancho_barra))
+            # en píxeles enteros: un cambio de décimas no mueve la barra
+            self._r_bar.set(coords=(0, 0, round(ancho_barra), 30))
 
 
 class ArduinoDashboard:
@@ -184,16 +313,34 @@ class ArduinoDashboard:
         self.root.geometry("900x600") # Más ancho para 2 columnas
         self.root.configure(bg=BG_COLOR)
         self.root.protocol("WM_DELETE_WINDOW", self._on_closing)
+        # Informe de arranque: segundos desde que se empezó a cargar dashboard.py
+        self.tiempos_arranque = {'módulos': T_MODULOS - T_INICIO}
+        configurar_fuentes(root)
 
         # --- Variables de estado ---
-        self.arduino = None
-        self.hilo_lectura = None
+        # Gestor de conexión: abre el puerto en segundo plano y lo reabre si se cae
+        self.conexion = None
+        self._estado_visto = None
+        self.parar_lectura = threading.Event()
         self.conectado = False
+        # Parser compartido con la web; lleva la cuenta de tramas corruptas
+        self.parser = FrameParser()
+        # Cola de comandos del servo: un único escritor y sólo el último ángulo
+        self.comandos = CommandQueue()
+        self.hilo_escritura = None
+        # Reglas de seguridad: las evalúa el hilo lector y escriben en el puerto sin esperar a la GUI
+        self.reglas = None
+        if REGLAS and not MEMORIA_COMPARTIDA:
+            self.reglas = RuleEngine('dashboard', load_rules(REGLAS), self.comandos)
+        self._regla_vista = None
+        self._latencia_vista = None
+        self.grafico = None
         
         # --- Variables de Tkinter ---
         self.datos_distancia = tk.StringVar(value="---")
         self.datos_movimiento = tk.StringVar(value="---")
         self.datos_servo = tk.StringVar(value="---")
+        self.datos_latencia = tk.StringVar(value="")
         self.estado_conexion = tk.StringVar(value="Desconectado")
 
         # --- Historial para gráficos ---
@@ -201,6 +348,14 @@ class ArduinoDashboard:
         self.mov_hist = deque(maxlen=HISTORY_SIZE)
         self.servo_hist = deque(maxlen=HISTORY_SIZE)
 
+        # --- Cola hilo lector -> GUI (acotada: si se llena se pierden las más viejas) ---
+        self.cola_muestras = deque(maxlen=COLA_MAX)
+        self.muestras_descartadas_total = 0  # sólo lo escribe el hilo lector
+        self._descartadas_vistas = 0
+        # Contadores del último tick: muestras agrupadas en un solo refresco y perdidas
+        self.muestras_coalescidas = 0
+        self.muestras_descartadas = 0
+
         # --- Paleta de colores para los widgets ---
         self.color_config = {
             'frame': FRAME_COLOR,
@@ -217,6 +372,33 @@ class ArduinoDashboard:
         # --- Inicializar Estilos y Widgets ---
         self._crear_estilos()
         self._crear_widgets()
+        self._marcar_arranque('ventana')
+        self.root.after(UI_TICK_MS, self._tick_ui)
+        # Tras pintar la ventana por primera vez se carga el gráfico
+        self.root.after_idle(self._primer_frame)
+
+    def _marcar_arranque(self, etapa):
+        self.tiempos_arranque[etapa] = time.perf_counter() - T_INICIO
+
+    def _primer_frame(self):
+        self.root.update_idletasks() # Termina de colocar y pintar los widgets
+        self._marcar_arranque('primer frame')
+        self.root.after(10, self._crear_grafico)
+
+    def _crear_grafico(self):
+        """Importa matplotlib y sustituye el aviso del panel derecho por el gráfico."""
+        from porton.live_plot import LivePlot
+        self.lbl_cargando_grafico.destroy()
+        # Configurar gráfico (artistas persistentes + blitting)
+        self.grafico = LivePlot(self.panel_grafico, self.color_config, HISTORY_SIZE, FONT_FAM)
+        self.fig, self.ax, self.canvas = self.grafico.fig, self.grafico.ax, self.grafico.canvas
+        self.grafico.widget.pack(fill=tk.BOTH, expand=True)
+        if self.dist_hist:
+            # Lo que llegó mientras se cargaba
+            self.grafico.extend(list(self.dist_hist), list(self.mov_hist))
+            self._actualizar_grafico_principal()
+        self._marcar_arranque('gráfico')
+        print("Arranque: " + " · ".join(f"{etapa} {t * 1000:.0f} ms" for etapa, t in self.tiempos_arranque.items()))
 
     def _crear_estilos(self):
         """Configura los estilos de ttk para el tema oscuro."""
@@ -247,6 +429,7 @@ class ArduinoDashboard:
         # Estilos de conexión
         self.style.configure('Success.TLabel', font=FONT_BOLD, foreground=SUCCESS_COLOR, background=BG_COLOR)
         self.style.configure('Danger.TLabel', font=FONT_BOLD, foreground=DANGER_COLOR, background=BG_COLOR)
+        self.style.configure('Pending.TLabel', font=FONT_BOLD, foreground=ACCENT_COLOR, background=BG_COLOR)
 
         # --- Botones ---
         self.style.configure('TButton', font=FONT_BOLD, foreground=BG_COLOR, background=ACCENT_COLOR,
@@ -327,215 +510,226 @@ class ArduinoDashboard:
         ttk.Label(servo_row, text="Servo:", style="StatTitle.TLabel").pack(side=tk.LEFT)
         self.lbl_servo_valor = ttk.Label(servo_row, textvariable=self.datos_servo, style="DefaultData.TLabel")
         self.lbl_servo_valor.pack(side=tk.LEFT, padx=(8,0))
+        # Latencia ida y vuelta del último comando (orden -> S: confirmado)
+        ttk.Label(frame_control, textvariable=self.datos_latencia, style="StatTitle.TLabel").pack(anchor="w", pady=(8,0))
 
         # --- [COLUMNA DERECHA] ---
         right_panel = ttk.Frame(main_frame, style="Card.TFrame", padding=10)
         right_panel.grid(row=0, column=1, sticky="nsew", padx=(10, 0))
 
-        # Configurar gráfico
-        self.fig = Figure(figsize=(5, 5), dpi=100, facecolor=FRAME_COLOR)
-        self.ax = self.fig.add_subplot(111, facecolor=PLOT_BG_COLOR)
-        self.ax.tick_params(axis='both', which='major', labelsize=10, colors=TEXT_COLOR)
-        self.ax.set_title('Historial de Distancia (cm)', color=TEXT_COLOR, fontdict={'fontfamily': FONT_FAM, 'fontsize': 14})
-        self.ax.set_xlabel('Muestras Recientes', color=TEXT_COLOR, fontdict={'fontfamily': FONT_FAM, 'fontsize': 10})
-        self.ax.set_ylabel('Distancia (cm)', color=TEXT_COLOR, fontdict={'fontfamily': FONT_FAM, 'fontsize': 10})
-        self.ax.grid(True, linestyle=':', color=TEXT_COLOR, alpha=0.2)
-        self.ax.spines['top'].set_color(FRAME_COLOR)
-        self.ax.spines['right'].set_color(FRAME_COLOR)
-        self.ax.spines['bottom'].set_color(TEXT_COLOR)
-        self.ax.spines['left'].set_color(TEXT_COLOR)
-        self.fig.tight_layout()
-
-        self.canvas = FigureCanvasTkAgg(self.fig, master=right_panel)
-        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
-        self.canvas.draw()
+        # El gráfico se crea en _crear_grafico, después del primer frame
+        self.panel_grafico = right_panel
+        self.lbl_cargando_grafico = ttk.Label(right_panel, text="Cargando gráfico...", style="StatTitle.TLabel")
+        self.lbl_cargando_grafico.pack(expand=True)
+
+        # Lo que cambia en cada tick: sólo se llama a Tk cuando el valor cambia
+        self.r_distancia = retained_var(self.datos_distancia)
+        self.r_movimiento = retained_var(self.datos_movimiento)
+        self.r_servo = retained_var(self.datos_servo)
+        self.r_latencia = retained_var(self.datos_latencia)
+        self.r_lbl_mov = RetainedProps(self.lbl_mov_valor.config)
+        self.r_lbl_servo = RetainedProps(self.lbl_servo_valor.config)
+        self.r_conexion = retained_var(self.estado_conexion)
+        self.r_lbl_conexion = RetainedProps(self.lbl_conexion.config)
 
 
     def conectar_arduino(self):
-        """Intenta conectar o desconectar el Arduino."""
+        """Conecta o desconecta el Arduino.
+
+        Conectar no bloquea la GUI: el gestor de conexión abre el puerto en su
+        hilo y, si se cae, lo reabre con backoff (al momento si se vuelve a
+        enchufar el cable). El estado se muestra en _vigilar_conexion.
+        """
         if self.conectado:
             # --- Desconectar ---
             self.conectado = False
-            if self.hilo_lectura:
-                self.hilo_lectura.join(timeout=1)
-            if self.arduino:
-                self.arduino.close()
+            self.parar_lectura.set()
+            if self.conexion:
+                self.conexion.stop()
+                self.conexion = None
+            if self.hilo_escritura:
+                self.hilo_escritura.join(timeout=1)
             self._actualizar_ui_desconectado()
             print("Desconectado de Arduino.")
         
         else:
             # --- Conectar ---
-            try:
-                self.arduino = serial.Serial(PUERTO_SERIAL, VELOCIDAD_SERIAL, timeout=1)
-                time.sleep(2)
-                self.conectado = True
-                self.hilo_lectura = threading.Thread(target=self.leer_datos_serial, daemon=True)
-                self.hilo_lectura.start()
-                self._actualizar_ui_conectado()
-                print(f"Conectado a Arduino en {PUERTO_SERIAL}.")
-            except serial.SerialException as e:
-                self.estado_conexion.set(f"Error: No se encuentra {PUERTO_SERIAL}")
-                self.lbl_conexion.config(style="Danger.TLabel")
-                self.arduino = None
-                print(f"Error de conexión: {e}")
-
-    def _actualizar_ui_conectado(self):
-        self.btn_conectar.config(text="Desconectar", style="Danger.TButton")
-        self.estado_conexion.set(f"Conectado a {PUERTO_SERIAL}")
-        self.lbl_conexion.config(style="Success.TLabel")
+            self.conectado = True
+            self.parar_lectura.clear()
+            self.conexion = ConnectionManager(self._origen_spec(), self._abrir_puerto, self.leer_datos_serial,
+                                              self._recibir_lote, commands=self.comandos)
+            self.conexion.start()
+            self.hilo_escritura = threading.Thread(target=self.comandos.run, args=(self.parar_lectura,), daemon=True)
+            self.hilo_escritura.start()
+            self.btn_conectar.config(text="Desconectar", style="Danger.TButton")
+            self._estado_visto = None
+            self._vigilar_conexion()
+
+    def _vigilar_conexion(self):
+        """Refleja el estado del gestor de conexión en la barra de estado (hilo de la GUI)."""
+        conexion = self.conexion
+        if not self.conectado or conexion is None:
+            return
+        estado = conexion.status()
+        puerto = estado['port'] or self._origen()
+        if estado['state'] == 'live':
+            texto, estilo = f"Conectado a {puerto}", "Success.TLabel"
+        elif estado['state'] == 'stale':
+            texto, estilo = f"Sin datos de {puerto} ({estado['last_sample_age_s']:.0f} s)", "Pending.TLabel"
+        elif estado['state'] == 'connecting':
+            texto, estilo = f"Conectando a {puerto}...", "Pending.TLabel"
+        else:
+            texto = f"Sin conexión con {puerto}"
+            if estado['retry_in'] is not None:
+                texto += f" · reintento en {estado['retry_in']:.1f} s"
+            estilo = "Danger.TLabel"
+        self.r_conexion.set(value=texto)
+        self.r_lbl_conexion.set(style=estilo)
+        if estado['state'] != self._estado_visto:
+            self._estado_visto = estado['state']
+            error = f" ({estado['error']})" if estado['error'] and estado['state'] == 'down' else ""
+            print(f"Conexión {estado['state']}: {puerto}{error}")
+        self.root.after(VIGILAR_CONEXION_MS, self._vigilar_conexion)
+
+    def _origen(self):
+        if MEMORIA_COMPARTIDA:
+            return f"memoria compartida ({MEMORIA_COMPARTIDA})"
+        return REPRODUCIR or PUERTO_SERIAL
+
+    def _origen_spec(self):
+        """Puertos candidatos para el gestor de conexión (admite globs y 'auto')."""
+        return MEMORIA_COMPARTIDA or REPRODUCIR or PUERTO_SERIAL
+
+    def _abrir_puerto(self, puerto):
+        """Abre el Arduino (o la grabación de REPRODUCIR), grabándolo si hay GRABACION_DIR.
+
+        Se llama desde el hilo del gestor de conexión. Con MEMORIA_COMPARTIDA
+        no se abre ningún puerto: se lee el anillo del demonio.
+        """
+        if MEMORIA_COMPARTIDA:
+            from porton.shm_ring import RingReader
+            return RingReader(puerto)
+        if REPRODUCIR:
+            abrir = replay_opener(REPRODUCIR_VELOCIDAD)
+        else:
+            def abrir(puerto, baudios):
+                return serial.Serial(puerto, baudios, timeout=1)
+        if GRABACION_DIR:
+            abrir = recording_opener(abrir, GRABACION_DIR)
+        return abrir(puerto, VELOCIDAD_SERIAL)
 
     def _actualizar_ui_desconectado(self):
         self.btn_conectar.config(text="Conectar", style="TButton")
-        self.estado_conexion.set("Desconectado")
-        self.lbl_conexion.config(style="Danger.TLabel")
-        self.datos_distancia.set("---")
-        self.datos_movimiento.set("---")
-        self.lbl_mov_valor.config(style="DefaultData.TLabel")
-
-    def leer_datos_serial(self):
-        """Lee datos del Arduino en un hilo separado."""
-        while self.conectado and self.arduino and self.arduino.is_open:
-            try:
-                if self.arduino.in_waiting > 0:
-                    linea = self.arduino.readline().decode('utf-8').strip()
-                    # Aceptamos líneas que contienen D: y M:, opcionalmente S:
-                    if linea.startswith("D:") and ",M:" in linea:
-                        self.root.after(0, self.actualizar_datos, linea)
-            except serial.SerialException:
-                print("Error: Puerto desconectado.")
-                self.root.after(0, self.conectar_arduino) # Intenta desconectar limpiamente
-                break
-            except Exception as e:
-                print(f"Error leyendo: {e}")
-                time.sleep(0.1)
-
-    def actualizar_datos(self, linea):
-        """Procesa la línea de datos y actualiza la GUI."""
-        try:
-            partes = linea.split(',')
-            
-            # --- Procesar Distancia ---
-            val_dist_s = partes[0].split(':')[1]
-            val_dist = int(val_dist_s)
-            self.datos_distancia.set(f"{val_dist}")
-            
-            # --- Procesar Movimiento ---
-            val_mov_s = partes[1].split(':')[1]
-            val_mov = (val_mov_s == '1') 
-
-            # --- ¡NUEVO! Procesar Servo (opcional S:<valor>) ---
-            val_servo = 90  # valor por defecto si no viene
-            if len(partes) > 2 and partes[2].startswith("S:"):
+        self.r_conexion.set(value="Desconectado")
+        self.r_lbl_conexion.set(style="Danger.TLabel")
+        self.r_distancia.set(value="---")
+        self.r_movimiento.set(value="---")
+        self.r_lbl_mov.set(style="DefaultData.TLabel")
+
+    def leer_datos_serial(self, puerto, parar, al_recibir):
+        """Lee datos del Arduino en el hilo del gestor de conexión.
+
+        El hilo queda bloqueado sobre el puerto hasta que llegan bytes; cada
+        lectura puede traer varias tramas D:...,M:...[,S:...]. Si el puerto
+        falla la excepción llega al gestor, que lo cierra y lo reabre.
+        """
+        if MEMORIA_COMPARTIDA:
+            # el demonio ya decodificó las tramas: sólo hay que copiarlas
+            puerto.run(parar, al_recibir)
+            return
+        SerialIngest(puerto, al_recibir, parser=self.parser, rules=self.reglas).run(parar)
+
+    def _recibir_lote(self, lote):
+        """Encola las muestras del lote para el próximo tick de la GUI (hilo lector)."""
+        self.comandos.observe(lote.servo)
+        sobran = len(self.cola_muestras) + len(lote) - COLA_MAX
+        if sobran > 0:
+            self.muestras_descartadas_total += sobran
+        self.cola_muestras.extend(lote)
+
+    def _tick_ui(self):
+        """Vacía la cola de muestras y refresca la GUI una sola vez, a ritmo fijo."""
+        cola = self.cola_muestras
+        muestras = [cola.popleft() for _ in range(len(cola))]
+        total = self.muestras_descartadas_total
+        self.muestras_descartadas = total - self._descartadas_vistas
+        self._descartadas_vistas = total
+        self.muestras_coalescidas = max(0, len(muestras) - 1)
+        if muestras:
+            self.actualizar_datos(muestras)
+        if self.comandos.last_latency is not None and self.comandos.last_latency != self._latencia_vista:
+            self._latencia_vista = self.comandos.last_latency
+            self.r_latencia.set(value=f"Respuesta del portón: {self.comandos.last_latency * 1000:.0f} ms")
+        if self.reglas and self.reglas.last is not self._regla_vista:
+            # la regla ya actuó en el hilo lector; aquí sólo se informa
+            regla = self._regla_vista = self.reglas.last
+            print(f"Regla '{regla['rule']}': servo a {regla['angle']}° en {regla['latency_ms']} ms")
+            self.r_latencia.set(value=f"Regla {regla['rule']}: {regla['angle']}° en {regla['latency_ms']:.1f} ms")
+        self._flush_widgets()
+        self.root.after(UI_TICK_MS, self._tick_ui)
+
+    def _flush_widgets(self):
+        """Pinta los widgets de canvas que hayan cambiado en este tick."""
+        for widget in (getattr(self, 'servo_gauge', None), getattr(self, 'sensor_visuals', None)):
+            if widget is not None:
                 try:
-                    val_servo_s = partes[2].split(':')[1]
-                    val_servo = int(val_servo_s)
-                except Exception:
-                    # si la parte S: no es un entero, lo ignoramos
-                    pass
+                    widget.flush()
+                except Exception as e:
+                    print(f"Error actualizando {type(widget).__name__}: {e}")
 
-            # Actualizar textos y estilos según movimiento
-            if val_mov:
-                self.datos_movimiento.set("¡DETECTADO!")
-                self.lbl_mov_valor.config(style="DangerData.TLabel")
-            else:
-                self.datos_movimiento.set("NO")
-                self.lbl_mov_valor.config(style="SuccessData.TLabel")
+    def actualizar_datos(self, muestras):
+        """Actualiza la GUI con las muestras (dist, mov, servo) acumuladas en un tick.
+
+        El historial recibe todas; etiquetas y widgets sólo la última.
+        """
+        dists = [m[0] for m in muestras]
+        movs = [bool(m[1]) for m in muestras]
+        servos = [90 if m[2] == NO_SERVO else m[2] for m in muestras]  # 90 si no viene S:
+        val_dist, val_mov, val_servo = dists[-1], movs[-1], servos[-1]
 
-            # Historial
-            self.dist_hist.append(val_dist)
-            self.mov_hist.append(val_mov)
-            self.servo_hist.append(val_servo)
+        self.r_distancia.set(value=f"{val_dist}")
 
-            # Actualizar todos los gráficos (principal)
-            self._actualizar_grafico_principal()
+        # Actualizar textos y estilos según movimiento
+        if val_mov:
+            self.r_movimiento.set(value="¡DETECTADO!")
+            self.r_lbl_mov.set(style="DangerData.TLabel")
+        else:
+            self.r_movimiento.set(value="NO")
+            self.r_lbl_mov.set(style="SuccessData.TLabel")
 
-            # Llamar a la nueva función para actualizar los widgets/gauges
-            self._actualizar_widgets_graficos(val_dist, val_mov, val_servo)
+        # Historial
+        self.dist_hist.extend(dists)
+        self.mov_hist.extend(movs)
+        self.servo_hist.extend(servos)
+        if self.grafico is not None: # None hasta que termina de cargarse
+            self.grafico.extend(dists, movs)
 
-        except Exception as e:
-            print(f"Error procesando datos '{linea}': {e}")
+        # Actualizar todos los gráficos (principal)
+        self._actualizar_grafico_principal()
+
+        # Llamar a la nueva función para actualizar los widgets/gauges
+        self._actualizar_widgets_graficos(val_dist, val_mov, val_servo)
 
     def _actualizar_grafico_principal(self):
-        """Dibuja el historial de distancia en el gráfico (principal)."""
-        # Protección contra reentradas y limitador de frecuencia de dibujo
-        try:
-            now = time.time()
-            if self._drawing:
-                return
-            if (now - self._last_draw_time) < self._min_draw_interval:
-                return
-            self._drawing = True
-
-            self.ax.clear()
-
-            # --- Estilo del gráfico (debe reaplicarse al limpiar) ---
-            self.ax.set_facecolor(PLOT_BG_COLOR)
-            self.ax.set_title('Historial de Distancia (cm)', color=TEXT_COLOR, fontdict={'fontfamily': FONT_FAM, 'fontsize': 14})
-            self.ax.set_xlabel('Muestras Recientes', color=TEXT_COLOR, fontdict={'fontfamily': FONT_FAM, 'fontsize': 10})
-            self.ax.set_ylabel('Distancia (cm)', color=TEXT_COLOR, fontdict={'fontfamily': FONT_FAM, 'fontsize': 10})
-            self.ax.grid(True, linestyle=':', color=TEXT_COLOR, alpha=0.2)
-            self.ax.tick_params(axis='both', colors=TEXT_COLOR)
-            self.ax.spines['top'].set_color(FRAME_COLOR)
-            self.ax.spines['right'].set_color(FRAME_COLOR)
-            self.ax.spines['bottom'].set_color(TEXT_COLOR)
-            self.ax.spines['left'].set_color(TEXT_COLOR)
-
-            n = len(self.dist_hist)
-            if n > 0:
-                # Decimación para proteger la renderización si hay muchos puntos
-                max_points = 300
-                step = max(1, n // max_points)
-                xs = list(range(-n + 1, 1))[::step]
-                ys = list(self.dist_hist)[::step]
-                mov_flags = list(self.mov_hist)[::step]
-
-                # Línea + relleno
-                self.ax.plot(xs, ys, color=ACCENT_COLOR, marker='o', markersize=3, linewidth=2)
-                self.ax.fill_between(xs, ys, color=ACCENT_COLOR, alpha=0.3)
-
-                # Límites Y automáticos con margen
-                max_y = max(ys)
-                padding = max(max_y * 0.1, 10)
-                self.ax.set_ylim(0, max_y + padding)
-                self.ax.set_xlim(-HISTORY_SIZE, 0)
-
-                # Marcadores rojos donde hubo movimiento (sobre los puntos decimados)
-                xm, ym = [], []
-                for idx, (mv, dist) in enumerate(zip(mov_flags, ys)):
-                    if mv:
-                        xm.append(xs[idx])
-                        ym.append(dist)
-
-                if xm:
-                    self.ax.scatter(xm, ym, color=DANGER_COLOR, s=60, zorder=5, label='Movimiento')
-                    self.ax.legend(loc='upper right', facecolor=FRAME_COLOR, labelcolor=TEXT_COLOR, frameon=False)
-            else:
-                self.ax.text(0.5, 0.5, 'Esperando datos...', transform=self.ax.transAxes,
-                             ha='center', color=TEXT_COLOR, font=FONT_BOLD)
-
-            # Dibujado no bloqueante
-            try:
-                self.canvas.draw_idle()
-            except Exception:
-                # En situaciones raras draw_idle puede fallar; intentamos draw() como fallback
-                try:
-                    self.canvas.draw()
-                except Exception as e:
-                    print(f"Error dibujando canvas: {e}")
+        """Dibuja el historial de distancia en el gráfico (principal).
 
-            self._last_draw_time = now
+        Sólo se actualizan los datos de los artistas y se hace blit; LivePlot
+        limita los FPS y redibuja los ejes completos sólo al reescalar.
+        """
+        if self.grafico is None:
+            return
+        try:
+            self.grafico.render()
         except Exception as e:
             # Protegemos el refresco del gráfico para evitar que un fallo bloquee la GUI
             print(f"Error actualizando gráfico principal: {e}")
-        finally:
-            self._drawing = False
 
     def enviar_comando_servo(self, posicion):
-        """Envía un comando de posición al Arduino."""
-        if self.conectado and self.arduino and self.arduino.is_open:
-            comando = f"{posicion}\n"
-            self.arduino.write(comando.encode('utf-8'))
-            print(f"Comando enviado a Python: {comando.strip()}")
+        """Encola un comando de posición; lo escribe el hilo escritor, no la GUI."""
+        if self.conectado:
+            # si el puerto aún no está listo queda pendiente hasta que lleguen tramas
+            self.comandos.submit(posicion)
+            print(f"Comando encolado: {posicion}")
         else:
             print("No se puede enviar comando: Arduino desconectado.")
 
@@ -550,27 +744,20 @@ class ArduinoDashboard:
             # Distancia y movimiento ya se actualizan en actualizar_datos,
             # aquí nos aseguramos de refrescar cualquier widget adicional
             # (como el valor del servo)
-            self.datos_servo.set(f"{val_servo}°")
+            self.r_servo.set(value=f"{val_servo}°")
 
             # Opcional: puedes cambiar color/estilo del valor del servo
             # según rango o estado
             if val_mov:
-                self.lbl_servo_valor.config(style='DangerData.TLabel')
+                self.r_lbl_servo.set(style='DangerData.TLabel')
             else:
-                self.lbl_servo_valor.config(style='AccentData.TLabel')
-            # Actualizar widgets opcionales si están instanciados
-            try:
-                if getattr(self, 'servo_gauge', None):
-                    self.servo_gauge.set_angle(val_servo)
-            except Exception as e:
-                print(f"Error actualizando ServoGauge: {e}")
-
-            try:
-                if getattr(self, 'sensor_visuals', None):
-                    self.sensor_visuals.set_movimiento(val_mov)
-                    self.sensor_visuals.set_distancia(val_dist)
-            except Exception as e:
-                print(f"Error actualizando SensorVisuals: {e}")
+                self.r_lbl_servo.set(style='AccentData.TLabel')
+            # Widgets opcionales: sólo guardan el valor, se pintan en _flush_widgets
+            if getattr(self, 'servo_gauge', None):
+                self.servo_gauge.set_angle(val_servo)
+            if getattr(self, 'sensor_visuals', None):
+                self.sensor_visuals.set_movimiento(val_mov)
+                self.sensor_visuals.set_distancia(val_dist)
         except Exception as e:
             print(f"Error actualizando widgets/gauges: {e}")
 
@@ -578,10 +765,9 @@ class ArduinoDashboard:
         """Manejador para el cierre de la ventana."""
         print("Cerrando aplicación...")
         self.conectado = False
-        if self.hilo_lectura:
-            self.hilo_lectura.join(timeout=1)
-        if self.arduino and self.arduino.is_open:
-            self.arduino.close()
+        self.parar_lectura.set()
+        if self.conexion:
+            self.conexion.stop()
             print("Puerto serial cerrado.")
         self.root.quit()
         self.root.destroy()
@@ -0,0 +1 @@
+"""Componentes compartidos por ``dashboard.py`` y ``web_app/app.py``."""
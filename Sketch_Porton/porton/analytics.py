@@ -0,0 +1,187 @@
+"""Analítica incremental por portón: filtrado, eventos y estadísticas.
+
+Cada muestra cuesta O(1) (la mediana usa una ventana fija y pequeña):
+
+- Distancia filtrada: mediana móvil de ``median_window`` muestras (quita los
+  picos sueltos del ultrasonido) seguida de una EWMA.
+- Movimiento con histéresis: empieza tras ``motion_on`` muestras seguidas con
+  ``M:1`` y termina cuando lleva ``motion_off_s`` segundos sin ninguna; así el
+  parpadeo del PIR no genera eventos.
+- Portón abierto/cerrado según el ``S:`` informado, con una banda muerta
+  entre ``close_angle`` y ``open_angle``.
+
+``update`` devuelve los eventos de las transiciones; la mayoría de lotes no
+produce ninguno.
+"""
+import bisect
+import threading
+import time
+from collections import deque
+
+from .frames import NO_SERVO
+
+MEDIAN_WINDOW = 5
+EWMA_ALPHA = 0.2
+MOTION_ON = 2
+MOTION_OFF_S = 2.0
+OPEN_ANGLE = 60
+CLOSE_ANGLE = 30
+# Ventana de la tasa de detecciones
+RATE_WINDOW_S = 3600.0
+
+
+class RollingMedian:
+    """Mediana de las últimas ``size`` muestras."""
+
+    def __init__(self, size=MEDIAN_WINDOW):
+        self.window = deque(maxlen=size)
+        self.sorted = []
+
+    def add(self, value):
+        if len(self.window) == self.window.maxlen:
+            old = self.window[0]
+            del self.sorted[bisect.bisect_left(self.sorted, old)]
+        self.window.append(value)
+        bisect.insort(self.sorted, value)
+        return self.sorted[(len(self.sorted) - 1) // 2]
+
+
+class Ewma:
+    """Media móvil exponencial; ``value`` es ``None`` hasta la primera muestra."""
+
+    def __init__(self, alpha=EWMA_ALPHA):
+        self.alpha = alpha
+        self.value = None
+
+    def add(self, x):
+        if self.value is None:
+            self.value = float(x)
+        else:
+            self.value += self.alpha * (x - self.value)
+        return self.value
+
+
+class GateAnalytics:
+    """Estado derivado de un portón a partir de sus lotes de muestras."""
+
+    def __init__(self, device, median_window=MEDIAN_WINDOW, alpha=EWMA_ALPHA,
+                 motion_on=MOTION_ON, motion_off_s=MOTION_OFF_S,
+                 open_angle=OPEN_ANGLE, close_angle=CLOSE_ANGLE):
+        self.device = device
+        self.median = RollingMedian(median_window)
+        self.ewma = Ewma(alpha)
+        self.motion_on = motion_on
+        self.motion_off_s = motion_off_s
+        self.open_angle = open_angle
+        self.close_angle = close_angle
+
+        self._lock = threading.Lock()
+        self.samples = 0
+        self.motion = False
+        self._streak = 0
+        self._motion_since = None
+        self._last_motion_ts = None
+        self.detections = 0
+        self._recent_detections = deque()
+
+        self.gate_open = None  # desconocido hasta ver un S:
+        self._open_since = None
+        self.opens = 0
+        self.open_seconds = 0.0
+        self.last_open_s = None
+
+    def update(self, batch):
+        """Procesa un :class:`porton.frames.FrameBatch`; devuelve la lista de eventos."""
+        events = []
+        ts = batch.ts or time.time()
+        median_add, ewma_add = self.median.add, self.ewma.add
+        with self._lock:
+            for dist, mov, servo in batch:
+                ewma_add(median_add(dist))
+                if mov:
+                    self._streak += 1
+                    self._last_motion_ts = ts
+                    if not self.motion and self._streak >= self.motion_on:
+                        self._start_motion(ts, events)
+                else:
+                    self._streak = 0
+                if servo != NO_SERVO:
+                    self._update_gate(servo, ts, events)
+            self.samples += len(batch)
+            self._check_motion_end(ts, events)
+        return events
+
+    def tick(self, now=None):
+        """Cierra el movimiento si el portón deja de mandar muestras; devuelve eventos."""
+        events = []
+        with self._lock:
+            self._check_motion_end(now or time.time(), events)
+        return events
+
+    def _check_motion_end(self, now, events):
+        # el fin de movimiento se decide por tiempo, no por muestra
+        if self.motion and now - self._last_motion_ts >= self.motion_off_s:
+            self._stop_motion(now, events)
+
+    def _event(self, kind, ts, **extra):
+        return {'device': self.device, 'type': kind, 'ts': ts,
+                'dist': round(self.ewma.value, 1) if self.ewma.value is not None else None, **extra}
+
+    def _start_motion(self, ts, events):
+        self.motion = True
+        self._motion_since = ts
+        self.detections += 1
+        self._recent_detections.append(ts)
+        events.append(self._event('motion_start', ts, detections_per_hour=self.detections_per_hour(ts)))
+
+    def _stop_motion(self, ts, events):
+        self.motion = False
+        self._streak = 0
+        events.append(self._event('motion_stop', ts,
+                                  duration_s=round(self._last_motion_ts - self._motion_since, 3)))
+
+    def _update_gate(self, servo, ts, events):
+        if servo >= self.open_angle and self.gate_open is not True:
+            self.gate_open = True
+            self._open_since = ts
+            self.opens += 1
+            events.append(self._event('gate_open', ts, angle=servo))
+        elif servo <= self.close_angle and self.gate_open is not False:
+            was_open = self.gate_open
+            self.gate_open = False
+            extra = {}
+            if was_open and self._open_since is not None:
+                self.last_open_s = ts - self._open_since
+                self.open_seconds += self.last_open_s
+                extra['duration_s'] = round(self.last_open_s, 3)
+            self._open_since = None
+            events.append(self._event('gate_close', ts, angle=servo, **extra))
+
+    def detections_per_hour(self, now=None):
+        now = now or time.time()
+        recent = self._recent_detections
+        while recent and now - recent[0] > RATE_WINDOW_S:
+            recent.popleft()
+        return len(recent) * 3600.0 / RATE_WINDOW_S
+
+    def stats(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            return self._stats(now)
+
+    def _stats(self, now):
+        open_s = self.open_seconds
+        if self.gate_open and self._open_since is not None:
+            open_s += now - self._open_since
+        return {
+            'device': self.device,
+            'samples': self.samples,
+            'dist_filtered': round(self.ewma.value, 1) if self.ewma.value is not None else None,
+            'motion': self.motion,
+            'detections': self.detections,
+            'detections_per_hour': self.detections_per_hour(now),
+            'gate_open': self.gate_open,
+            'opens': self.opens,
+            'open_seconds_total': round(open_s, 3),
+            'last_open_s': round(self.last_open_s, 3) if self.last_open_s is not None else None,
+        }
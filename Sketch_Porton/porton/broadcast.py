@@ -0,0 +1,142 @@
+"""Difusión a clientes Socket.IO con una cola de salida acotada por cliente.
+
+Un ``emit`` global deja que el transporte acumule sin límite los mensajes de
+un cliente lento. Aquí cada cliente tiene su propia cola; ``pump()`` sólo le
+pasa mensajes al transporte mientras éste tenga menos de ``max_backlog``
+pendientes para ese cliente, y cuando la cola se llena se aplica la política:
+
+- ``drop-oldest``: se descarta el mensaje más viejo de la cola.
+- ``latest-only``: la cola tiene tamaño 1; sólo cuenta el último mensaje.
+- ``disconnect``: se desconecta al cliente.
+
+Cada cliente está suscrito a una sala (``room``, p. ej. un portón); un mensaje
+publicado con ``room`` sólo llega a los clientes de esa sala.
+
+El transporte se inyecta con funciones (``send``, ``backlog``, ``disconnect``)
+para no depender de Flask-SocketIO.
+"""
+import threading
+import time
+from collections import deque
+
+from .metrics import REGISTRY
+
+POLICIES = ('drop-oldest', 'latest-only', 'disconnect')
+
+QUEUE_SECONDS = REGISTRY.histogram('porton_client_queue_seconds',
+                                   'Tiempo de un mensaje en la cola de un cliente hasta pasar al transporte')
+
+
+class ClientChannel:
+    """Estado de salida de un cliente."""
+
+    __slots__ = ('sid', 'room', 'queue', 'sent', 'dropped', 'connected_at')
+
+    def __init__(self, sid, maxlen, room=None):
+        self.sid = sid
+        self.room = room
+        self.queue = deque(maxlen=maxlen)
+        self.sent = 0
+        self.dropped = 0
+        self.connected_at = time.time()
+
+
+class Broadcaster:
+    """Reparte mensajes a todos los clientes respetando su contrapresión."""
+
+    def __init__(self, send, backlog=None, disconnect=None,
+                 policy='drop-oldest', max_queue=32, max_backlog=8):
+        if policy not in POLICIES:
+            raise ValueError(f'política desconocida: {policy!r} (usa una de {POLICIES})')
+        self.send = send
+        self.backlog = backlog or (lambda sid: 0)
+        self.disconnect = disconnect
+        self.policy = policy
+        self.max_queue = 1 if policy == 'latest-only' else max_queue
+        self.max_backlog = max_backlog
+        self._clients = {}
+        self._lock = threading.Lock()
+        self.disconnected = 0
+        # pérdidas acumuladas, incluidas las de clientes ya desconectados
+        self.dropped_total = 0
+
+    def add_client(self, sid, room=None):
+        with self._lock:
+            self._clients[sid] = ClientChannel(sid, self.max_queue, room)
+
+    def subscribe(self, sid, room):
+        """Cambia la sala del cliente y descarta lo que tenía de la anterior."""
+        with self._lock:
+            ch = self._clients.get(sid)
+        if ch is not None:
+            ch.room = room
+            ch.queue.clear()
+
+    def remove_client(self, sid):
+        with self._lock:
+            self._clients.pop(sid, None)
+
+    def __len__(self):
+        return len(self._clients)
+
+    def _channels(self):
+        with self._lock:
+            return list(self._clients.values())
+
+    def publish(self, event, payload, room=None):
+        """Encola ``payload`` para los clientes de ``room`` (todos si es ``None``)."""
+        item = (time.monotonic(), event, payload)
+        for ch in self._channels():
+            if room is not None and ch.room != room:
+                continue
+            if len(ch.queue) >= self.max_queue:
+                ch.dropped += 1
+                self.dropped_total += 1
+                if self.policy == 'disconnect':
+                    self._kick(ch)
+                    continue
+            ch.queue.append(item)
+
+    def pump(self):
+        """Pasa al transporte lo que cada cliente pueda aceptar ahora."""
+        now = time.monotonic()
+        for ch in self._channels():
+            queue = ch.queue
+            while queue and self.backlog(ch.sid) < self.max_backlog:
+                queued_at, event, payload = queue.popleft()
+                QUEUE_SECONDS.observe(now - queued_at)
+                self.send(ch.sid, event, payload)
+                ch.sent += 1
+
+    def queue_depth(self):
+        """Mensajes pendientes sumando todas las colas."""
+        return sum(len(ch.queue) for ch in self._channels())
+
+    def _kick(self, ch):
+        self.remove_client(ch.sid)
+        ch.queue.clear()
+        self.disconnected += 1
+        if self.disconnect:
+            self.disconnect(ch.sid)
+
+    def stats(self):
+        """Contadores por cliente: encolados, pendientes en transporte, retraso y pérdidas."""
+        now = time.monotonic()
+        clients = {}
+        for ch in self._channels():
+            queue = ch.queue
+            try:
+                oldest = queue[0][0]
+            except IndexError:
+                oldest = now
+            clients[ch.sid] = {
+                'room': ch.room,
+                'queued': len(queue),
+                'backlog': self.backlog(ch.sid),
+                'lag_s': round(now - oldest, 3),
+                'sent': ch.sent,
+                'dropped': ch.dropped,
+            }
+        return {'policy': self.policy, 'max_queue': self.max_queue,
+                'disconnected': self.disconnected, 'dropped_total': self.dropped_total,
+                'clients': clients}
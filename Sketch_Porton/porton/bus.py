@@ -0,0 +1,328 @@
+"""Bus pub/sub mínimo sobre TCP para separar la ingesta de los workers web.
+
+Un único proceso de ingesta abre los puertos y publica; cualquier número de
+workers web se suscriben y reparten a sus propios clientes Socket.IO. El
+:class:`Broker` es un reenviador sin estado (un hilo con ``selectors``) que
+puede vivir dentro del proceso de ingesta o lanzarse aparte con
+``python -m porton.bus``.
+
+Trama: ``<HI`` (longitud del tema, longitud del contenido) + tema UTF-8 +
+contenido. Un cliente declara sus suscripciones con el tema ``!sub`` y una
+lista de prefijos separados por comas; el broker le reenvía todo lo que
+empiece por alguno de ellos (nunca lo que él mismo publicó). Si un
+suscriptor no lee, sus mensajes se descartan al superar ``MAX_BUFFER`` bytes
+pendientes: el publicador nunca se frena por un worker lento.
+
+Temas que usa la web: ``batch.<dispositivo>`` (lote binario,
+:func:`encode_batch`), ``event.<dispositivo>``, ``ack.<dispositivo>``,
+``cmd.<dispositivo>`` y ``state`` (JSON).
+"""
+import argparse
+import json
+import selectors
+import socket
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from .frames import FrameBatch
+
+DEFAULT_URL = 'tcp://127.0.0.1:7600'
+FRAME = struct.Struct('<HI')
+SUBSCRIBE = '!sub'
+# Bytes pendientes por suscriptor antes de empezar a descartar
+MAX_BUFFER = 4 * 1024 * 1024
+RETRY_DELAY = 1.0
+
+_BATCH_HEADER = struct.Struct('<dI')
+
+
+def parse_url(url):
+    """``tcp://host:puerto`` -> ``(host, puerto)``."""
+    rest = url.split('://', 1)[-1]
+    host, _, port = rest.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def pack(topic, payload):
+    topic = topic.encode('utf-8')
+    return FRAME.pack(len(topic), len(payload)) + topic + payload
+
+
+class FrameReader:
+    """Reensambla tramas a partir de trozos de un socket."""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def feed(self, data):
+        buf = self._buf
+        buf += data
+        frames = []
+        off = 0
+        while len(buf) - off >= FRAME.size:
+            tlen, plen = FRAME.unpack_from(buf, off)
+            end = off + FRAME.size + tlen + plen
+            if len(buf) < end:
+                break
+            start = off + FRAME.size
+            frames.append((buf[start:start + tlen].decode('utf-8'), bytes(buf[start + tlen:end])))
+            off = end
+        del buf[:off]
+        return frames
+
+
+def encode_batch(batch):
+    """:class:`porton.frames.FrameBatch` -> bytes (cabecera ``<dI`` + columnas int32)."""
+    cols = [batch.dist, batch.mov, batch.servo]
+    if sys.byteorder != 'little':
+        cols = [array('i', c) for c in cols]
+        for c in cols:
+            c.byteswap()
+    return _BATCH_HEADER.pack(batch.ts, len(batch)) + b''.join(c.tobytes() for c in cols)
+
+
+def decode_batch(payload):
+    ts, n = _BATCH_HEADER.unpack_from(payload)
+    batch = FrameBatch(ts)
+    off = _BATCH_HEADER.size
+    for col in (batch.dist, batch.mov, batch.servo):
+        size = col.itemsize * n
+        col.frombytes(payload[off:off + size])
+        if sys.byteorder != 'little':
+            col.byteswap()
+        off += size
+    return batch
+
+
+class _Peer:
+    __slots__ = ('sock', 'reader', 'out', 'subs', 'dropped')
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = FrameReader()
+        self.out = bytearray()
+        self.subs = ()
+        self.dropped = 0
+
+
+class Broker:
+    """Reenvía cada mensaje a los clientes suscritos a su tema."""
+
+    def __init__(self, host='127.0.0.1', port=7600, max_buffer=MAX_BUFFER):
+        self.max_buffer = max_buffer
+        self._listener = socket.create_server((host, port))
+        self._listener.setblocking(False)
+        self.address = self._listener.getsockname()[:2]
+        self._sel = selectors.DefaultSelector()
+        self._peers = {}
+        self._stop = threading.Event()
+        self.messages = 0
+        self.dropped = 0
+
+    def start(self):
+        hilo = threading.Thread(target=self.run, daemon=True)
+        hilo.start()
+        return hilo
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        sel = self._sel
+        sel.register(self._listener, selectors.EVENT_READ)
+        try:
+            while not self._stop.is_set():
+                for key, mask in sel.select(0.5):
+                    if key.fileobj is self._listener:
+                        self._accept()
+                        continue
+                    peer = key.data
+                    if mask & selectors.EVENT_READ:
+                        self._read(peer)
+                    if mask & selectors.EVENT_WRITE and peer.sock.fileno() != -1:
+                        self._flush(peer)
+        finally:
+            for peer in list(self._peers.values()):
+                self._drop(peer)
+            sel.close()
+            self._listener.close()
+
+    def _accept(self):
+        try:
+            sock, _ = self._listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        peer = _Peer(sock)
+        self._peers[sock] = peer
+        self._sel.register(sock, selectors.EVENT_READ, peer)
+
+    def _read(self, peer):
+        try:
+            data = peer.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(peer)
+            return
+        for topic, payload in peer.reader.feed(data):
+            if topic == SUBSCRIBE:
+                peer.subs = tuple(p for p in payload.decode('utf-8').split(',') if p)
+            else:
+                self._route(peer, topic, payload)
+
+    def _route(self, sender, topic, payload):
+        self.messages += 1
+        frame = None
+        for peer in list(self._peers.values()):
+            if peer is sender or not topic.startswith(peer.subs):
+                continue
+            if frame is None:
+                frame = pack(topic, payload)
+            if len(peer.out) + len(frame) > self.max_buffer:
+                peer.dropped += 1
+                self.dropped += 1
+                continue
+            was_empty = not peer.out
+            peer.out += frame
+            if was_empty:
+                self._flush(peer)
+
+    def _flush(self, peer):
+        try:
+            sent = peer.sock.send(peer.out)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self._drop(peer)
+            return
+        del peer.out[:sent]
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if peer.out else 0)
+        self._sel.modify(peer.sock, events, peer)
+
+    def _drop(self, peer):
+        if self._peers.pop(peer.sock, None) is None:
+            return
+        try:
+            self._sel.unregister(peer.sock)
+        except (KeyError, ValueError):
+            pass
+        peer.sock.close()
+
+    def stats(self):
+        return {'clients': len(self._peers), 'messages': self.messages, 'dropped': self.dropped}
+
+
+class BusClient:
+    """Cliente del bus: publica y, si tiene ``topics``, entrega lo recibido a ``on_message``.
+
+    Se reconecta solo; mientras no hay conexión ``publish`` devuelve False y
+    el mensaje se pierde (``dropped``).
+    """
+
+    def __init__(self, url=DEFAULT_URL, topics=(), on_message=None, retry_delay=RETRY_DELAY):
+        self.address = parse_url(url)
+        self.topics = tuple(topics)
+        self.on_message = on_message
+        self.retry_delay = retry_delay
+        self._sock = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.connected = threading.Event()
+        self.dropped = 0
+        self.received = 0
+
+    def start(self):
+        hilo = threading.Thread(target=self.run, daemon=True)
+        hilo.start()
+        return hilo
+
+    def close(self):
+        self._stop.set()
+        self._disconnect()
+
+    def publish(self, topic, payload):
+        sock = self._sock
+        if sock is None:
+            self.dropped += 1
+            return False
+        frame = pack(topic, payload)
+        try:
+            with self._lock:
+                sock.sendall(frame)
+        except OSError:
+            self.dropped += 1
+            self._disconnect()
+            return False
+        return True
+
+    def publish_json(self, topic, obj):
+        return self.publish(topic, json.dumps(obj).encode('utf-8'))
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                sock = socket.create_connection(self.address, timeout=5)
+            except OSError:
+                self._stop.wait(self.retry_delay)
+                continue
+            sock.settimeout(None)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                sock.sendall(pack(SUBSCRIBE, ','.join(self.topics).encode('utf-8')))
+            except OSError:
+                sock.close()
+                continue
+            self._sock = sock
+            self.connected.set()
+            try:
+                self._read_loop(sock)
+            finally:
+                self._disconnect()
+            self._stop.wait(self.retry_delay)
+
+    def _read_loop(self, sock):
+        reader = FrameReader()
+        while not self._stop.is_set():
+            try:
+                data = sock.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+            for topic, payload in reader.feed(data):
+                self.received += 1
+                if self.on_message:
+                    self.on_message(topic, payload)
+
+    def _disconnect(self):
+        self.connected.clear()
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Broker del bus pub/sub de la web')
+    parser.add_argument('--url', default=DEFAULT_URL, help='dirección de escucha (tcp://host:puerto)')
+    args = parser.parse_args()
+    host, port = parse_url(args.url)
+    broker = Broker(host, port)
+    print(f'Broker escuchando en {host}:{port}')
+    try:
+        broker.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
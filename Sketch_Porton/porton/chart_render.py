@@ -0,0 +1,141 @@
+"""Gráfico del historial renderizado en el servidor (PNG/SVG).
+
+Para pantallas de pared y móviles que no pueden redibujar Chart.js con cada
+muestra: piden una imagen cada pocos segundos. Tiene el mismo aspecto que
+el gráfico del dashboard (:mod:`porton.chart_style`) y se pinta con Agg,
+sin pyplot ni pantalla.
+
+:class:`ChartCache` guarda la última imagen de cada dispositivo y formato
+junto con la versión de los datos que la generó: mientras no cambien los
+datos, o no pase ``min_interval`` desde el último render, todos los clientes
+reciben los mismos bytes. N pantallas cuestan un render por intervalo. El
+ETag es un hash de la imagen, así que vale igual en todos los workers.
+
+Con eventlet o gevent un render de decenas de milisegundos dentro de la
+petición pararía el hub, y con él a todos los clientes Socket.IO del worker:
+``offload`` (p. ej. ``eventlet.tpool.execute``) lo lleva a un hilo real.
+"""
+import hashlib
+import io
+import threading
+import time
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from .chart_style import COLORS, FONT_FAMILY, create_artists, style_axes, y_top
+from .downsample import downsample
+from .metrics import REGISTRY
+
+FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+# Como mucho un render por dispositivo y formato cada tantos segundos
+MIN_INTERVAL = 1.0
+MAX_POINTS = 300
+
+RENDERS = REGISTRY.counter('porton_chart_renders_total', 'Imágenes del gráfico renderizadas', ('format',))
+RENDER_SECONDS = REGISTRY.histogram('porton_chart_render_seconds', 'Tiempo de render de una imagen del gráfico')
+
+
+class ChartRenderer:
+    """Una figura Agg que se reutiliza en cada render (no es segura entre hilos)."""
+
+    def __init__(self, history_size, cfg=COLORS, font_family=FONT_FAMILY, size=(6, 4), dpi=100):
+        self.history_size = history_size
+        self.fig = Figure(figsize=size, dpi=dpi, facecolor=cfg['frame'])
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(111, facecolor=cfg['plot_bg'])
+        style_axes(self.ax, cfg, font_family, history_size)
+        (self.fill, self.line, self.scatter,
+         self.legend, self.waiting) = create_artists(self.ax, cfg, font_family, np.zeros((2, 2)))
+        self.fig.tight_layout()
+
+    def render(self, dists, movs, fmt='png'):
+        """Imagen (bytes) de las últimas muestras; ``dists``/``movs`` del más viejo al más nuevo."""
+        t0 = time.perf_counter()
+        ys = np.asarray(dists[-self.history_size:], dtype=float)
+        flags = np.asarray(movs[-self.history_size:], dtype=bool)
+        n = len(ys)
+        self.waiting.set_visible(n == 0)
+        if n:
+            xs = np.arange(-n + 1, 1, dtype=float)
+            if n > MAX_POINTS:
+                idx = downsample(xs, ys, MAX_POINTS, flags, method='minmax')
+                xs, ys, flags = xs[idx], ys[idx], flags[idx]
+            verts = np.empty((len(xs) + 2, 2))
+            verts[1:-1, 0] = xs
+            verts[1:-1, 1] = ys
+            verts[0] = (xs[0], 0)
+            verts[-1] = (xs[-1], 0)
+            self.fill.set_xy(verts)
+            self.line.set_data(xs, ys)
+            self.scatter.set_offsets(np.column_stack((xs[flags], ys[flags])))
+            self.legend.set_visible(bool(flags.any()))
+            self.ax.set_ylim(0, y_top(ys.max()))
+        else:
+            self.fill.set_xy(np.zeros((2, 2)))
+            self.line.set_data([], [])
+            self.scatter.set_offsets(np.empty((0, 2)))
+            self.legend.set_visible(False)
+        buf = io.BytesIO()
+        self.fig.savefig(buf, format=fmt, facecolor=self.fig.get_facecolor())
+        RENDERS.labels(fmt).inc()
+        RENDER_SECONDS.observe(time.perf_counter() - t0)
+        return buf.getvalue()
+
+
+class ChartImage:
+    __slots__ = ('version', 'rendered_at', 'etag', 'body')
+
+    def __init__(self, version, rendered_at, etag, body):
+        self.version = version
+        self.rendered_at = rendered_at
+        self.etag = etag
+        self.body = body
+
+
+class ChartCache:
+    """Última imagen por ``(dispositivo, formato)``; un único hilo renderiza a la vez.
+
+    ``offload(fn, *args)`` ejecuta el render fuera del hilo que atiende la
+    petición (por defecto, en el mismo).
+    """
+
+    def __init__(self, history_size, min_interval=MIN_INTERVAL, offload=None):
+        self.history_size = history_size
+        self.min_interval = min_interval
+        self.offload = offload or (lambda fn, *args: fn(*args))
+        self._renderer = None
+        self._lock = threading.Lock()
+        self._images = {}
+        self.hits = 0
+
+    def _fresh(self, image, version):
+        return image is not None and (image.version == version
+                                      or time.monotonic() - image.rendered_at < self.min_interval)
+
+    def get(self, device, fmt, version, columns):
+        """Devuelve la :class:`ChartImage` vigente.
+
+        ``version`` es la versión actual de los datos y ``columns()`` devuelve
+        ``(version, dists, movs)``; sólo se llama si hay que renderizar.
+        """
+        key = (device, fmt)
+        image = self._images.get(key)
+        if self._fresh(image, version):
+            self.hits += 1
+            return image
+        with self._lock:
+            # mientras esperábamos el lock otro hilo pudo renderizarla
+            image = self._images.get(key)
+            if self._fresh(image, version):
+                self.hits += 1
+                return image
+            if self._renderer is None:
+                self._renderer = ChartRenderer(self.history_size)
+            version, dists, movs = columns()
+            body = self.offload(self._renderer.render, dists, movs, fmt)
+            etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+            image = ChartImage(version, time.monotonic(), etag, body)
+            self._images[key] = image
+            return image
@@ -0,0 +1,64 @@
+"""Estilo del gráfico de distancia, común al dashboard y a la web.
+
+:class:`porton.live_plot.LivePlot` (Tk, con blitting) y
+:class:`porton.chart_render.ChartRenderer` (Agg, PNG/SVG en el servidor)
+crean sus ejes y artistas con estas funciones, así los dos gráficos son
+iguales. El módulo no importa matplotlib: recibe los ejes ya creados y no
+retrasa el arranque del dashboard.
+"""
+
+# Paleta "Impacto neon" (las claves son las de ``color_config`` en dashboard.py)
+COLORS = {
+    'frame': '#2a2a2a',    # Fondo de 'tarjetas'
+    'plot_bg': '#252526',  # Fondo del gráfico
+    'text': '#d4d4d4',     # Texto principal (blanco suave)
+    'accent': '#00e5ff',   # Acento neon (cian brillante)
+    'success': '#4cd964',  # Verde neon
+    'danger': '#ff4554',   # Rojo neon
+}
+# En el servidor no hay fuentes del sistema garantizadas: la que trae matplotlib
+FONT_FAMILY = 'DejaVu Sans'
+
+
+def style_axes(ax, cfg, font_family, history_size):
+    """Títulos, rejilla, bordes y límites iniciales de los ejes."""
+    ax.tick_params(axis='both', which='major', labelsize=10, colors=cfg['text'])
+    ax.set_title('Historial de Distancia (cm)', color=cfg['text'], fontdict={'fontfamily': font_family, 'fontsize': 14})
+    ax.set_xlabel('Muestras Recientes', color=cfg['text'], fontdict={'fontfamily': font_family, 'fontsize': 10})
+    ax.set_ylabel('Distancia (cm)', color=cfg['text'], fontdict={'fontfamily': font_family, 'fontsize': 10})
+    ax.grid(True, linestyle=':', color=cfg['text'], alpha=0.2)
+    ax.spines['top'].set_color(cfg['frame'])
+    ax.spines['right'].set_color(cfg['frame'])
+    ax.spines['bottom'].set_color(cfg['text'])
+    ax.spines['left'].set_color(cfg['text'])
+    ax.set_xlim(-history_size, 0)
+    ax.set_ylim(0, 10)
+
+
+def create_artists(ax, cfg, font_family, fill_verts, animated=False):
+    """Relleno, línea, puntos de movimiento, leyenda y aviso de espera.
+
+    Devuelve ``(fill, line, scatter, legend, waiting)``; la leyenda empieza
+    oculta. ``animated`` los deja fuera del dibujado normal (para blitting).
+    """
+    from matplotlib.patches import Polygon
+
+    fill = Polygon(fill_verts, closed=True, facecolor=cfg['accent'],
+                   alpha=0.3, linewidth=0, animated=animated)
+    ax.add_patch(fill)
+    line, = ax.plot([], [], color=cfg['accent'], marker='o', markersize=3,
+                    linewidth=2, animated=animated)
+    scatter = ax.scatter([], [], color=cfg['danger'], s=60, zorder=5,
+                         label='Movimiento', animated=animated)
+    legend = ax.legend(loc='upper right', facecolor=cfg['frame'],
+                       labelcolor=cfg['text'], frameon=False)
+    legend.set_visible(False)
+    waiting = ax.text(0.5, 0.5, 'Esperando datos...', transform=ax.transAxes,
+                      ha='center', color=cfg['text'],
+                      fontdict={'fontfamily': font_family, 'fontsize': 12, 'fontweight': 'bold'})
+    return fill, line, scatter, legend, waiting
+
+
+def y_top(max_y):
+    """Límite superior del eje Y para un máximo ``max_y`` (con margen)."""
+    return max_y + max(max_y * 0.1, 10)
@@ -0,0 +1,200 @@
+"""Cola de comandos del servo con coalescencia y medida de latencia.
+
+Hay una cola por dispositivo y un único escritor, así que nunca se escribe en
+el puerto desde dos hilos a la vez. Si llegan varios ángulos antes de que el
+escritor los envíe, sólo se manda el último (``coalesced`` cuenta los que se
+saltaron). Las reglas de seguridad (:mod:`porton.rules`) se saltan la cola
+con ``send_now``, que escribe desde el hilo que las evalúa. Cada comando
+enviado queda "en vuelo" hasta que el Arduino informa en ``S:`` un ángulo que
+coincide con el objetivo; ese tiempo es la latencia de actuación del portón.
+Si el último ``S:`` ya estaba en el objetivo no hay movimiento que medir: se
+confirma al escribirlo, sin latencia (``already``).
+"""
+import threading
+import time
+from collections import deque
+
+from .frames import NO_SERVO
+
+# Diferencia máxima (grados) entre S: y el objetivo para darlo por alcanzado
+SERVO_TOLERANCE = 2
+# Segundos tras los que un comando sin respuesta se da por perdido
+ACK_TIMEOUT = 10.0
+
+
+def encode_command(angle):
+    return f'{int(angle)}\n'.encode('ascii')
+
+
+class CommandQueue:
+    """Escritor serializado de comandos de ángulo para un puerto.
+
+    ``write`` es la función que escribe en el puerto (``None`` mientras no
+    esté abierto: el comando queda pendiente). El escritor puede ser un hilo
+    (``run``) o el propio bucle del lector, que llama a ``drain`` cuando
+    ``notify`` le avisa.
+    """
+
+    def __init__(self, write=None, tolerance=SERVO_TOLERANCE, timeout=ACK_TIMEOUT):
+        self.write = write
+        self.notify = None
+        self.tolerance = tolerance
+        self.timeout = timeout
+        self.on_ack = None
+        self._lock = threading.Lock()
+        # sólo una escritura a la vez: la del escritor o la de send_now
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = None
+        self._in_flight = None  # (ángulo, instante de envío)
+        self.sent = 0
+        self.coalesced = 0
+        self.superseded = 0
+        self.timeouts = 0
+        self.acked = 0
+        self.priority = 0
+        self.preempted = 0
+        self.blocked = 0
+        self.already = 0
+        self._hold_until = 0.0
+        # último S: recibido, para no medir comandos que no mueven el servo
+        self._servo = NO_SERVO
+        self.last_latency = None
+        self._latencies = deque(maxlen=100)
+
+    def submit(self, angle):
+        """Pide mover el servo a ``angle``; sustituye a cualquier pendiente."""
+        with self._lock:
+            if self._pending is not None:
+                self.coalesced += 1
+            self._pending = int(angle)
+        self._wake.set()
+        if self.notify:
+            self.notify()
+
+    def wake(self):
+        """Despierta al escritor, p. ej. al abrirse el puerto con un comando pendiente."""
+        self._wake.set()
+        if self.notify:
+            self.notify()
+
+    def drain(self):
+        """Escribe el comando pendiente, si lo hay y el puerto está abierto."""
+        write = self.write
+        if write is None:
+            return
+        with self._write_lock:
+            with self._lock:
+                angle, self._pending = self._pending, None
+            if angle is None:
+                return
+            if time.monotonic() < self._hold_until:
+                self.blocked += 1  # una regla de seguridad acaba de actuar
+                return
+            write(encode_command(angle))
+            already = self._sent(angle)
+        if already:
+            self._ack_unmoved(angle)
+
+    def send_now(self, angle, hold=0.0):
+        """Vía prioritaria: escribe ``angle`` ya, desde el hilo que llama.
+
+        Descarta el comando pendiente y, durante ``hold`` segundos, los que
+        lleguen por ``submit``. Devuelve False si el puerto no está abierto.
+        """
+        write = self.write
+        if write is None:
+            return False
+        with self._write_lock:
+            with self._lock:
+                if self._pending is not None:
+                    self._pending = None
+                    self.preempted += 1
+            self._hold_until = time.monotonic() + hold
+            write(encode_command(angle))
+            self.priority += 1
+            already = self._sent(angle)
+        if already:
+            self._ack_unmoved(angle)
+        return True
+
+    def _sent(self, angle):
+        """Deja ``angle`` en vuelo; True si el servo ya estaba ahí (nada que medir)."""
+        servo = self._servo
+        already = servo != NO_SERVO and abs(servo - angle) <= self.tolerance
+        with self._lock:
+            if self._in_flight is not None:
+                self.superseded += 1
+            self._in_flight = None if already else (angle, time.monotonic())
+            self.sent += 1
+            if already:
+                self.already += 1
+        return already
+
+    def _ack_unmoved(self, angle):
+        if self.on_ack:
+            self.on_ack(angle, None)
+
+    def target(self):
+        """Ángulo del comando en vuelo, o ``NO_SERVO``."""
+        in_flight = self._in_flight
+        return in_flight[0] if in_flight else NO_SERVO
+
+    def run(self, stop):
+        """Bucle de escritor para usar en un hilo propio."""
+        while not stop.is_set():
+            if self._wake.wait(0.5):
+                self._wake.clear()
+                self.drain()
+
+    def observe(self, servo_values):
+        """Compara los ``S:`` recibidos con el comando en vuelo."""
+        for servo in reversed(servo_values):
+            if servo != NO_SERVO:
+                self._servo = servo
+                break
+        in_flight = self._in_flight
+        if in_flight is None:
+            return
+        target, sent_at = in_flight
+        now = time.monotonic()
+        if now - sent_at > self.timeout:
+            with self._lock:
+                if self._in_flight is in_flight:
+                    self._in_flight = None
+                    self.timeouts += 1
+            return
+        for servo in servo_values:
+            if servo != NO_SERVO and abs(servo - target) <= self.tolerance:
+                latency = now - sent_at
+                with self._lock:
+                    if self._in_flight is not in_flight:
+                        return
+                    self._in_flight = None
+                    self.acked += 1
+                    self.last_latency = latency
+                    self._latencies.append(latency)
+                if self.on_ack:
+                    self.on_ack(target, latency)
+                return
+
+    def stats(self):
+        lat = sorted(self._latencies)
+        def ms(v):
+            return round(v * 1000, 1) if v is not None else None
+        return {
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'superseded': self.superseded,
+            'acked': self.acked,
+            'timeouts': self.timeouts,
+            'priority': self.priority,
+            'preempted': self.preempted,
+            'blocked': self.blocked,
+            'already': self.already,
+            'pending': self._pending,
+            'in_flight': self._in_flight[0] if self._in_flight else None,
+            'latency_last_ms': ms(self.last_latency),
+            'latency_p50_ms': ms(lat[len(lat) // 2]) if lat else None,
+            'latency_max_ms': ms(lat[-1]) if lat else None,
+        }
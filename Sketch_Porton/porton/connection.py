@@ -0,0 +1,252 @@
+"""Conexión con los portones: descubrimiento, reconexión con backoff y estado.
+
+Estados de un puerto (``STATES``):
+
+- ``connecting``: abriéndolo o esperando su primera trama (el Arduino se
+  reinicia al abrir el puerto; no se espera un tiempo fijo, basta con que
+  empiece a hablar).
+- ``live``: llegan muestras.
+- ``stale``: abierto pero sin muestras desde hace ``STALE_AFTER`` segundos
+  (Arduino colgado, cable medio suelto).
+- ``down``: no se pudo abrir o se cayó. Se reintenta con backoff exponencial
+  y jitter, pero mientras se espera se vigila el puerto: si desaparece y
+  vuelve a aparecer (cable desenchufado y enchufado) se reintenta al momento.
+
+Los puertos se configuran con una lista separada por comas en la que cada
+elemento puede ser un glob (``"/dev/ttyACM*,COM5"``) o ``auto``, que busca
+placas Arduino y conversores USB-serie habituales por su VID.
+
+:class:`ConnectionManager` mantiene un puerto en un hilo (el dashboard);
+:class:`porton.devices.DeviceRegistry` usa las mismas piezas en asyncio.
+"""
+import glob
+import os
+import random
+import threading
+import time
+
+try:
+    from serial.tools import list_ports
+except ImportError:
+    list_ports = None
+
+STATES = ('connecting', 'live', 'stale', 'down')
+STALE_AFTER = 3.0
+BACKOFF_BASE = 0.25
+BACKOFF_MAX = 10.0
+# Cada cuánto se mira si un puerto caído ha vuelto a aparecer
+HOTPLUG_POLL = 0.2
+# VID USB de Arduino y de los conversores de los clones (CH340, FTDI, CP210x)
+ARDUINO_VIDS = {0x2341, 0x2A03, 0x1A86, 0x0403, 0x10C4}
+
+
+class Backoff:
+    """Esperas exponenciales (``base``, ``2·base``... hasta ``maximum``) con jitter.
+
+    Cada espera es uniforme entre la mitad y el total del escalón, así varios
+    procesos que pierden el puerto a la vez no reintentan al unísono.
+    """
+
+    def __init__(self, base=BACKOFF_BASE, maximum=BACKOFF_MAX, factor=2.0, rng=random):
+        self.base = base
+        self.maximum = maximum
+        self.factor = factor
+        self.rng = rng
+        self.attempt = 0
+
+    def next(self):
+        step = min(self.maximum, self.base * self.factor ** self.attempt)
+        self.attempt += 1
+        return step / 2 + self.rng.random() * step / 2
+
+    def reset(self):
+        self.attempt = 0
+
+
+def detect_arduinos():
+    """Puertos con un VID de Arduino o de conversor USB-serie conocido."""
+    if list_ports is None:
+        return []
+    return sorted(p.device for p in list_ports.comports() if p.vid in ARDUINO_VIDS)
+
+
+def resolve_ports(spec):
+    """Expande ``spec`` (lista separada por comas, con globs o ``auto``) a rutas de puerto."""
+    ports = []
+    for item in (p.strip() for p in spec.split(',')):
+        if not item:
+            continue
+        if item.lower() == 'auto':
+            ports.extend(detect_arduinos())
+        elif glob.has_magic(item):
+            ports.extend(sorted(glob.glob(item)))
+        else:
+            ports.append(item)
+    # sin duplicados, conservando el orden
+    return list(dict.fromkeys(ports))
+
+
+def port_present(port):
+    """¿Existe ahora mismo ``port``? (``True`` si no hay forma de saberlo)."""
+    if os.path.isabs(port):
+        return os.path.exists(port)
+    if list_ports is not None and port.upper().startswith('COM'):
+        return any(p.device == port for p in list_ports.comports())
+    return True
+
+
+class Presence:
+    """Detecta que un puerto reaparece (pasa de no existir a existir)."""
+
+    def __init__(self, port):
+        self.port = port
+        self.present = port_present(port) if port else False
+
+    def returned(self):
+        if not self.port:
+            return False
+        present = port_present(self.port)
+        back = present and not self.present
+        self.present = present
+        return back
+
+
+class ConnectionManager:
+    """Mantiene abierto uno de los puertos de ``spec`` en un hilo propio.
+
+    ``opener(port)`` devuelve un puerto abierto; ``read_loop(port, stop,
+    on_batch)`` lo lee hasta que se active ``stop`` o lance una excepción.
+    Si falla, se cierra y se vuelve a intentar (con el siguiente candidato si
+    hay varios) tras la espera del backoff. ``commands``
+    (:class:`porton.commands.CommandQueue`) sólo recibe el puerto cuando ya
+    llegan tramas, así no se pierden comandos durante el reinicio.
+    """
+
+    def __init__(self, spec, opener, read_loop, on_batch, commands=None,
+                 stale_after=STALE_AFTER, backoff=None):
+        self.spec = spec
+        self.opener = opener
+        self.read_loop = read_loop
+        self.on_batch = on_batch
+        self.commands = commands
+        self.stale_after = stale_after
+        self.backoff = backoff or Backoff()
+        self._stop = threading.Event()
+        self._thread = None
+        self._port = None
+        self._state = 'connecting'
+        self.port_name = None
+        self.last_error = None
+        self.last_sample = None
+        self.retry_at = None
+        self.reconnects = 0
+
+    @property
+    def state(self):
+        if self._state == 'live' and time.monotonic() - self.last_sample > self.stale_after:
+            return 'stale'
+        return self._state
+
+    def status(self):
+        """Estado para la interfaz: ``state``, ``port``, ``error`` y ``retry_in`` (s)."""
+        retry_in = None
+        if self._state == 'down' and self.retry_at is not None:
+            retry_in = max(0.0, self.retry_at - time.monotonic())
+        return {
+            'state': self.state,
+            'port': self.port_name,
+            'error': self.last_error,
+            'retry_in': retry_in,
+            'reconnects': self.reconnects,
+            'last_sample_age_s': time.monotonic() - self.last_sample if self.last_sample else None,
+        }
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout=1.0):
+        self._stop.set()
+        port = self._port
+        if port is not None:
+            try:
+                port.close()  # desbloquea un read() en curso
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        tried = 0
+        while not self._stop.is_set():
+            candidates = resolve_ports(self.spec)
+            if not candidates:
+                self._down('no se encuentra ningún puerto', None)
+                continue
+            # tras un fallo se prueba el siguiente candidato
+            self.port_name = candidates[tried % len(candidates)]
+            self._state = 'connecting'
+            try:
+                self._port = self.opener(self.port_name)
+            except Exception as e:
+                tried += 1
+                self._down(e, self.port_name)
+                continue
+            try:
+                self.read_loop(self._port, self._stop, self._on_batch)
+            except Exception as e:
+                if not self._stop.is_set():
+                    self.last_error = str(e)
+            finally:
+                self._close()
+            if self._stop.is_set():
+                break
+            self.reconnects += 1
+            self._down(self.last_error, self.port_name)
+
+    def _on_batch(self, batch):
+        self.last_sample = time.monotonic()
+        if self._state != 'live':
+            self._state = 'live'
+            self.last_error = None
+            self.backoff.reset()
+            if self.commands is not None:
+                self.commands.write = self._port.write
+                self.commands.wake()
+        self.on_batch(batch)
+
+    def _down(self, error, port):
+        """Espera el backoff, o menos si el puerto (o alguno de ``spec``) reaparece."""
+        self._state = 'down'
+        if error is not None:
+            self.last_error = str(error)
+        delay = self.backoff.next()
+        self.retry_at = time.monotonic() + delay
+        presence = Presence(port)
+        known = set(resolve_ports(self.spec)) if port is None else None
+        while not self._stop.wait(min(HOTPLUG_POLL, max(0.0, self.retry_at - time.monotonic()))):
+            if time.monotonic() >= self.retry_at:
+                if port is None or presence.present:
+                    break
+                # desenchufado: no tiene sentido abrirlo, se sigue esperando
+                self.retry_at = time.monotonic() + self.backoff.next()
+                continue
+            if presence.returned():
+                # recién enchufado: si aún no se deja abrir, reintentar pronto
+                self.backoff.reset()
+                break
+            if known is not None and set(resolve_ports(self.spec)) - known:
+                break  # apareció un puerto nuevo
+        self.retry_at = None
+
+    def _close(self):
+        if self.commands is not None:
+            self.commands.write = None
+        port, self._port = self._port, None
+        if port is not None:
+            try:
+                port.close()
+            except Exception:
+                pass
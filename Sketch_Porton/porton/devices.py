@@ -0,0 +1,320 @@
+"""Registro de dispositivos: varios puertos serie en un único bucle asyncio.
+
+Cada puerto se registra en el bucle con ``loop.add_reader`` sobre su
+descriptor, así que N portones no necesitan N hilos. Los puertos sin
+descriptor (pyserial en Windows) se leen con lecturas bloqueantes en el
+ejecutor por defecto del bucle.
+
+Los puertos se configuran con una lista separada por comas en la que cada
+elemento puede ser un glob o ``auto``: ``"COM4,COM5"``, ``"/dev/ttyACM*"``
+(ver :func:`porton.connection.resolve_ports`). Un puerto caído se reabre con
+backoff exponencial, o al momento si se vuelve a enchufar, y con ``spec`` se
+añaden los portones que aparezcan después de arrancar.
+"""
+import asyncio
+import functools
+import os
+import threading
+import time
+
+from .commands import CommandQueue
+from .connection import HOTPLUG_POLL, STALE_AFTER, Backoff, Presence, resolve_ports
+from .frames import FrameParser
+from .ingest import FdPort, FrameDecoder, _fileno
+from .metrics import REGISTRY
+from .rules import RuleEngine
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+# Cada cuánto se vuelve a expandir ``spec`` en busca de portones nuevos
+DISCOVER_INTERVAL = 1.0
+
+SAMPLES = REGISTRY.counter('porton_samples_total', 'Muestras válidas leídas del puerto serie', ('device',))
+BYTES = REGISTRY.counter('porton_serial_bytes_total', 'Bytes leídos del puerto serie', ('device',))
+PARSE_SECONDS = REGISTRY.histogram('porton_read_to_parse_seconds',
+                                   'Tiempo desde que read() devuelve hasta tener el lote decodificado', ('device',))
+
+
+def device_name(port):
+    """Nombre corto de un puerto: ``/dev/ttyACM0`` -> ``ttyACM0``."""
+    return os.path.basename(port) or port
+
+
+def open_port(port, baud):
+    """Abre ``port`` sin bloquear en lectura (pyserial o, sin él, un descriptor POSIX)."""
+    if serial is not None:
+        return serial.Serial(port, baud, timeout=0)
+    return FdPort(os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK))
+
+
+class Device:
+    """Un puerto del registro con su parser y su estado de salud."""
+
+    def __init__(self, port, baud):
+        self.port_name = port
+        self.name = device_name(port)
+        self.baud = baud
+        self.port = None
+        self.parser = FrameParser()
+        # texto o binario (COBS + CRC), según lo que mande el portón
+        self.decoder = FrameDecoder(self.parser)
+        self.commands = CommandQueue()
+        self.rules = None
+        self.state = 'connecting'
+        self.backoff = Backoff()
+        self.retry_at = None
+        self.m_samples = SAMPLES.labels(self.name)
+        self.m_bytes = BYTES.labels(self.name)
+        self.m_parse = PARSE_SECONDS.labels(self.name)
+        self.errors = 0
+        self.reconnects = 0
+        self.last_error = None
+        self.last_sample_ts = None
+
+    def health(self):
+        age = time.time() - self.last_sample_ts if self.last_sample_ts else None
+        retry_in = max(0.0, self.retry_at - time.monotonic()) if self.retry_at else None
+        return {
+            'port': self.port_name,
+            'state': self.state,
+            'samples': self.m_samples.value(),
+            'bytes': self.m_bytes.value(),
+            'errors': self.errors,
+            'reconnects': self.reconnects,
+            'last_error': self.last_error,
+            'retry_in_s': round(retry_in, 3) if retry_in is not None else None,
+            'last_sample_age_s': round(age, 3) if age is not None else None,
+            **self.decoder.stats(),
+            'commands': self.commands.stats(),
+            'rules': self.rules.stats() if self.rules else None,
+        }
+
+
+class DeviceRegistry:
+    """Abre todos los puertos y reparte sus lotes con ``on_batch(name, batch)``.
+
+    ``on_command_ack(name, angle, latency)`` se llama cuando un portón confirma
+    en ``S:`` el ángulo de un comando (``latency`` None si ya estaba en él) y ``on_state(name, state)`` cada vez que
+    un puerto cambia de estado (``connecting``, ``live``, ``stale``, ``down``).
+    Con ``spec`` se vuelve a expandir la lista de puertos cada
+    ``DISCOVER_INTERVAL`` y se abren los que aparezcan. ``rules``
+    (:func:`porton.rules.load_rules`) se evalúan en este bucle sobre cada
+    muestra, antes de entregar el lote, y ``on_rule(info)`` avisa de cada
+    disparo ya escrito en el puerto.
+    """
+
+    def __init__(self, ports, baud, on_batch, opener=open_port, on_command_ack=None,
+                 spec=None, on_state=None, stale_after=STALE_AFTER, rules=(), on_rule=None):
+        self.devices = {}
+        self.baud = baud
+        self.on_command_ack = on_command_ack
+        self.rules = list(rules)
+        self.on_rule = on_rule
+        for port in ports:
+            self._add(port)
+        self.on_batch = on_batch
+        self.opener = opener
+        self.spec = spec
+        self.on_state = on_state
+        self.stale_after = stale_after
+        self.loop = None
+        REGISTRY.callback('porton_frames_malformed_total', 'Tramas que no cumplen el formato (texto o COBS)',
+                          'counter', lambda: self._per_device(lambda d: d.decoder.malformed))
+        REGISTRY.callback('porton_frames_crc_errors_total', 'Tramas binarias descartadas por CRC',
+                          'counter', lambda: self._per_device(lambda d: d.decoder.binary.crc_errors))
+        REGISTRY.callback('porton_frames_lost_total', 'Saltos en la secuencia de las tramas binarias',
+                          'counter', lambda: self._per_device(lambda d: d.decoder.binary.lost))
+        REGISTRY.callback('porton_serial_reconnects_total', 'Reaperturas de un puerto tras un fallo',
+                          'counter', lambda: self._per_device(lambda d: d.reconnects))
+        REGISTRY.callback('porton_serial_errors_total', 'Errores al abrir o leer un puerto',
+                          'counter', lambda: self._per_device(lambda d: d.errors))
+        REGISTRY.callback('porton_device_live', '1 si el puerto está entregando datos',
+                          'gauge', lambda: self._per_device(lambda d: int(d.state == 'live')))
+
+    def _add(self, port):
+        dev = Device(port, self.baud)
+        if self.on_command_ack:
+            dev.commands.on_ack = functools.partial(self.on_command_ack, dev.name)
+        if self.rules:
+            dev.rules = RuleEngine(dev.name, self.rules, dev.commands, on_fire=self.on_rule)
+        self.devices[dev.name] = dev
+        return dev
+
+    def _per_device(self, fn):
+        return [({'device': name}, fn(dev)) for name, dev in self.devices.items()]
+
+    def names(self):
+        return list(self.devices)
+
+    def health(self):
+        return {name: dev.health() for name, dev in self.devices.items()}
+
+    def submit_command(self, name, angle):
+        """Encola un ángulo para el portón ``name``; False si no existe."""
+        dev = self.devices.get(name)
+        if dev is None:
+            return False
+        dev.commands.submit(angle)
+        return True
+
+    # --- Bucle ---
+    def start(self, stop):
+        """Lanza el bucle asyncio en un hilo demonio hasta que se active ``stop``."""
+        hilo = threading.Thread(target=self.run, args=(stop,), daemon=True)
+        hilo.start()
+        return hilo
+
+    def run(self, stop):
+        asyncio.run(self._main(stop))
+
+    async def _main(self, stop):
+        self.loop = asyncio.get_running_loop()
+        tasks = [self._launch(dev, stop) for dev in self.devices.values()]
+        next_discover = time.monotonic() + DISCOVER_INTERVAL
+        while not stop.is_set():
+            await asyncio.sleep(0.2)
+            now = time.time()
+            for dev in list(self.devices.values()):
+                if dev.state == 'live' and now - dev.last_sample_ts > self.stale_after:
+                    self._set_state(dev, 'stale')
+            if self.spec and time.monotonic() >= next_discover:
+                next_discover = time.monotonic() + DISCOVER_INTERVAL
+                for port in resolve_ports(self.spec):
+                    if device_name(port) not in self.devices:
+                        tasks.append(self._launch(self._add(port), stop))
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _launch(self, dev, stop):
+        # los comandos llegan desde otros hilos; se escriben en este bucle
+        dev.commands.notify = functools.partial(self.loop.call_soon_threadsafe, dev.commands.drain)
+        if self.on_state:
+            self.on_state(dev.name, dev.state)
+        return asyncio.create_task(self._supervise(dev, stop))
+
+    async def _supervise(self, dev, stop):
+        """Abre el puerto, lo lee hasta que falle y vuelve a intentarlo."""
+        while not stop.is_set():
+            self._set_state(dev, 'connecting')
+            try:
+                dev.port = self.opener(dev.port_name, dev.baud)
+            except Exception as e:
+                self._mark_down(dev, e)
+                await self._wait_retry(dev, stop)
+                continue
+            # los comandos se escriben cuando llega la primera trama: al abrir
+            # el puerto el Arduino se reinicia y no los leería
+            dev.decoder.reset()
+            try:
+                fd = _fileno(dev.port)
+                if fd is None:
+                    await self._read_blocking(dev, stop)
+                else:
+                    await self._read_fd(dev, fd)
+            except asyncio.CancelledError:
+                self._close(dev)
+                raise
+            except Exception as e:
+                self._mark_down(dev, e)
+            self._close(dev)
+            dev.reconnects += 1
+            await self._wait_retry(dev, stop)
+
+    async def _wait_retry(self, dev, stop):
+        """Espera el backoff del puerto; si se desenchufa y vuelve, reintenta ya."""
+        dev.retry_at = time.monotonic() + dev.backoff.next()
+        presence = Presence(dev.port_name)
+        while not stop.is_set():
+            left = dev.retry_at - time.monotonic()
+            if left <= 0:
+                if presence.present:
+                    break
+                # desenchufado: no tiene sentido abrirlo, se sigue esperando
+                dev.retry_at = time.monotonic() + dev.backoff.next()
+                continue
+            await asyncio.sleep(min(HOTPLUG_POLL, left))
+            if presence.returned():
+                dev.backoff.reset()
+                break
+        dev.retry_at = None
+
+    async def _read_fd(self, dev, fd):
+        failed = self.loop.create_future()
+
+        def on_readable():
+            try:
+                chunk = dev.port.read(dev.port.in_waiting or 1)
+                if not chunk:
+                    raise ConnectionError('el puerto se cerró')
+                self._feed(dev, chunk)
+            except Exception as e:
+                if not failed.done():
+                    failed.set_exception(e)
+
+        self.loop.add_reader(fd, on_readable)
+        try:
+            await failed
+        finally:
+            self.loop.remove_reader(fd)
+
+    async def _read_blocking(self, dev, stop):
+        def read():
+            chunk = dev.port.read(1)
+            waiting = dev.port.in_waiting if chunk else 0
+            return chunk + dev.port.read(waiting) if waiting else chunk
+
+        dev.port.timeout = 0.5
+        while not stop.is_set():
+            chunk = await self.loop.run_in_executor(None, read)
+            if chunk:
+                self._feed(dev, chunk)
+
+    def _feed(self, dev, chunk):
+        t0 = time.perf_counter()
+        dev.m_bytes.inc(len(chunk))
+        now = time.time()
+        batch = dev.decoder.feed(chunk, now)
+        if batch is not None:
+            dev.m_parse.observe(time.perf_counter() - t0)
+            if batch:
+                dev.m_samples.inc(len(batch))
+                dev.last_sample_ts = now
+                if dev.state != 'live':
+                    self._live(dev)
+                if dev.rules:
+                    # vía rápida: antes que la analítica y la difusión
+                    dev.rules.evaluate(batch, t0)
+                dev.commands.observe(batch.servo)
+                self.on_batch(dev.name, batch)
+
+    def _live(self, dev):
+        if dev.state == 'connecting':
+            dev.backoff.reset()
+            dev.commands.write = dev.port.write
+            dev.commands.drain()
+        self._set_state(dev, 'live')
+
+    def _set_state(self, dev, state):
+        if dev.state == state:
+            return
+        dev.state = state
+        if self.on_state:
+            self.on_state(dev.name, state)
+
+    def _mark_down(self, dev, error):
+        dev.errors += 1
+        dev.last_error = str(error)
+        self._set_state(dev, 'down')
+
+    def _close(self, dev):
+        dev.commands.write = None
+        try:
+            if dev.port is not None:
+                dev.port.close()
+        except Exception:
+            pass
+        dev.port = None
@@ -0,0 +1,122 @@
+"""Reducción de series largas a un número fijo de puntos sin perder su forma.
+
+Las funciones devuelven *índices* crecientes, así se pueden aplicar a todas
+las columnas (tiempo, distancia, movimiento...) a la vez.
+
+- :func:`minmax_indices`: en cada cubo se quedan el mínimo y el máximo. Es
+  O(n) sin bucles de Python y no pierde ningún pico; es la que usa el
+  gráfico en vivo.
+- :func:`lttb_indices`: *Largest-Triangle-Three-Buckets*, un punto por cubo
+  eligiendo el que más área aporta. Da curvas más fieles a la vista con menos
+  puntos; se usa para el historial de la web.
+
+Con ``flags`` (la columna de movimiento) las muestras marcadas se conservan
+además del presupuesto; si son demasiadas, al menos el principio y el final
+de cada racha.
+"""
+import numpy as np
+
+METHODS = ('lttb', 'minmax')
+
+
+def _flag_indices(flags, budget):
+    """Índices de las muestras con movimiento.
+
+    Si son más que ``budget`` se quedan sólo el principio y el final de cada
+    racha, y si ni así caben, un subconjunto repartido de esos bordes.
+    """
+    flags = np.asarray(flags, dtype=bool)
+    idx = np.flatnonzero(flags)
+    if len(idx) <= budget:
+        return idx
+    edges = np.flatnonzero(np.diff(flags.astype(np.int8)))
+    # primera muestra de cada racha (diff +1 en i -> i+1) y última (diff -1 en i)
+    starts = edges[flags[edges + 1]] + 1
+    ends = edges[~flags[edges + 1]]
+    extra = [starts, ends]
+    if flags[0]:
+        extra.append([0])
+    if flags[-1]:
+        extra.append([len(flags) - 1])
+    idx = np.unique(np.concatenate(extra).astype(np.intp))
+    if len(idx) > budget:
+        idx = idx[np.linspace(0, len(idx) - 1, budget).astype(np.intp)]
+    return idx
+
+
+def _even_indices(n, n_out):
+    """``n_out`` índices repartidos (para presupuestos demasiado pequeños)."""
+    return np.unique(np.linspace(0, n - 1, max(0, n_out)).astype(np.intp))
+
+
+def minmax_indices(y, n_out):
+    """Mínimo y máximo de cada uno de ``n_out // 2`` cubos (más el primer y el último punto)."""
+    y = np.asarray(y)
+    n = len(y)
+    if n <= n_out:
+        return np.arange(n)
+    if n_out < 4:
+        return _even_indices(n, n_out)
+    buckets = (n_out - 2) // 2
+    size = -(-(n - 2) // buckets)  # techo
+    inner = y[1:n - 1]
+    pad = buckets * size - len(inner)
+    if pad:
+        inner = np.concatenate((inner, np.repeat(inner[-1:], pad)))
+    rows = inner.reshape(buckets, size)
+    base = np.arange(buckets) * size + 1
+    lo = base + rows.argmin(axis=1)
+    hi = base + rows.argmax(axis=1)
+    idx = np.concatenate(([0], lo, hi, [n - 1]))
+    return np.unique(np.minimum(idx, n - 1))
+
+
+def lttb_indices(x, y, n_out):
+    """Índices elegidos por LTTB (siempre incluye el primer y el último punto)."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= n_out:
+        return np.arange(n)
+    if n_out < 3:
+        return _even_indices(n, n_out)
+    # n_out - 2 cubos entre el primer y el último punto
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.intp)
+    # centroide de cada cubo (el "siguiente" del último cubo es el último punto)
+    counts = np.diff(edges)
+    avg_x = np.append(np.add.reduceat(x[:n - 1], edges[:-1]) / counts, x[-1])
+    avg_y = np.append(np.add.reduceat(y[:n - 1], edges[:-1]) / counts, y[-1])
+    out = np.empty(n_out, dtype=np.intp)
+    out[0] = 0
+    out[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        bx, by = x[lo:hi], y[lo:hi]
+        cx, cy = avg_x[i + 1], avg_y[i + 1]
+        # el doble del área del triángulo (a, b, c), sin el factor común
+        area = np.abs((x[a] - cx) * (by - y[a]) - (x[a] - bx) * (cy - y[a]))
+        a = lo + int(area.argmax())
+        out[i + 1] = a
+    return out
+
+
+def downsample(x, y, n_out, flags=None, method='lttb'):
+    """Índices para dibujar ``(x, y)`` con unos ``n_out`` puntos.
+
+    ``flags`` marca las muestras que deben conservarse siempre.
+    """
+    n = len(y)
+    if n <= n_out:
+        return np.arange(n)
+    if method == 'minmax':
+        idx = minmax_indices(y, n_out)
+    elif method == 'lttb':
+        idx = lttb_indices(x, y, n_out)
+    else:
+        raise ValueError(f'método desconocido: {method!r} (usa {", ".join(METHODS)})')
+    if flags is not None:
+        keep = _flag_indices(flags, n_out)
+        if len(keep):
+            idx = np.union1d(idx, keep)
+    return idx
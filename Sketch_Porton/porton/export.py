@@ -0,0 +1,73 @@
+"""Exportación del historial crudo en CSV o NDJSON, en streaming.
+
+:func:`export_chunks` convierte las filas de
+:meth:`porton.store.SampleStore.iter_samples` en trozos de unos
+``CHUNK_BYTES`` (comprimidos con gzip si se pide) para una respuesta HTTP
+troceada. Todo son generadores: ni las filas ni el archivo completo llegan
+a estar en memoria. Si el cliente se desconecta, el servidor cierra el
+generador y la consulta se abandona en la página en curso.
+"""
+import json
+import zlib
+
+from .frames import NO_SERVO
+from .metrics import REGISTRY
+
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+CSV_HEADER = 'device,ts,dist,mov,servo\n'
+# Tamaño aproximado de cada trozo de la respuesta (antes de comprimir)
+CHUNK_BYTES = 64 * 1024
+
+ROWS = REGISTRY.counter('porton_export_rows_total', 'Muestras enviadas por /api/export', ('format',))
+CANCELLED = REGISTRY.counter('porton_export_cancelled_total', 'Exportaciones cortadas porque el cliente se fue')
+
+
+def _csv_line(device, ts, dist, mov, servo):
+    return f'{device},{ts:.3f},{dist},{mov},{"" if servo == NO_SERVO else servo}\n'
+
+
+def _ndjson_line(device, ts, dist, mov, servo):
+    sample = {'device': device, 'ts': round(ts, 3), 'dist': dist, 'mov': mov}
+    if servo != NO_SERVO:
+        sample['servo'] = servo
+    return json.dumps(sample, separators=(',', ':')) + '\n'
+
+
+def export_chunks(rows, fmt, compress=False, chunk_bytes=CHUNK_BYTES):
+    """Trozos ``bytes`` de ``rows`` en formato ``fmt`` (``csv`` o ``ndjson``)."""
+    line = _csv_line if fmt == 'csv' else _ndjson_line
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31: cabecera gzip
+    m_rows = ROWS.labels(fmt)
+    parts = [CSV_HEADER] if fmt == 'csv' else []
+    size = n = 0
+    done = False
+    try:
+        for row in rows:
+            text = line(*row)
+            parts.append(text)
+            size += len(text)
+            n += 1
+            if size >= chunk_bytes:
+                data = ''.join(parts).encode('utf-8')
+                parts, size = [], 0
+                m_rows.inc(n)
+                n = 0
+                if gz is not None:
+                    data = gz.compress(data)
+                    if not data:
+                        continue  # zlib aún lo guarda en su ventana
+                yield data
+        data = ''.join(parts).encode('utf-8')
+        m_rows.inc(n)
+        if gz is not None:
+            data = gz.compress(data) + gz.flush()
+        if data:
+            yield data
+        done = True
+    finally:
+        if not done:
+            CANCELLED.inc()
+        # cierra el generador de filas (y su conexión) aunque no se haya agotado
+        close = getattr(rows, 'close', None)
+        if close:
+            close()
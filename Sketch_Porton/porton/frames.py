@@ -0,0 +1,89 @@
+"""Parser único de las tramas de telemetría del Arduino.
+
+Formato: ``D:<dist>,M:<0|1>[,S:<servo>]`` terminado en ``\\n`` (``\\r\\n`` también
+vale), con el servo entre 0 y ``SERVO_MAX``. El parser trabaja directamente
+sobre ``bytes``/``memoryview`` y decodifica un bloque entero de tramas en una
+sola pasada de una expresión regular compilada, guardando el resultado en
+columnas ``array('i')`` en vez de crear un ``str`` por línea.
+"""
+import re
+from array import array
+
+# Valor de la columna servo cuando la trama no trae ``S:``
+NO_SERVO = -1
+# Ángulo máximo del servo; un ``S:`` fuera de 0..SERVO_MAX es una trama corrupta
+SERVO_MAX = 180
+
+_FRAME_RE = re.compile(
+    rb'^(?:D:(-?\d{1,9}),M:([01])(?:,S:(-?\d{1,9}))?\r?$'  # trama válida
+    rb'|(D:[^\n]*)'                                        # trama corrupta
+    rb'|[^\n]+)',                                          # otra línea (p. ej. "OK 90")
+    re.M)
+
+
+class FrameBatch:
+    """Lote de muestras en columnas paralelas ``dist``/``mov``/``servo``."""
+
+    __slots__ = ('dist', 'mov', 'servo', 'ts')
+
+    def __init__(self, ts=0.0):
+        self.dist = array('i')
+        self.mov = array('i')
+        self.servo = array('i')
+        # instante (time.time()) en que se leyó el bloque
+        self.ts = ts
+
+    def __len__(self):
+        return len(self.dist)
+
+    def __iter__(self):
+        return zip(self.dist, self.mov, self.servo)
+
+    def append(self, dist, mov, servo=NO_SERVO):
+        self.dist.append(dist)
+        self.mov.append(mov)
+        self.servo.append(servo)
+
+    def last(self):
+        """Última muestra ``(dist, mov, servo)`` del lote."""
+        return self.dist[-1], self.mov[-1], self.servo[-1]
+
+
+class FrameParser:
+    """Decodifica bloques de tramas y lleva la cuenta de las corruptas.
+
+    ``frames`` cuenta las tramas válidas, ``malformed`` las que empiezan por
+    ``D:`` pero no cumplen el formato e ``ignored`` el resto de líneas no
+    vacías (respuestas del sketch, mensajes de arranque...).
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self.malformed = 0
+        self.ignored = 0
+
+    def parse(self, buf, ts=0.0):
+        """Decodifica todas las líneas completas de ``buf`` en un :class:`FrameBatch`."""
+        batch = FrameBatch(ts)
+        dist, mov, servo = batch.dist, batch.mov, batch.servo
+        ignored = malformed = 0
+        for d, m, s, bad in _FRAME_RE.findall(buf):
+            if d:
+                angle = int(s) if s else NO_SERVO
+                if not (0 <= angle <= SERVO_MAX or angle == NO_SERVO):
+                    malformed += 1
+                    continue
+                dist.append(int(d))
+                mov.append(m == b'1')
+                servo.append(angle)
+            elif bad:
+                malformed += 1
+            else:
+                ignored += 1
+        self.frames += len(dist)
+        self.malformed += malformed
+        self.ignored += ignored
+        return batch
+
+    def stats(self):
+        return {'frames': self.frames, 'malformed': self.malformed, 'ignored': self.ignored}
@@ -0,0 +1,241 @@
+"""Ingesta serie orientada a eventos.
+
+En lugar de sondear ``in_waiting`` cada 10 ms y leer línea a línea, el lector
+bloquea sobre el descriptor del puerto (``selectors``) y, cuando hay datos, los
+lee todos con un único ``read()``. Las tramas completas del bloque se
+decodifican de una vez (:class:`FrameDecoder`, en texto o binarias según lo
+que mande el Arduino); lo que llegue a medias se guarda para la siguiente
+lectura.
+
+Funciona igual con un ``serial.Serial`` que con un pseudo-terminal (pty) que
+haga de Arduino, envuelto en :class:`FdPort`.
+"""
+import io
+import os
+import selectors
+import struct
+import time
+
+try:  # sólo POSIX; en Windows pyserial usa el camino bloqueante
+    import fcntl
+    import termios
+except ImportError:
+    fcntl = termios = None
+
+from .binframe import DELIMITER as BINARY_DELIMITER, BinaryFrameParser
+from .frames import FrameParser
+
+# Si se acumula más que esto sin ver un fin de trama, es basura: se descarta
+MAX_PENDING = 4096
+# Tramas de texto seguidas (sin binarias válidas) para dejar el protocolo binario
+TEXT_FALLBACK = 3
+# Bytes que pueden ir en una línea de texto; cualquier otro es de una trama binaria
+_TEXT_BYTES = bytes(range(0x20, 0x7F)) + b'\r\n'
+
+
+class FdPort:
+    """Adaptador mínimo con la interfaz de ``serial.Serial`` sobre un descriptor.
+
+    Pensado para pruebas con un pty: ``FdPort(master_fd)``.
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.is_open = True
+
+    def fileno(self):
+        return self.fd
+
+    @property
+    def in_waiting(self):
+        buf = fcntl.ioctl(self.fd, termios.FIONREAD, b'\0\0\0\0')
+        return struct.unpack('i', buf)[0]
+
+    def read(self, size=1):
+        return os.read(self.fd, size)
+
+    def write(self, data):
+        return os.write(self.fd, data)
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            os.close(self.fd)
+
+
+class LineSplitter:
+    """Acumula bytes y entrega sólo el bloque de tramas completas (terminadas en ``sep``)."""
+
+    def __init__(self, max_pending=MAX_PENDING, sep=b'\n'):
+        self.max_pending = max_pending
+        self.sep = sep
+        self._pending = bytearray()
+
+    def feed(self, chunk):
+        """Devuelve las tramas completas (terminadas en ``sep``) o ``b''``.
+
+        Si no había nada pendiente el bloque es una ``memoryview`` sobre
+        ``chunk``, sin copia.
+        """
+        end = chunk.rfind(self.sep)
+        if end < 0:
+            self._pending += chunk
+            if len(self._pending) > self.max_pending:
+                self._pending.clear()
+            return b''
+        view = memoryview(chunk)
+        if self._pending:
+            self._pending += view[:end + 1]
+            block = bytes(self._pending)
+            self._pending[:] = view[end + 1:]
+            return block
+        self._pending += view[end + 1:]
+        return view[:end + 1]
+
+    def reset(self):
+        self._pending.clear()
+
+
+class FrameDecoder:
+    """Separa y decodifica las tramas de un puerto, de texto o binarias.
+
+    El protocolo se detecta solo: el texto (``D:..,M:..\\n``) nunca lleva
+    bytes nulos y el binario (:mod:`porton.binframe`) termina cada trama en
+    ``0x00``. Se decodifica como texto hasta que llega una trama binaria que
+    pasa el CRC; un ``0x00`` suelto (ruido al arrancar) no basta. Si estando
+    en binario sólo llegan líneas de texto válidas (``TEXT_FALLBACK`` tramas
+    seguidas sin ninguna binaria), se vuelve a texto.
+    """
+
+    def __init__(self, parser=None, max_pending=MAX_PENDING):
+        self.text = parser or FrameParser()
+        self.binary = BinaryFrameParser()
+        self.protocol = None
+        self._lines = LineSplitter(max_pending)
+        self._records = LineSplitter(max_pending, sep=BINARY_DELIMITER)
+        self._text_run = 0
+
+    def feed(self, chunk, ts=0.0):
+        """Añade ``chunk`` y devuelve un :class:`porton.frames.FrameBatch` con lo completo (o ``None``)."""
+        # los dos separadores ven todos los bytes: así no se pierde la primera
+        # trama de un protocolo que aún no se ha detectado
+        lines = self._lines.feed(chunk)
+        records = self._records.feed(chunk)
+        if records:
+            batch = self.binary.parse(records, ts)
+            if batch:
+                self.protocol = 'binary'
+                self._text_run = 0
+                return batch
+        if not lines:
+            return None
+        if self.protocol != 'binary':
+            batch = self.text.parse(lines, ts)
+            if batch and self.protocol is None:
+                self.protocol = 'text'
+            return batch
+        # ``lines`` puede ser una memoryview, y ``in`` sobre ella compara enteros
+        if bytes(lines).translate(None, _TEXT_BYTES):
+            return None  # trozo de trama binaria que contiene un 0x0A
+        batch = self.text.parse(lines, ts)
+        self._text_run += len(batch)
+        if self._text_run < TEXT_FALLBACK:
+            return None
+        self.protocol = 'text'
+        self._text_run = 0
+        self.binary.reset()
+        return batch
+
+    def reset(self):
+        self.protocol = None
+        self._text_run = 0
+        self._lines.reset()
+        self._records.reset()
+        self.binary.reset()
+
+    @property
+    def malformed(self):
+        return self.text.malformed + self.binary.malformed
+
+    def stats(self):
+        """Contadores de los dos protocolos y la tasa de errores de CRC de las binarias."""
+        binary = self.binary
+        checked = binary.frames + binary.crc_errors
+        return {
+            'protocol': self.protocol,
+            'frames': self.text.frames + binary.frames,
+            'malformed': self.malformed,
+            'ignored': self.text.ignored + binary.ignored,
+            'crc_errors': binary.crc_errors,
+            'crc_error_rate': round(binary.crc_errors / checked, 6) if checked else 0.0,
+            'lost': binary.lost,
+        }
+
+
+def _fileno(port):
+    try:
+        return port.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+
+class SerialIngest:
+    """Lector de un puerto que entrega lotes de muestras a ``on_batch``.
+
+    ``on_batch`` recibe un :class:`porton.frames.FrameBatch` por cada
+    ``read()`` que complete al menos una trama válida; antes, si hay
+    ``rules`` (:class:`porton.rules.RuleEngine`), se evalúan sobre el lote.
+    ``run`` termina cuando se activa ``stop`` y propaga los errores del
+    puerto (``OSError``/``SerialException``) para que quien lo llama decida
+    si reconectar.
+    """
+
+    def __init__(self, port, on_batch, parser=None, poll_timeout=0.5, rules=None):
+        self.port = port
+        self.on_batch = on_batch
+        self.rules = rules
+        self.decoder = FrameDecoder(parser)
+        self.parser = self.decoder.text
+        self.poll_timeout = poll_timeout
+
+    def run(self, stop):
+        fd = _fileno(self.port)
+        if fd is None:
+            self._run_blocking(stop)
+        else:
+            self._run_selector(stop, fd)
+
+    def _run_selector(self, stop, fd):
+        sel = selectors.DefaultSelector()
+        sel.register(fd, selectors.EVENT_READ)
+        try:
+            while not stop.is_set():
+                if not sel.select(self.poll_timeout):
+                    continue
+                chunk = self.port.read(self.port.in_waiting or 1)
+                if not chunk:
+                    raise ConnectionError('el puerto se cerró')
+                self._dispatch(chunk)
+        finally:
+            sel.close()
+
+    def _run_blocking(self, stop):
+        # Puertos sin descriptor (p. ej. pyserial en Windows): read(1) bloquea
+        # en el driver hasta el primer byte o el timeout del puerto, y luego
+        # se recoge de una vez todo lo que ya esté en el buffer.
+        while not stop.is_set():
+            chunk = self.port.read(1)
+            if not chunk:
+                continue
+            waiting = self.port.in_waiting
+            if waiting:
+                chunk += self.port.read(waiting)
+            self._dispatch(chunk)
+
+    def _dispatch(self, chunk):
+        t0 = time.perf_counter()
+        batch = self.decoder.feed(chunk, time.time())
+        if batch:
+            if self.rules:
+                self.rules.evaluate(batch, t0)
+            self.on_batch(batch)
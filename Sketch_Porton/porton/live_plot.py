@@ -0,0 +1,164 @@
+"""Gráfico en vivo del dashboard con artistas persistentes y blitting.
+
+Los artistas (línea, relleno, marcadores de movimiento) se crean una sola vez y
+sólo se les cambian los datos. El fondo de los ejes (títulos, rejilla, ticks)
+se guarda tras un dibujado completo y en cada frame se restaura y se pintan
+encima los artistas animados. El dibujado completo sólo ocurre al
+redimensionar o cuando hay que cambiar la escala Y.
+"""
+import time
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+from .chart_style import create_artists, style_axes, y_top
+from .downsample import downsample
+
+# Puntos a dibujar mientras no se conoce el ancho de los ejes; después, uno por
+# píxel: por encima se reduce (min/max por cubo) antes de dibujar
+MAX_POINTS = 300
+
+
+class LivePlot:
+    """Historial de distancia en un ``FigureCanvasTkAgg`` con blitting.
+
+    ``append``/``extend`` sólo mueven datos dentro de arrays preasignados;
+    ``render`` pinta como mucho ``max_fps`` veces por segundo. Un historial
+    más largo que el ancho del gráfico se reduce a ``max_points`` (el ancho
+    de los ejes en píxeles) sin perder picos ni muestras con movimiento.
+    """
+
+    def __init__(self, master, style_config, history_size, font_family, max_fps=30):
+        self.cfg = style_config
+        self.history_size = history_size
+        self.min_interval = 1.0 / max_fps
+        self._last_render = 0.0
+        self._render_pending = False
+        self._bg = None
+        self.max_points = MAX_POINTS
+
+        # --- Historial en arrays (el más reciente al final) ---
+        self.xs = np.arange(-history_size + 1, 1, dtype=float)
+        self.ys = np.zeros(history_size)
+        self.mov = np.zeros(history_size, dtype=bool)
+        self.n = 0
+        self._verts = np.zeros((history_size + 2, 2))
+
+        # --- Figura y estilo (una sola vez) ---
+        cfg = style_config
+        self.fig = Figure(figsize=(5, 5), dpi=100, facecolor=cfg['frame'])
+        self.ax = self.fig.add_subplot(111, facecolor=cfg['plot_bg'])
+        style_axes(self.ax, cfg, font_family, history_size)
+
+        # --- Artistas persistentes ---
+        (self.fill, self.line, self.scatter,
+         self.legend, self.waiting) = create_artists(self.ax, cfg, font_family, self._verts[:2], animated=True)
+        self.fig.tight_layout()
+
+        self.canvas = FigureCanvasTkAgg(self.fig, master=master)
+        self.widget = self.canvas.get_tk_widget()
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+        self.canvas.draw()
+
+    # --- Datos ---
+    def append(self, dist, mov):
+        """Añade una muestra desplazando el historial en su sitio."""
+        self.ys[:-1] = self.ys[1:]
+        self.mov[:-1] = self.mov[1:]
+        self.ys[-1] = dist
+        self.mov[-1] = mov
+        if self.n < self.history_size:
+            self.n += 1
+
+    def extend(self, dists, movs):
+        """Añade varias muestras de golpe (secuencias de igual longitud)."""
+        k = len(dists)
+        if k >= self.history_size:
+            self.ys[:] = dists[-self.history_size:]
+            self.mov[:] = movs[-self.history_size:]
+            self.n = self.history_size
+            return
+        if k == 0:
+            return
+        self.ys[:-k] = self.ys[k:]
+        self.mov[:-k] = self.mov[k:]
+        self.ys[-k:] = dists
+        self.mov[-k:] = movs
+        self.n = min(self.history_size, self.n + k)
+
+    # --- Dibujado ---
+    def render(self):
+        """Pinta el estado actual respetando el límite de FPS."""
+        now = time.perf_counter()
+        wait = self.min_interval - (now - self._last_render)
+        if wait > 0:
+            if not self._render_pending:
+                self._render_pending = True
+                self.widget.after(int(wait * 1000) + 1, self._deferred_render)
+            return
+        self._last_render = now
+
+        full = self._update_artists()
+        if full or self._bg is None:
+            self.canvas.draw()
+            return
+        self.canvas.restore_region(self._bg)
+        self._draw_animated()
+        self.canvas.blit(self.ax.bbox)
+
+    def _deferred_render(self):
+        self._render_pending = False
+        self.render()
+
+    def _update_artists(self):
+        """Actualiza los datos de los artistas; True si hace falta un redibujado completo."""
+        n = self.n
+        full = False
+        if n == 0:
+            return False
+        if self.waiting.get_visible():
+            self.waiting.set_visible(False)
+            full = True
+
+        xs, ys, flags = self.xs[-n:], self.ys[-n:], self.mov[-n:]
+        if n > self.max_points:
+            # mínimo y máximo por cubo: los picos y el movimiento no se pierden
+            idx = downsample(xs, ys, self.max_points, flags, method='minmax')
+            xs, ys, flags = xs[idx], ys[idx], flags[idx]
+        self.line.set_data(xs, ys)
+
+        verts = self._verts
+        m = len(xs)
+        verts[1:m + 1, 0] = xs
+        verts[1:m + 1, 1] = ys
+        verts[0] = (xs[0], 0)
+        verts[m + 1] = (xs[-1], 0)
+        self.fill.set_xy(verts[:m + 2])
+
+        self.scatter.set_offsets(np.column_stack((xs[flags], ys[flags])))
+        if self.legend.get_visible() != bool(flags.any()):
+            self.legend.set_visible(not self.legend.get_visible())
+            full = True
+
+        # Escala Y con margen; sólo se reescala si los datos se salen o
+        # quedan muy por debajo del límite actual
+        max_y = ys.max()
+        top = y_top(max_y)
+        _, cur_top = self.ax.get_ylim()
+        if max_y > cur_top or top < cur_top * 0.5:
+            self.ax.set_ylim(0, top)
+            full = True
+        return full
+
+    def _draw_animated(self):
+        self.ax.draw_artist(self.fill)
+        self.ax.draw_artist(self.line)
+        self.ax.draw_artist(self.scatter)
+
+    def _on_draw(self, event):
+        # Tras un dibujado completo (inicio, resize, reescalado) se guarda el
+        # fondo sin artistas animados y se pintan éstos encima
+        self._bg = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.max_points = max(MAX_POINTS // 3, int(self.ax.bbox.width))
+        self._draw_animated()
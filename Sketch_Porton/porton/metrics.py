@@ -0,0 +1,245 @@
+"""Métricas de bajo coste en formato de texto de Prometheus.
+
+Los contadores e histogramas no usan locks en el camino caliente: cada hilo
+incrementa su propia celda (``threading.local``) y sólo al exportar se suman
+todas. El lock sólo se toma la primera vez que un hilo usa una métrica. Cuando
+un hilo (o greenlet) termina, su celda se suma a una base común y se descarta,
+así los hilos de peticiones no van dejando celdas detrás.
+
+Para valores que ya se cuentan en otro sitio (contadores del parser, tamaño
+de colas...) se registran funciones que se evalúan al exportar.
+"""
+import bisect
+import threading
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Cubos por defecto para latencias, en segundos
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    inner = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+    return '{' + inner + '}'
+
+
+class _Owner:
+    """Se guarda en el ``threading.local``: se recoge cuando termina su hilo."""
+
+    __slots__ = ('__weakref__',)
+
+
+class _PerThread:
+    """Celdas por hilo; ``_new_cell`` devuelve una lista mutable."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._cells = []
+        # celdas de hilos terminados, pendientes de sumar a _base
+        self._dead = []
+        self._base = self._new_cell()
+        self._lock = threading.Lock()
+
+    def _cell(self):
+        cell = getattr(self._local, 'cell', None)
+        if cell is None:
+            cell = self._new_cell()
+            owner = _Owner()
+            # el finalizador puede correr dentro de cualquier recolección, con
+            # el lock tomado: sólo apunta la celda y se suma en _reap
+            weakref.finalize(owner, self._dead.append, cell).atexit = False
+            with self._lock:
+                self._reap()
+                self._cells.append(cell)
+            self._local.owner = owner
+            self._local.cell = cell
+        return cell
+
+    def _reap(self):
+        """Suma a ``_base`` las celdas de los hilos terminados (con el lock tomado)."""
+        base = self._base
+        while self._dead:
+            cell = self._dead.pop()
+            self._cells.remove(cell)
+            for i, v in enumerate(cell):
+                base[i] += v
+
+    def _totals(self):
+        """Suma elemento a elemento de todas las celdas."""
+        with self._lock:
+            self._reap()
+            totals = list(self._base)
+            for cell in self._cells:
+                for i, v in enumerate(cell):
+                    totals[i] += v
+        return totals
+
+
+class _CounterChild(_PerThread):
+    def _new_cell(self):
+        return [0]
+
+    def inc(self, amount=1):
+        self._cell()[0] += amount
+
+    def value(self):
+        return self._totals()[0]
+
+
+class _HistogramChild(_PerThread):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        super().__init__()
+
+    def _new_cell(self):
+        # [cubo_0, ..., cubo_n, +Inf, suma]
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, value):
+        cell = self._cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def snapshot(self):
+        totals = self._totals()
+        return totals[:-1], totals[-1]
+
+
+class _Family:
+    kind = None
+
+    def __init__(self, name, doc, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values, **kw):
+        """Hijo para unos valores de etiqueta; guárdalo para no buscarlo en cada uso."""
+        if kw:
+            values = tuple(kw[n] for n in self.labelnames)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._make_child())
+        return child
+
+    def header(self):
+        return [f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Family):
+    kind = 'counter'
+
+    def _make_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def render(self):
+        lines = self.header()
+        for values, child in list(self._children.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, values)} {child.value()}')
+        return lines
+
+
+class Histogram(_Family):
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, doc, labelnames)
+
+    def _make_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def render(self):
+        lines = self.header()
+        for values, child in list(self._children.items()):
+            counts, total = child.snapshot()
+            acc = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                acc += count
+                labels = _format_labels(self.labelnames, values, [('le', bound)])
+                lines.append(f'{self.name}_bucket{labels} {acc}')
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {acc}')
+        return lines
+
+
+class Callback:
+    """Métrica calculada al exportar: ``fn()`` devuelve ``[(labels_dict, valor), ...]``."""
+
+    def __init__(self, name, doc, kind, fn):
+        self.name = name
+        self.doc = doc
+        self.kind = kind
+        self.fn = fn
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} {self.kind}']
+        for labels, value in self.fn():
+            lines.append(f'{self.name}{_format_labels(labels.keys(), labels.values())} {value}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, doc, labelnames=()):
+        return self._add(Counter(name, doc, labelnames))
+
+    def histogram(self, name, doc, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, doc, labelnames, buckets))
+
+    def callback(self, name, doc, kind, fn):
+        """Registra (o sustituye) una métrica calculada; ``kind`` es 'gauge' o 'counter'."""
+        return self._add(Callback(name, doc, kind, fn))
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics.values()):
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                # una métrica rota no debe tumbar el endpoint entero
+                continue
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def serve(port, host='0.0.0.0', registry=REGISTRY):
+    """Sirve ``/metrics`` en un hilo, para procesos sin servidor web (la ingesta)."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,237 @@
+"""Grabación y reproducción de los bytes crudos de un puerto serie.
+
+Formato del archivo (``.prec``, little-endian):
+
+- Cabecera de 16 bytes: ``b'PREC'``, versión (uint8), 3 bytes de relleno y
+  el instante de inicio (float64, segundos epoch).
+- Un registro por ``read()``: microsegundos desde el registro anterior
+  (uint32, reloj monotónico), longitud (uint16) y los bytes leídos.
+
+Se graba tal cual lo que devuelve el puerto, así que la reproducción conserva
+las ráfagas y las tramas cortadas a medias que produce el hardware real.
+"""
+import io
+import os
+import struct
+import threading
+import time
+
+MAGIC = b'PREC'
+VERSION = 1
+HEADER = struct.Struct('<4sBxxxd')
+RECORD = struct.Struct('<IH')
+MAX_CHUNK = 0xFFFF
+MAX_DELTA_US = 0xFFFFFFFF
+EXTENSION = '.prec'
+
+
+class Recorder:
+    """Escribe los trozos leídos de un puerto con su marca de tiempo."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, time.time()))
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self.bytes = 0
+
+    def write(self, chunk):
+        if not chunk:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delta = int((now - self._last) * 1_000_000)
+            self._last = now
+            # un hueco de más de ~71 min se parte en registros vacíos
+            while delta > MAX_DELTA_US:
+                self._file.write(RECORD.pack(MAX_DELTA_US, 0))
+                delta -= MAX_DELTA_US
+            view = memoryview(chunk)
+            for off in range(0, len(view), MAX_CHUNK):
+                part = view[off:off + MAX_CHUNK]
+                self._file.write(RECORD.pack(delta, len(part)))
+                self._file.write(part)
+                delta = 0
+            self.bytes += len(view)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class RecordingPort:
+    """Envuelve un puerto y graba todo lo que se lee de él.
+
+    El resto de atributos (``fileno``, ``in_waiting``, ``write``...) pasan al
+    puerto original.
+    """
+
+    def __init__(self, port, recorder):
+        object.__setattr__(self, '_port', port)
+        object.__setattr__(self, 'recorder', recorder)
+
+    def __getattr__(self, name):
+        return getattr(self._port, name)
+
+    def __setattr__(self, name, value):
+        # p. ej. ``port.timeout = 0.5`` debe llegar al puerto real
+        setattr(self._port, name, value)
+
+    def read(self, size=1):
+        chunk = self._port.read(size)
+        self.recorder.write(chunk)
+        return chunk
+
+    def close(self):
+        try:
+            self._port.close()
+        finally:
+            self.recorder.close()
+
+
+def recording_path(directory, name):
+    """``<directory>/<name>-AAAAMMDD-HHMMSS.prec``"""
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    return os.path.join(directory, f'{name}-{stamp}{EXTENSION}')
+
+
+def recording_opener(opener, directory, name_of=os.path.basename):
+    """Adapta un ``opener(port, baud)`` para que cada apertura se grabe en ``directory``."""
+    def open_and_record(port, baud):
+        os.makedirs(directory, exist_ok=True)
+        recorder = Recorder(recording_path(directory, name_of(port)))
+        try:
+            return RecordingPort(opener(port, baud), recorder)
+        except Exception:
+            recorder.close()
+            os.remove(recorder.path)
+            raise
+    return open_and_record
+
+
+def read_recording(path):
+    """Devuelve ``(inicio_epoch, registros)``.
+
+    ``registros`` es un generador de ``(segundos_desde_inicio, bytes)`` que
+    lee el archivo registro a registro: una grabación de un día no se carga
+    entera en memoria. El archivo se cierra al agotarlo o al cerrarlo.
+    """
+    f = open(path, 'rb')
+    try:
+        magic, version, start = HEADER.unpack(f.read(HEADER.size))
+    except struct.error:
+        magic = version = None
+    if magic != MAGIC or version != VERSION:
+        f.close()
+        raise ValueError(f'{path} no es una grabación válida')
+    return start, _iter_records(f)
+
+
+def _iter_records(f):
+    t = 0.0
+    try:
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            delta, n = RECORD.unpack(head)
+            t += delta / 1_000_000
+            if n:
+                chunk = f.read(n)
+                if chunk:
+                    yield t, chunk
+                if len(chunk) < n:
+                    return  # grabación cortada a medias
+    finally:
+        f.close()
+
+
+def parse_speed(value):
+    """``'1'``, ``'10'``, ``'10x'`` o ``'max'`` -> factor (0 = lo más rápido posible)."""
+    value = str(value).strip().lower()
+    if value in ('max', 'inf', '0', ''):
+        return 0.0
+    return float(value[:-1] if value.endswith('x') else value)
+
+
+class ReplayPort:
+    """Sustituto de ``serial.Serial`` que reproduce una grabación.
+
+    Un hilo va leyendo los registros del archivo y los escribe en una tubería
+    respetando los tiempos originales divididos por ``speed`` (``0`` = sin
+    esperas; la tubería llena frena al escritor, así que la memoria no crece
+    con la duración de la grabación). La lectura tiene la misma interfaz que un puerto: en
+    POSIX expone ``fileno()`` para ``selectors``/``add_reader``.
+
+    Al terminar la grabación ``read`` lanza ``ConnectionError``, igual que un
+    Arduino desconectado; quien reabra el puerto la vuelve a reproducir.
+    """
+
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        self.speed = speed
+        self.timeout = None
+        self.is_open = True
+        self._start, self._records = read_recording(path)
+        self._rfd, self._wfd = os.pipe()
+        self._written = 0
+        self._consumed = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._feed, daemon=True)
+        self._thread.start()
+
+    def _feed(self):
+        t0 = time.monotonic()
+        try:
+            for t, chunk in self._records:
+                if self.speed:
+                    wait = t0 + t / self.speed - time.monotonic()
+                    if wait > 0 and self._stop.wait(wait):
+                        break
+                if self._stop.is_set():
+                    break
+                os.write(self._wfd, chunk)
+                self._written += len(chunk)
+        except OSError:
+            pass
+        finally:
+            self._records.close()
+            # el lector ve EOF
+            os.close(self._wfd)
+
+    def fileno(self):
+        if os.name == 'nt':
+            # select() en Windows sólo admite sockets: usar la lectura bloqueante
+            raise io.UnsupportedOperation('fileno')
+        return self._rfd
+
+    @property
+    def in_waiting(self):
+        return max(0, self._written - self._consumed)
+
+    def read(self, size=1):
+        chunk = os.read(self._rfd, size)
+        if not chunk and size:
+            raise ConnectionError('fin de la grabación')
+        self._consumed += len(chunk)
+        return chunk
+
+    def write(self, data):
+        # el portón grabado no recibe comandos
+        return len(data)
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            self._stop.set()
+            self._thread.join(timeout=1)
+            os.close(self._rfd)
+
+
+def replay_opener(speed=1.0):
+    """``opener(port, baud)`` para :class:`porton.devices.DeviceRegistry` que reproduce grabaciones."""
+    def open_replay(path, baud):
+        return ReplayPort(path, speed)
+    return open_replay
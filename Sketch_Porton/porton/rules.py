@@ -0,0 +1,224 @@
+"""Reglas de seguridad evaluadas en la ingesta, con vía prioritaria al servo.
+
+Una regla es una condición sobre cada muestra y el ángulo al que mandar el
+servo cuando se cumple. Se cargan de un JSON::
+
+    [{"name": "obstaculo", "when": "dist < 30 and closing", "servo": 180,
+      "cooldown": 1.0, "hold": 2.0}]
+
+- ``when``: expresión sobre ``dist``, ``mov`` (0/1), ``servo`` (último ``S:``
+  visto, -1 si aún no hay), ``target`` (ángulo del comando en vuelo, -1 si
+  no hay), ``ddist`` y ``dservo`` (cm/s y grados/s respecto a la muestra
+  anterior), ``closing`` y ``opening`` (el servo baja/sube o va hacia un
+  comando menor/mayor). Admite ``and``/``or``/``not``, comparaciones,
+  aritmética, ``x if c else y`` y ``abs``/``min``/``max``.
+- ``servo``: ángulo, o expresión con las mismas variables (``"servo"`` lo
+  deja donde está).
+- ``cooldown``: segundos mínimos entre dos disparos (por defecto ``COOLDOWN``).
+- ``hold``: segundos durante los que se descartan los comandos de la
+  interfaz tras el disparo, para que nadie lo deshaga sin querer.
+
+Las expresiones se validan contra un AST restringido (sin atributos,
+subíndices, nombres desconocidos ni llamadas a otras funciones) y se
+compilan una vez a funciones de Python; evaluar una regla es una llamada.
+
+:class:`RuleEngine` se evalúa en el hilo que acaba de decodificar el lote,
+muestra a muestra, y al dispararse escribe el ángulo en el puerto con
+:meth:`porton.commands.CommandQueue.send_now`, sin pasar por la GUI, por
+Socket.IO ni por la cola de comandos. Mide cada disparo desde que
+``read()`` devolvió los bytes hasta que el comando está escrito
+(``porton_rule_actuate_seconds``) y cuenta los que superan ``DEADLINE``.
+"""
+import ast
+import json
+import time
+
+from .frames import NO_SERVO
+from .metrics import REGISTRY
+
+VARIABLES = ('dist', 'mov', 'servo', 'target', 'ddist', 'dservo', 'closing', 'opening')
+FUNCTIONS = {'abs': abs, 'min': min, 'max': max}
+# Argumentos admitidos por función (mínimo, máximo): todo son números sueltos,
+# así que ``min``/``max`` con uno solo esperarían un iterable y fallarían
+ARITY = {'abs': (1, 1), 'min': (2, None), 'max': (2, None)}
+COOLDOWN = 1.0
+# Límite de read() -> comando escrito; los disparos más lentos se cuentan aparte
+DEADLINE = 0.010
+
+_ALLOWED = (
+    ast.Expression, ast.Load, ast.Name, ast.Constant, ast.Call, ast.IfExp,
+    ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod,
+    ast.Compare, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq,
+)
+
+FIRES = REGISTRY.counter('porton_rule_fires_total', 'Disparos de reglas de seguridad', ('device', 'rule'))
+ACTUATE_SECONDS = REGISTRY.histogram('porton_rule_actuate_seconds',
+                                     'Tiempo desde read() hasta escribir el comando de una regla', ('device',))
+DEADLINE_MISSES = REGISTRY.counter('porton_rule_deadline_misses_total',
+                                   'Disparos de reglas que superaron el límite de latencia', ('device',))
+
+
+class RuleError(ValueError):
+    """Regla mal escrita; el mensaje dice cuál y por qué."""
+
+
+def compile_expression(source, name='<regla>'):
+    """Compila ``source`` a una función ``f(dist, mov, servo, ...)`` (ver ``VARIABLES``)."""
+    if isinstance(source, (int, float)):
+        source = repr(source)
+    try:
+        tree = ast.parse(source.strip(), mode='eval')
+    except SyntaxError as e:
+        raise RuleError(f'{name}: {e.msg}') from None
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED):
+            raise RuleError(f'{name}: no se admite {type(node).__name__}')
+        if isinstance(node, ast.Name) and node.id not in VARIABLES and node.id not in FUNCTIONS:
+            raise RuleError(f'{name}: variable desconocida {node.id!r}')
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+                raise RuleError(f'{name}: sólo se pueden llamar {", ".join(FUNCTIONS)}')
+            low, high = ARITY[node.func.id]
+            if len(node.args) < low or high is not None and len(node.args) > high:
+                raise RuleError(f'{name}: {node.func.id}() con {len(node.args)} argumentos')
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+            raise RuleError(f'{name}: sólo se admiten constantes numéricas')
+    # lambda dist, mov, ...: <expresión>, con las variables como locales rápidas
+    args = ast.arguments(posonlyargs=[], args=[ast.arg(v) for v in VARIABLES], vararg=None,
+                         kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[])
+    fn = ast.Expression(ast.Lambda(args, tree.body))
+    ast.fix_missing_locations(fn)
+    return eval(compile(fn, name, 'eval'), {'__builtins__': {}, **FUNCTIONS})
+
+
+class Rule:
+    """Una regla ya compilada; ``when``/``angle`` son funciones de las variables."""
+
+    def __init__(self, name, when, servo, cooldown=COOLDOWN, hold=0.0):
+        self.name = name
+        self.source = when
+        self.when = compile_expression(when, name)
+        self.angle = compile_expression(servo, name)
+        self.cooldown = float(cooldown)
+        self.hold = float(hold)
+
+
+def load_rules(spec):
+    """Reglas de una lista de dicts (o de su JSON, o de la ruta a un archivo JSON)."""
+    if isinstance(spec, str):
+        if spec.lstrip().startswith('['):
+            spec = json.loads(spec)
+        else:
+            with open(spec, encoding='utf-8') as f:
+                spec = json.load(f)
+    rules = []
+    for i, item in enumerate(spec):
+        name = item.get('name') or f'regla{i + 1}'
+        if 'when' not in item or 'servo' not in item:
+            raise RuleError(f'{name}: faltan "when" o "servo"')
+        rules.append(Rule(name, item['when'], item['servo'],
+                          item.get('cooldown', COOLDOWN), item.get('hold', 0.0)))
+    return rules
+
+
+class RuleEngine:
+    """Evalúa las reglas sobre las muestras de un portón y actúa sobre ``commands``.
+
+    Un motor por portón (guarda la muestra anterior para las derivadas); las
+    reglas compiladas se comparten. ``on_fire(info)`` se llama después de
+    escribir el comando, para avisar a la interfaz.
+    """
+
+    def __init__(self, device, rules, commands, deadline=DEADLINE, on_fire=None):
+        self.device = device
+        self.rules = list(rules)
+        self.commands = commands
+        self.deadline = deadline
+        self.on_fire = on_fire
+        self._last_fire = {}
+        self._dist = None
+        self._servo = NO_SERVO
+        self._ts = None
+        self.evaluated = 0
+        self.fired = 0
+        self.misses = 0
+        self.errors = 0
+        self.last = None
+        self.max_latency = 0.0
+        self.m_actuate = ACTUATE_SECONDS.labels(device)
+        self.m_misses = DEADLINE_MISSES.labels(device)
+        self.m_fires = {rule.name: FIRES.labels(device, rule.name) for rule in self.rules}
+
+    def evaluate(self, batch, t_read):
+        """Evalúa cada muestra de ``batch``; ``t_read`` es ``perf_counter()`` al volver ``read()``."""
+        if not self.rules:
+            return
+        n = len(batch)
+        # el lote sólo trae su instante: las muestras se reparten el intervalo
+        dt = (batch.ts - self._ts) / n if self._ts is not None and batch.ts > self._ts else 0.0
+        self._ts = batch.ts
+        last_dist, servo = self._dist, self._servo
+        commands = self.commands
+        for dist, mov, s in batch:
+            target = commands.target()
+            ddist = (dist - last_dist) / dt if dt and last_dist is not None else 0.0
+            dservo = 0.0
+            if s != NO_SERVO:
+                if dt and servo != NO_SERVO:
+                    dservo = (s - servo) / dt
+                servo = s
+            closing = dservo < 0 or 0 <= target < servo
+            opening = dservo > 0 or target > servo >= 0
+            values = (dist, mov, servo, target, ddist, dservo, closing, opening)
+            for rule in self.rules:
+                # una regla que falla (p. ej. una división por cero) no cuenta
+                # para esa muestra, pero no tumba el puerto ni las demás reglas
+                try:
+                    fire = rule.when(*values)
+                except Exception:
+                    self.errors += 1
+                    continue
+                if fire:
+                    self._fire(rule, values, t_read)
+            last_dist = dist
+        self._dist, self._servo = last_dist, servo
+        self.evaluated += n
+
+    def _fire(self, rule, values, t_read):
+        now = time.monotonic()
+        last = self._last_fire.get(rule.name)
+        if last is not None and now - last < rule.cooldown:
+            return
+        try:
+            angle = max(0, min(180, int(rule.angle(*values))))
+        except Exception:
+            self.errors += 1  # p. ej. un ángulo NaN
+            return
+        if not self.commands.send_now(angle, rule.hold):
+            return  # puerto cerrado
+        latency = time.perf_counter() - t_read
+        self._last_fire[rule.name] = now
+        self.fired += 1
+        self.m_fires[rule.name].inc()
+        self.m_actuate.observe(latency)
+        if latency > self.deadline:
+            self.misses += 1
+            self.m_misses.inc()
+        self.max_latency = max(self.max_latency, latency)
+        self.last = {'rule': rule.name, 'angle': angle, 'ts': time.time(),
+                     'latency_ms': round(latency * 1000, 3)}
+        if self.on_fire:
+            self.on_fire(dict(self.last, device=self.device))
+
+    def stats(self):
+        return {
+            'rules': [rule.name for rule in self.rules],
+            'evaluated': self.evaluated,
+            'fired': self.fired,
+            'deadline_ms': self.deadline * 1000,
+            'deadline_misses': self.misses,
+            'errors': self.errors,
+            'max_latency_ms': round(self.max_latency * 1000, 3),
+            'last': self.last,
+        }
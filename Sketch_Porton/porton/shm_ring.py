@@ -0,0 +1,323 @@
+"""Anillo en memoria compartida para que varios procesos lean un mismo puerto.
+
+Un puerto serie sólo lo puede abrir un proceso. El demonio de este módulo es
+su único dueño: decodifica las tramas y escribe cada muestra en un anillo de
+``multiprocessing.shared_memory`` por portón. ``dashboard.py`` y la web se
+enganchan como lectores sin cerrojos y sin pasar por ningún socket::
+
+    python -m porton.shm_ring --ports COM4
+    MEMORIA_COMPARTIDA=COM4 python dashboard.py
+    SHM_RINGS=COM4 python web_app/app.py
+
+Disposición (little-endian):
+
+- Cabecera de 64 bytes: ``b'PRNG'``, versión (uint16), tamaño de registro
+  (uint16), capacidad (uint32), pid del escritor (uint32), ``head`` (uint64,
+  muestras publicadas), buzón de comandos (uint64) y latido del escritor
+  (float64, epoch).
+- ``capacity`` registros de 32 bytes: ``seq`` (uint64), ``ts`` (float64) y
+  ``dist``/``mov``/``servo`` (int32).
+
+La muestra número ``n`` (desde 1) vive en la ranura ``(n - 1) % capacity``
+con ``seq == n``. El escritor pone ``seq = 0`` antes de tocar una ranura y el
+número definitivo al terminar; el lector copia las ranuras y vuelve a leer
+``seq``: si no coincide con el esperado, el escritor le dio la vuelta
+mientras copiaba y esas muestras cuentan como perdidas (``lost``).
+
+Los lectores no escriben nada salvo el buzón: ``(contador << 16) | ángulo``.
+El demonio lo mira cada pocos milisegundos y manda el último ángulo al
+portón; como en :class:`porton.commands.CommandQueue`, sólo importa el último.
+"""
+import argparse
+import os
+import re
+import signal
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .frames import FrameBatch
+
+MAGIC = b'PRNG'
+VERSION = 1
+HEADER = struct.Struct('<4sHHII')
+HEADER_SIZE = 64
+_COUNTERS, _BEAT = 16, 32
+RECORD = np.dtype([('seq', '<u8'), ('ts', '<f8'), ('dist', '<i4'),
+                   ('mov', '<i4'), ('servo', '<i4'), ('_pad', '<i4')])
+# ~36 min de historia a 30 muestras/s; 2 MB por portón
+DEFAULT_CAPACITY = 65536
+PREFIX = 'porton_'
+# Espera del lector entre consultas cuando no hay muestras nuevas
+POLL_INTERVAL = 0.0005
+# Sin latido durante este tiempo el escritor se da por caído
+STALE_AFTER = 2.0
+
+
+def ring_name(device):
+    """Nombre del segmento de un portón: ``COM4`` -> ``porton_COM4``."""
+    return PREFIX + re.sub(r'[^A-Za-z0-9_.-]', '_', device)
+
+
+def _attach(name):
+    """Abre un segmento existente sin que este proceso lo borre al salir."""
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # Python < 3.13: el resource_tracker lo borraría al terminar el lector
+        shm = shared_memory.SharedMemory(name)
+        if os.name == 'posix':
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class _Ring:
+    """Vistas NumPy sobre un segmento; no copian nada."""
+
+    def _map(self, shm, capacity):
+        buf = shm.buf
+        self.shm = shm
+        self.capacity = capacity
+        self._counters = np.ndarray((2,), '<u8', buf, _COUNTERS)
+        self._beat = np.ndarray((1,), '<f8', buf, _BEAT)
+        self._records = np.ndarray((capacity,), RECORD, buf, HEADER_SIZE)
+
+    @property
+    def head(self):
+        return int(self._counters[0])
+
+    def _release(self):
+        # las vistas retienen el buffer: hay que soltarlas antes de cerrar
+        self._counters = self._beat = self._records = None
+        self.shm.close()
+
+
+class RingWriter(_Ring):
+    """Crea el anillo de ``device`` y publica lotes en él (un único hilo escritor)."""
+
+    def __init__(self, device, capacity=DEFAULT_CAPACITY):
+        self.device = device
+        name = ring_name(device)
+        try:
+            # segmento huérfano de un demonio anterior que murió sin limpiar
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name, create=True, size=HEADER_SIZE + capacity * RECORD.itemsize)
+        HEADER.pack_into(shm.buf, 0, MAGIC, VERSION, RECORD.itemsize, capacity, os.getpid())
+        self._map(shm, capacity)
+        self._counters[:] = 0
+        self._records['seq'] = 0
+        self._last_cmd = 0
+        self.beat()
+
+    def beat(self):
+        self._beat[0] = time.time()
+
+    def write_batch(self, batch):
+        """Copia un :class:`porton.frames.FrameBatch` al anillo y lo publica."""
+        n = len(batch)
+        if not n:
+            return
+        cap = self.capacity
+        dist = np.frombuffer(batch.dist, dtype=np.int32)
+        mov = np.frombuffer(batch.mov, dtype=np.int32)
+        servo = np.frombuffer(batch.servo, dtype=np.int32)
+        head = self.head
+        if n > cap:
+            # no cabe: las más viejas se dan por publicadas y perdidas
+            head += n - cap
+            dist, mov, servo = dist[-cap:], mov[-cap:], servo[-cap:]
+            n = cap
+        seqs = np.arange(head + 1, head + n + 1, dtype=np.uint64)
+        slots = (seqs - 1) % cap
+        recs = self._records
+        recs['seq'][slots] = 0
+        recs['ts'][slots] = batch.ts
+        recs['dist'][slots] = dist
+        recs['mov'][slots] = mov
+        recs['servo'][slots] = servo
+        recs['seq'][slots] = seqs
+        self._counters[0] = head + n
+        self.beat()
+
+    def poll_command(self):
+        """Último ángulo pedido por un lector desde la llamada anterior, o ``None``."""
+        cmd = int(self._counters[1])
+        if cmd == self._last_cmd:
+            return None
+        self._last_cmd = cmd
+        return cmd & 0xFFFF
+
+    def close(self):
+        shm = self.shm
+        self._release()
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class RingReader(_Ring):
+    """Lector sin cerrojos del anillo de ``device``.
+
+    Empieza en la muestra más reciente (``from_start=True`` para leer todo lo
+    que aún guarda el anillo). Además de ``read``/``run`` tiene ``write`` y
+    ``close`` como un puerto, así que puede sustituir a ``serial.Serial`` como
+    destino de :class:`porton.commands.CommandQueue`.
+    """
+
+    def __init__(self, device, from_start=False):
+        self.device = device
+        shm = _attach(ring_name(device))
+        magic, version, size, capacity, pid = HEADER.unpack_from(shm.buf, 0)
+        if magic != MAGIC or version != VERSION or size != RECORD.itemsize:
+            shm.close()
+            raise ValueError(f'{ring_name(device)} no es un anillo de porton v{VERSION}')
+        self.writer_pid = pid
+        self._map(shm, capacity)
+        self.pos = max(0, self.head - capacity) if from_start else self.head
+        self.lost = 0
+        self.is_open = True
+
+    def read(self, max_samples=None):
+        """Muestras nuevas como :class:`porton.frames.FrameBatch` (``None`` si no hay)."""
+        head = self.head
+        pos = self.pos
+        if head <= pos:
+            return None
+        cap = self.capacity
+        if head - pos > cap:
+            self.lost += head - cap - pos
+            pos = head - cap
+        n = head - pos
+        if max_samples:
+            n = min(n, max_samples)
+        expected = np.arange(pos + 1, pos + n + 1, dtype=np.uint64)
+        slots = (expected - 1) % cap
+        recs = self._records[slots]  # única copia
+        # seqlock: la ranura sigue siendo la que se copió
+        ok = (recs['seq'] == expected) & (self._records['seq'][slots] == expected)
+        self.pos = pos + n
+        if not ok.all():
+            self.lost += int(n - ok.sum())
+            recs = recs[ok]
+            if not len(recs):
+                return None
+        batch = FrameBatch(float(recs['ts'][-1]))
+        batch.dist.frombytes(recs['dist'].tobytes())
+        batch.mov.frombytes(recs['mov'].tobytes())
+        batch.servo.frombytes(recs['servo'].tobytes())
+        return batch
+
+    def run(self, stop, on_batch, interval=POLL_INTERVAL):
+        """Entrega cada lote nuevo a ``on_batch(batch)`` hasta ``stop``.
+
+        Lanza ``ConnectionError`` si el escritor deja de latir: un demonio
+        nuevo crea otro segmento y hay que volver a abrirlo.
+        """
+        while not stop.is_set():
+            batch = self.read()
+            if batch is not None:
+                on_batch(batch)
+            elif stop.wait(interval):
+                break
+            elif self.writer_age() > STALE_AFTER:
+                raise ConnectionError(f'{ring_name(self.device)}: el demonio no responde')
+
+    def writer_age(self):
+        """Segundos desde el último latido del escritor."""
+        return time.time() - float(self._beat[0])
+
+    def health(self):
+        age = self.writer_age()
+        head = self.head
+        last = None
+        if head:
+            last = round(time.time() - float(self._records['ts'][(head - 1) % self.capacity]), 3)
+        return {
+            'port': ring_name(self.device),
+            'state': 'live' if age < STALE_AFTER else 'stale',
+            'samples': head,
+            'lost': self.lost,
+            'writer_pid': self.writer_pid,
+            'writer_age_s': round(age, 3),
+            'last_sample_age_s': last,
+        }
+
+    def send_command(self, angle):
+        cmd = int(self._counters[1])
+        self._counters[1] = (((cmd >> 16) + 1) << 16) | (int(angle) & 0xFFFF)
+
+    def write(self, data):
+        # bytes de porton.commands.encode_command: "90\n"
+        self.send_command(int(bytes(data).strip()))
+        return len(data)
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            self._release()
+
+
+def main():
+    from .devices import DeviceRegistry, resolve_ports
+    from .rules import load_rules
+    from .simulator import Simulator, batch_sink
+
+    parser = argparse.ArgumentParser(description='Demonio de ingesta: puertos serie -> memoria compartida')
+    parser.add_argument('--ports', default=os.environ.get('SERIAL_PORTS', 'COM4'),
+                        help='puertos separados por comas (admite globs)')
+    parser.add_argument('--baud', type=int, default=9600)
+    parser.add_argument('--capacity', type=int, default=DEFAULT_CAPACITY, help='muestras por portón')
+    parser.add_argument('--simulate', type=int, default=0, metavar='N',
+                        help='N portones simulados (sim1..N) en lugar de puertos')
+    parser.add_argument('--rate', type=float, default=10.0, help='muestras/s del simulador')
+    parser.add_argument('--rules', default=os.environ.get('RULES', ''),
+                        help='reglas de seguridad (JSON o archivo JSON, ver porton/rules.py)')
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    registry = None
+    if args.simulate:
+        names = [f'sim{i + 1}' for i in range(args.simulate)]
+    else:
+        # las reglas actúan aquí, el dueño del puerto, no en los lectores
+        registry = DeviceRegistry(resolve_ports(args.ports), args.baud,
+                                  lambda name, batch: writers[name].write_batch(batch),
+                                  rules=load_rules(args.rules) if args.rules else ())
+        names = registry.names()
+    writers = {name: RingWriter(name, args.capacity) for name in names}
+    if registry is not None:
+        registry.start(stop)
+    else:
+        sim = Simulator(args.simulate, args.rate)
+        sink = batch_sink(lambda batch, name: writers[name].write_batch(batch), names)
+        threading.Thread(target=sim.run, args=(stop, sink), daemon=True).start()
+    print('Anillos: ' + ', '.join(ring_name(n) for n in names))
+    # Ctrl+C o un kill normal: borrar los segmentos al salir
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        while not stop.wait(0.01):
+            for name, writer in writers.items():
+                angle = writer.poll_command()
+                if angle is not None and registry is not None:
+                    registry.submit_command(name, angle)
+                writer.beat()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        time.sleep(0.1)
+        for writer in writers.values():
+            writer.close()
+
+
+if __name__ == '__main__':
+    main()
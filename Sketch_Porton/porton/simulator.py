@@ -0,0 +1,320 @@
+"""Simulador de varios portones que genera bloques de muestras con NumPy.
+
+Todas las puertas virtuales avanzan juntas: cada bloque es una matriz
+``(puertas, muestras)`` calculada sin bucles por muestra. Cada puerta vive
+una sucesión de episodios:
+
+- ``idle``: distancia de reposo con ruido y algún eco suelto.
+- ``car``: un coche se acerca, espera con el portón abierto (``S:90``) y se va.
+- ``pedestrian``: alguien se queda cerca; el PIR parpadea.
+- ``dropout``: el sensor deja de mandar tramas.
+
+Un escenario (``SCENARIOS``) fija la mezcla y la frecuencia de episodios;
+``burst`` los encadena casi sin pausa. Con la misma ``seed`` la secuencia es
+idéntica. Un guion (``script``) fuerza episodios concretos: ``[{"at": 5,
+"gate": 0, "kind": "car", "duration": 8}, ...]`` (segundos desde el inicio).
+
+La salida va a un ``sink(gate, ts, dist, mov, servo)``: :func:`batch_sink`
+la publica en proceso como :class:`porton.frames.FrameBatch` y
+:class:`PtySink` la escribe como texto (o, con ``--binary``, en el formato
+de :mod:`porton.binframe`) en pseudo-terminales, para probar el camino serie
+completo::
+
+    python -m porton.simulator --gates 8 --rate 1000 --pty
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from .binframe import encode_record
+from .frames import FrameBatch, NO_SERVO
+
+IDLE, CAR, PEDESTRIAN, DROPOUT = range(4)
+KINDS = {'idle': IDLE, 'car': CAR, 'pedestrian': PEDESTRIAN, 'dropout': DROPOUT}
+
+# Pesos de (car, pedestrian, dropout), pausa media entre episodios (s) y
+# duración media de un episodio (s)
+SCENARIOS = {
+    'quiet': {'weights': (0.6, 0.3, 0.1), 'gap': 60.0, 'duration': 8.0},
+    'mixed': {'weights': (0.5, 0.35, 0.15), 'gap': 15.0, 'duration': 8.0},
+    'cars': {'weights': (1.0, 0.0, 0.0), 'gap': 10.0, 'duration': 8.0},
+    'pedestrians': {'weights': (0.0, 1.0, 0.0), 'gap': 10.0, 'duration': 20.0},
+    'dropouts': {'weights': (0.2, 0.2, 0.6), 'gap': 10.0, 'duration': 5.0},
+    'burst': {'weights': (0.8, 0.2, 0.0), 'gap': 0.5, 'duration': 3.0},
+}
+
+NOISE_CM = 3.0
+GLITCH_PROB = 0.002
+OPEN_ANGLE = 90
+# Bytes que PtySink guarda por puerta si el lector va atrasado; después descarta
+PTY_BACKLOG = 64 * 1024
+
+
+def load_script(path):
+    """Lee un guion JSON: lista de ``{"at", "gate", "kind", "duration"}``."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def _check_script(script, gates):
+    """Valida los episodios del guion; ``ValueError`` diciendo cuál está mal."""
+    for i, e in enumerate(script):
+        where = f'guion, episodio {i + 1}'
+        if not isinstance(e, dict):
+            raise ValueError(f'{where}: debe ser un objeto JSON')
+        if not isinstance(e.get('at'), (int, float)):
+            raise ValueError(f'{where}: falta "at" (segundos desde el inicio)')
+        if e.get('kind') not in KINDS:
+            raise ValueError(f'{where}: "kind" debe ser uno de {", ".join(KINDS)}')
+        gate = e.get('gate', 0)
+        if not isinstance(gate, int) or not 0 <= gate < gates:
+            raise ValueError(f'{where}: "gate" {gate!r} fuera de rango (hay {gates} puertas, de 0 a {gates - 1})')
+        duration = e.get('duration', 1.0)
+        if not isinstance(duration, (int, float)) or duration <= 0:
+            raise ValueError(f'{where}: "duration" debe ser un número positivo')
+    return script
+
+
+class Simulator:
+    """Genera muestras para ``gates`` portones a ``rate`` muestras/s cada uno."""
+
+    def __init__(self, gates=1, rate=10.0, seed=None, scenario='mixed', script=None):
+        if scenario not in SCENARIOS:
+            raise ValueError(f'escenario desconocido: {scenario!r} (usa {", ".join(SCENARIOS)})')
+        self.gates = gates
+        self.rate = float(rate)
+        self.scenario = SCENARIOS[scenario]
+        self.rng = np.random.default_rng(seed)
+        rng = self.rng
+        self.base = rng.uniform(200, 400, gates)
+        # episodio actual de cada puerta
+        self.kind = np.full(gates, IDLE)
+        self.ep_start = np.zeros(gates)
+        self.ep_dur = np.ones(gates)
+        self.near = np.zeros(gates)
+        self.next_ep = rng.exponential(self.scenario['gap'], gates)
+        self.script = sorted(_check_script(script or [], gates), key=lambda e: e['at'])
+        self._script_pos = 0
+        self.t = 0.0       # tiempo simulado (s)
+        self.n = 0         # muestras generadas por puerta
+
+    # --- Episodios ---
+    def _schedule(self, t):
+        """Termina los episodios vencidos y arranca los que tocan (vectorizado)."""
+        ended = (self.kind != IDLE) & (t >= self.ep_start + self.ep_dur)
+        if ended.any():
+            self.kind[ended] = IDLE
+            self.next_ep[ended] = t + self.rng.exponential(self.scenario['gap'], ended.sum())
+        due = (self.kind == IDLE) & (t >= self.next_ep)
+        if due.any():
+            k = int(due.sum())
+            kinds = self.rng.choice([CAR, PEDESTRIAN, DROPOUT], k, p=self._weights())
+            self._start(np.flatnonzero(due), kinds, t,
+                        self.rng.exponential(self.scenario['duration'], k) + 1.0)
+        while self._script_pos < len(self.script) and self.script[self._script_pos]['at'] <= t:
+            e = self.script[self._script_pos]
+            self._script_pos += 1
+            self._start(np.array([e.get('gate', 0)]), np.array([KINDS[e['kind']]]), t,
+                        np.array([float(e.get('duration', self.scenario['duration']))]))
+
+    def _weights(self):
+        w = np.asarray(self.scenario['weights'], dtype=float)
+        return w / w.sum()
+
+    def _start(self, gates, kinds, t, durations):
+        self.kind[gates] = kinds
+        self.ep_start[gates] = t
+        self.ep_dur[gates] = durations
+        self.near[gates] = np.where(kinds == CAR, self.rng.uniform(30, 80, len(gates)),
+                                    self.rng.uniform(100, 180, len(gates)))
+
+    # --- Bloques ---
+    def advance(self, dt):
+        """Avanza ``dt`` segundos simulados.
+
+        Devuelve ``(dist, mov, servo, valid)``, matrices ``(gates, k)``; las
+        muestras con ``valid`` falso (sensor caído) no deben enviarse.
+        """
+        t_end = self.t + dt
+        k = int(t_end * self.rate) - self.n
+        self._schedule(self.t)
+        self.t = t_end
+        if k <= 0:
+            empty = np.empty((self.gates, 0), dtype=np.int32)
+            return empty, empty, empty, empty.astype(bool)
+        times = (self.n + 1 + np.arange(k)) / self.rate
+        self.n += k
+        rng = self.rng
+        g = self.gates
+
+        # fase del episodio en [0, 1] para cada puerta y muestra
+        phase = (times[None, :] - self.ep_start[:, None]) / self.ep_dur[:, None]
+        active = (phase >= 0) & (phase <= 1)
+        kind = np.where(active, self.kind[:, None], IDLE)
+        # trapecio: sube en el primer 30 %, se mantiene y baja en el último 30 %
+        envelope = np.clip(np.minimum(phase, 1 - phase) / 0.3, 0, 1)
+
+        base = self.base[:, None]
+        near = self.near[:, None]
+        is_car = kind == CAR
+        is_ped = kind == PEDESTRIAN
+        approach = base - (base - near) * envelope
+        # el peatón se balancea cerca del sensor en vez de quedarse quieto
+        wobble = near + 15 * np.sin(2 * np.pi * times[None, :] / 3.0)
+        dist = np.where(is_car, approach, base)
+        dist = np.where(is_ped, np.where(envelope >= 1, wobble, approach), dist)
+        dist = dist + rng.normal(0, NOISE_CM, (g, k))
+        glitch = rng.random((g, k)) < GLITCH_PROB
+        dist = np.where(glitch, rng.uniform(0, 600, (g, k)), dist)
+
+        mov = (is_car & (envelope > 0.2)) | (is_ped & (rng.random((g, k)) < 0.3))
+        servo = np.where(is_car & (envelope >= 1), OPEN_ANGLE, 0)
+        valid = kind != DROPOUT
+        return (np.maximum(dist, 0).astype(np.int32), mov.astype(np.int32),
+                servo.astype(np.int32), valid)
+
+    def run(self, stop, sink, block_s=0.05, speed=1.0):
+        """Genera bloques en tiempo real (``speed`` > 1 acelera) hasta ``stop``."""
+        start = time.monotonic()
+        while not stop.is_set():
+            target = (self.t + block_s) / speed
+            wait = start + target - time.monotonic()
+            if wait > 0 and stop.wait(wait):
+                break
+            dist, mov, servo, valid = self.advance(block_s)
+            if not dist.shape[1]:
+                continue
+            ts = time.time()
+            for gate in range(self.gates):
+                ok = valid[gate]
+                if ok.all():
+                    sink(gate, ts, dist[gate], mov[gate], servo[gate])
+                elif ok.any():
+                    sink(gate, ts, dist[gate][ok], mov[gate][ok], servo[gate][ok])
+
+
+def to_batch(ts, dist, mov, servo):
+    """Columnas NumPy -> :class:`porton.frames.FrameBatch` sin bucle por muestra."""
+    batch = FrameBatch(ts)
+    batch.dist.frombytes(np.ascontiguousarray(dist, dtype=np.int32).tobytes())
+    batch.mov.frombytes(np.ascontiguousarray(mov, dtype=np.int32).tobytes())
+    batch.servo.frombytes(np.ascontiguousarray(servo, dtype=np.int32).tobytes())
+    return batch
+
+
+def batch_sink(publish, names):
+    """Sink que llama a ``publish(batch, names[gate])`` (el camino de emisión en proceso)."""
+    def sink(gate, ts, dist, mov, servo):
+        publish(to_batch(ts, dist, mov, servo), names[gate])
+    return sink
+
+
+def encode_frames(dist, mov, servo):
+    """Muestras -> tramas de texto ``D:..,M:..[,S:..]\\n`` como las del Arduino."""
+    return b''.join(
+        b'D:%d,M:%d\n' % (d, m) if s == NO_SERVO else b'D:%d,M:%d,S:%d\n' % (d, m, s)
+        for d, m, s in zip(dist.tolist(), mov.tolist(), servo.tolist()))
+
+
+def encode_binary_frames(dist, mov, servo, seq=0):
+    """Muestras -> tramas binarias (:mod:`porton.binframe`) numeradas desde ``seq``."""
+    return b''.join(
+        encode_record(seq + i, d, m, s)
+        for i, (d, m, s) in enumerate(zip(dist.tolist(), mov.tolist(), servo.tolist())))
+
+
+class PtySink:
+    """Un pseudo-terminal por puerta (sólo POSIX); ``ports`` son las rutas a abrir.
+
+    Si el pty está lleno lo que no cabe se guarda y se escribe antes del
+    siguiente bloque, así nunca se corta una trama; pasado ``PTY_BACKLOG``
+    los bloques nuevos se descartan enteros (``dropped`` cuenta muestras).
+    """
+
+    def __init__(self, gates, binary=False, backlog=PTY_BACKLOG):
+        import pty
+        import tty
+        self.binary = binary
+        self.backlog = backlog
+        self.dropped = 0
+        self._seq = [0] * gates
+        self._pending = [b''] * gates
+        self._fds = []
+        self.ports = []
+        for _ in range(gates):
+            master, slave = pty.openpty()
+            tty.setraw(slave)
+            os.set_blocking(master, False)
+            self._fds.append((master, slave))
+            self.ports.append(os.ttyname(slave))
+
+    def __call__(self, gate, ts, dist, mov, servo):
+        if self.binary:
+            data = encode_binary_frames(dist, mov, servo, self._seq[gate])
+            self._seq[gate] += len(dist)
+        else:
+            data = encode_frames(dist, mov, servo)
+        pending = self._pending[gate]
+        if len(pending) + len(data) > self.backlog:
+            # nadie lee el puerto: se pierde, como en un serie real
+            self.dropped += len(dist)
+            data = b''
+        data = pending + data
+        try:
+            written = os.write(self._fds[gate][0], data) if data else 0
+        except BlockingIOError:
+            written = 0
+        self._pending[gate] = data[written:]
+
+    def close(self):
+        for pair in self._fds:
+            for fd in pair:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+
+
+def main():
+    import threading
+    parser = argparse.ArgumentParser(description='Simulador de portones sobre pseudo-terminales')
+    parser.add_argument('--gates', type=int, default=1)
+    parser.add_argument('--rate', type=float, default=10.0, help='muestras por segundo y puerta')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--scenario', default='mixed', choices=sorted(SCENARIOS))
+    parser.add_argument('--script', help='guion JSON de episodios')
+    parser.add_argument('--pty', action='store_true', help='escribir en pseudo-terminales')
+    parser.add_argument('--binary', action='store_true', help='tramas binarias COBS + CRC en lugar de texto')
+    parser.add_argument('--seconds', type=float, default=0, help='duración (0 = hasta Ctrl+C)')
+    args = parser.parse_args()
+
+    sim = Simulator(args.gates, args.rate, args.seed, args.scenario,
+                    load_script(args.script) if args.script else None)
+    stop = threading.Event()
+    if args.pty:
+        sink = PtySink(args.gates, args.binary)
+        print('SERIAL_PORTS=' + ','.join(sink.ports))
+    else:
+        counts = [0]
+
+        def sink(gate, ts, dist, mov, servo):
+            counts[0] += len(dist)
+    if args.seconds:
+        threading.Timer(args.seconds, stop.set).start()
+    try:
+        sim.run(stop, sink)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        if args.pty:
+            sink.close()
+        else:
+            print(f'{counts[0]} muestras generadas')
+
+
+if __name__ == '__main__':
+    main()
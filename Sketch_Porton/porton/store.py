@@ -0,0 +1,346 @@
+"""Almacén persistente de muestras en SQLite (modo WAL) con rollups.
+
+Las muestras crudas se añaden en bloque (una transacción por segundo desde un
+hilo escritor, sin frenar la lectura del puerto). A la vez se mantienen de
+forma incremental agregados por bucket de 1 s, 1 min y 1 h
+(n, suma/mín/máx de distancia, muestras con movimiento y último servo), de
+modo que una consulta de semanas lee unas cientos de filas de un rollup en vez
+de millones de muestras.
+
+Si SQLite falla (base de datos bloqueada, disco lleno) el escritor lo apunta y
+reintenta en la siguiente vuelta; mientras tanto la cola es acotada: si se
+llena, los lotes nuevos se descartan y se cuentan en lugar de acumularse en
+memoria.
+"""
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from .downsample import downsample
+from .metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+DEFAULT_DEVICE = 'default'
+# Resoluciones de los rollups, en segundos
+ROLLUPS = (1, 60, 3600)
+# Puntos por defecto de una consulta sin resolución explícita
+DEFAULT_POINTS = 1000
+# Máximo de muestras crudas devueltas por una consulta
+MAX_RAW_ROWS = 20000
+# Filas por página al recorrer muestras crudas (iter_samples)
+PAGE_ROWS = 5000
+# Lotes en cola hacia el escritor; si se llena se descartan los nuevos
+MAX_QUEUE = 10000
+# Muestras sin guardar que se conservan para reintentar tras un error de SQLite
+MAX_RETRY_ROWS = 200000
+
+DROPPED = REGISTRY.counter('porton_store_dropped_total', 'Muestras no guardadas porque el escritor no daba abasto')
+ERRORS = REGISTRY.counter('porton_store_errors_total', 'Errores de SQLite del escritor del historial')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS samples (
+    device TEXT NOT NULL,
+    ts REAL NOT NULL,
+    dist INTEGER NOT NULL,
+    mov INTEGER NOT NULL,
+    servo INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_device_ts ON samples (device, ts);
+'''
+
+_ROLLUP_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS rollup_{res} (
+    device TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    dist_sum INTEGER NOT NULL,
+    dist_min INTEGER NOT NULL,
+    dist_max INTEGER NOT NULL,
+    mov INTEGER NOT NULL,
+    servo INTEGER NOT NULL,
+    PRIMARY KEY (device, bucket)
+) WITHOUT ROWID;
+'''
+
+_ROLLUP_UPSERT = '''
+INSERT INTO rollup_{res} (device, bucket, n, dist_sum, dist_min, dist_max, mov, servo)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (device, bucket) DO UPDATE SET
+    n = n + excluded.n,
+    dist_sum = dist_sum + excluded.dist_sum,
+    dist_min = MIN(dist_min, excluded.dist_min),
+    dist_max = MAX(dist_max, excluded.dist_max),
+    mov = mov + excluded.mov,
+    servo = excluded.servo
+'''
+
+
+def connect(path, check_same_thread=True):
+    """Abre ``path`` en modo WAL (lectores y escritor no se bloquean)."""
+    conn = sqlite3.connect(path, timeout=5.0, check_same_thread=check_same_thread)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+class _Rollup:
+    """Agregados en memoria de los buckets de una resolución aún sin volcar."""
+
+    def __init__(self, res):
+        self.res = res
+        self.sql = _ROLLUP_UPSERT.format(res=res)
+        # (device, bucket) -> [n, dist_sum, dist_min, dist_max, mov, servo]
+        self.pending = {}
+
+    def add(self, device, ts, dist, mov, servo):
+        key = (device, int(ts // self.res))
+        agg = self.pending.get(key)
+        if agg is None:
+            self.pending[key] = [1, dist, dist, dist, mov, servo]
+            return
+        agg[0] += 1
+        agg[1] += dist
+        if dist < agg[2]:
+            agg[2] = dist
+        if dist > agg[3]:
+            agg[3] = dist
+        agg[4] += mov
+        agg[5] = servo
+
+    def flush(self, conn):
+        """Vuelca lo pendiente; se vacía con :meth:`clear` cuando la transacción se confirma."""
+        if self.pending:
+            conn.executemany(self.sql, [key + tuple(agg) for key, agg in self.pending.items()])
+
+    def clear(self):
+        self.pending.clear()
+
+
+class SampleStore:
+    """Escritor en segundo plano + consultas de historial.
+
+    ``append_batch`` es barato y seguro desde cualquier hilo; el hilo escritor
+    vuelca lo recibido cada ``commit_interval`` segundos en una transacción.
+    ``dropped`` cuenta las muestras perdidas (cola llena o reintentos agotados)
+    y ``errors`` los fallos de SQLite.
+    """
+
+    def __init__(self, path, commit_interval=1.0, raw_retention_days=7, max_queue=MAX_QUEUE):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.raw_retention = raw_retention_days * 86400 if raw_retention_days else None
+        self._queue = queue.Queue(max_queue)
+        self.dropped = 0
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._rollups = [_Rollup(res) for res in ROLLUPS]
+        conn = connect(path)
+        with conn:
+            conn.executescript(_SCHEMA + ''.join(_ROLLUP_SCHEMA.format(res=r) for r in ROLLUPS))
+        conn.close()
+
+    # --- Escritura ---
+    def append_batch(self, batch, device=DEFAULT_DEVICE):
+        """Encola un :class:`porton.frames.FrameBatch` para guardarlo (o lo descarta si la cola está llena)."""
+        try:
+            self._queue.put_nowait((device, batch))
+        except queue.Full:
+            self._drop(len(batch))
+
+    def _drop(self, n):
+        self.dropped += n
+        DROPPED.inc(n)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _writer_loop(self):
+        conn = connect(self.path)
+        last_prune = 0.0
+        rows = []
+        try:
+            while not self._stop.is_set():
+                deadline = time.monotonic() + self.commit_interval
+                while True:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        device, batch = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                    self._collect(rows, device, batch)
+                if rows and self._write(conn, rows):
+                    rows = []
+                elif len(rows) > MAX_RETRY_ROWS:
+                    # la base de datos lleva mucho sin aceptar escrituras
+                    self._drop(len(rows))
+                    rows = []
+                    for rollup in self._rollups:
+                        rollup.clear()
+                now = time.time()
+                if self.raw_retention and now - last_prune > 3600:
+                    try:
+                        with conn:
+                            conn.execute('DELETE FROM samples WHERE ts < ?', (now - self.raw_retention,))
+                        last_prune = now
+                    except sqlite3.Error as e:
+                        self._error('purgando muestras antiguas', e)
+            # vaciar lo que quede al parar
+            while True:
+                try:
+                    device, batch = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._collect(rows, device, batch)
+            if rows and not self._write(conn, rows):
+                self._drop(len(rows))
+        finally:
+            conn.close()
+
+    def _collect(self, rows, device, batch):
+        ts = batch.ts
+        for dist, mov, servo in batch:
+            rows.append((device, ts, dist, mov, servo))
+            for rollup in self._rollups:
+                rollup.add(device, ts, dist, mov, servo)
+
+    def _write(self, conn, rows):
+        """Guarda ``rows`` y los rollups en una transacción; False si SQLite falla."""
+        try:
+            with conn:
+                conn.executemany('INSERT INTO samples (device, ts, dist, mov, servo) VALUES (?, ?, ?, ?, ?)', rows)
+                for rollup in self._rollups:
+                    rollup.flush(conn)
+        except sqlite3.Error as e:
+            # la transacción se deshizo entera: se reintenta en la siguiente vuelta
+            self._error(f'guardando {len(rows)} muestras', e)
+            return False
+        for rollup in self._rollups:
+            rollup.clear()
+        return True
+
+    def _error(self, what, error):
+        self.errors += 1
+        ERRORS.inc()
+        log.warning('Historial: error %s: %s', what, error)
+
+    # --- Lectura ---
+    def devices(self):
+        """Dispositivos con historial (del rollup horario: unas pocas filas)."""
+        conn = connect(self.path)
+        try:
+            return [r[0] for r in conn.execute(f'SELECT DISTINCT device FROM rollup_{ROLLUPS[-1]} ORDER BY device')]
+        finally:
+            conn.close()
+
+    def raw_retained_from(self, now=None):
+        """Instante desde el que se conservan muestras crudas (None: desde siempre).
+
+        Lo anterior ya se purgó y sólo queda en los rollups.
+        """
+        if not self.raw_retention:
+            return None
+        return (time.time() if now is None else now) - self.raw_retention
+
+    def iter_samples(self, start, end, devices, page_rows=PAGE_ROWS, offload=None):
+        """Muestras crudas ``(device, ts, dist, mov, servo)`` entre ``start`` y ``end``.
+
+        Generador con memoria constante: lee páginas de ``page_rows`` filas
+        por el índice ``(device, ts)``, continuando desde la última
+        ``(ts, rowid)`` vista (el rowid desempata las muestras de un mismo
+        lote, que comparten ``ts``). Cada página es una lectura corta, así
+        que una exportación larga no retiene el WAL; al cerrar el generador
+        (el cliente se fue) se cierra la conexión. ``offload(fn, *args)``,
+        como en :class:`porton.chart_render.ChartCache`, lleva cada lectura
+        a otro hilo.
+        """
+        run = offload or (lambda fn, *args: fn(*args))
+        conn = run(connect, self.path, offload is None)
+        try:
+            for device in devices:
+                ts, rowid = start, -1
+                while True:
+                    rows = run(self._page, conn, device, ts, rowid, end, page_rows)
+                    for row in rows:
+                        yield (device,) + row[1:]
+                    if len(rows) < page_rows:
+                        break
+                    rowid, ts = rows[-1][0], rows[-1][1]
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _page(conn, device, ts, rowid, end, page_rows):
+        return conn.execute(
+            'SELECT rowid, ts, dist, mov, servo FROM samples '
+            'WHERE device = ? AND ts >= ? AND (ts > ? OR rowid > ?) AND ts < ? '
+            'ORDER BY ts, rowid LIMIT ?',
+            (device, ts, ts, rowid, end, page_rows)).fetchall()
+
+    def query(self, start, end, resolution=None, device=DEFAULT_DEVICE, points=DEFAULT_POINTS):
+        """Historial entre ``start`` y ``end`` (segundos epoch).
+
+        Usa el rollup más grueso cuya resolución no supere ``resolution`` y,
+        si hace falta, agrega varios buckets en SQL. Con ``resolution < 1``
+        devuelve muestras crudas; si en el rango hay más de ``MAX_RAW_ROWS``
+        se responde desde los rollups con la resolución que las deja por
+        debajo (``source`` y ``resolution`` lo dicen), en lugar de cortar.
+        Si salen más de ``points`` filas se reducen con LTTB conservando las
+        que tienen movimiento (``downsampled`` lo indica).
+        """
+        if resolution is None:
+            resolution = max(1.0, (end - start) / points)
+        conn = connect(self.path)
+        try:
+            rows = None
+            if resolution < ROLLUPS[0]:
+                rows = conn.execute(
+                    'SELECT ts, 1, dist, dist, dist, mov FROM samples '
+                    'WHERE device = ? AND ts >= ? AND ts < ? ORDER BY ts LIMIT ?',
+                    (device, start, end, MAX_RAW_ROWS + 1)).fetchall()
+                source = 'raw'
+                resolution = 0
+                if len(rows) > MAX_RAW_ROWS:
+                    rows = None
+                    resolution = max(1.0, (end - start) / MAX_RAW_ROWS)
+            if rows is None:
+                res = max(r for r in ROLLUPS if r <= resolution)
+                group = max(1, int(resolution // res))
+                rows = conn.execute(
+                    f'SELECT (bucket / ?) * ? * ?, SUM(n), SUM(dist_sum), MIN(dist_min), '
+                    f'MAX(dist_max), SUM(mov) FROM rollup_{res} '
+                    f'WHERE device = ? AND bucket >= ? AND bucket < ? '
+                    f'GROUP BY bucket / ? ORDER BY 1',
+                    (group, group, res, device, int(start // res), int(end // res) + 1, group)).fetchall()
+                source = f'rollup_{res}'
+                resolution = res * group
+        finally:
+            conn.close()
+        downsampled = len(rows) > points
+        if downsampled:
+            idx = downsample([r[0] for r in rows], [r[2] / r[1] for r in rows], points,
+                             flags=[r[5] > 0 for r in rows])
+            rows = [rows[i] for i in idx]
+        return {
+            'device': device,
+            'source': source,
+            'resolution': resolution,
+            'downsampled': downsampled,
+            't': [r[0] for r in rows],
+            'n': [r[1] for r in rows],
+            'dist_avg': [r[2] / r[1] for r in rows],
+            'dist_min': [r[3] for r in rows],
+            'dist_max': [r[4] for r in rows],
+            'mov': [r[5] for r in rows],
+        }
@@ -0,0 +1,167 @@
+"""Codificación binaria de lotes de muestras para Socket.IO.
+
+En vez de un evento JSON por muestra, el servidor agrupa las muestras de una
+ventana (50-100 ms) y envía un único frame binario con las columnas
+empaquetadas. Formato (little endian)::
+
+    cabecera (16 bytes): magic 'P' u8 | versión u8 | n u16 | reservado u32 | base_ts f64 (ms epoch)
+    t_off   float32[n]  ms desde base_ts
+    dist    int32[n]
+    servo   int16[n]    -1 si la trama no trae S:
+    mov     uint8[n]
+
+Las columnas quedan alineadas para que el navegador pueda crear vistas
+``Float32Array``/``Int32Array``/... directamente sobre el ``ArrayBuffer``.
+"""
+import struct
+import sys
+import threading
+from array import array
+from collections import deque
+
+MAGIC = 0x50
+VERSION = 1
+HEADER = struct.Struct('<BBHId')
+# u16 en la cabecera
+MAX_SAMPLES = 0xFFFF
+
+
+def _le(arr):
+    if sys.byteorder != 'little':
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def encode_samples(ts, dist, mov, servo):
+    """Empaqueta columnas paralelas (``ts`` en segundos epoch) en un frame binario."""
+    n = len(dist)
+    base = ts[0] if n else 0.0
+    t_off = array('f', [(t - base) * 1000.0 for t in ts])
+    return b''.join((
+        HEADER.pack(MAGIC, VERSION, n, 0, base * 1000.0),
+        _le(t_off),
+        _le(array('i', dist)),
+        _le(array('h', servo)),
+        _le(array('B', mov)),
+    ))
+
+
+def payload_base_ts(payload):
+    """Instante (segundos epoch) de la primera muestra de un frame binario."""
+    return HEADER.unpack_from(payload)[4] / 1000.0
+
+
+class SampleWindow:
+    """Acumula muestras entre dos ``flush()`` de la ventana de emisión.
+
+    ``add_batch`` se llama desde el hilo lector y ``flush`` desde el de
+    emisión; el intercambio de columnas se hace bajo un lock corto.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # muestras descartadas por superar MAX_SAMPLES en una ventana
+        self.dropped = 0
+        self._reset()
+
+    def _reset(self):
+        # mismas columnas 'i' que FrameBatch: extend() sin conversión
+        self._ts = array('d')
+        self._dist = array('i')
+        self._mov = array('i')
+        self._servo = array('i')
+
+    def __len__(self):
+        return len(self._dist)
+
+    def add_batch(self, batch):
+        with self._lock:
+            if len(self._dist) + len(batch) > MAX_SAMPLES:
+                self.dropped += len(batch)
+                return
+            self._ts.extend([batch.ts] * len(batch))
+            self._dist.extend(batch.dist)
+            self._mov.extend(batch.mov)
+            self._servo.extend(batch.servo)
+
+    def flush(self):
+        """Devuelve el frame binario de lo acumulado, o ``None`` si no hay nada."""
+        with self._lock:
+            if not self._dist:
+                return None
+            ts, dist, mov, servo = self._ts, self._dist, self._mov, self._servo
+            self._reset()
+        return encode_samples(ts, dist, mov, servo)
+
+
+class RecentSamples:
+    """Últimas ``capacity`` muestras, para que un cliente nuevo pinte al instante.
+
+    ``snapshot()`` codifica el buffer con el mismo formato que los lotes y
+    reutiliza el resultado mientras no lleguen datos nuevos, así que muchas
+    reconexiones simultáneas cuestan una sola codificación.
+    """
+
+    def __init__(self, capacity=120):
+        self._samples = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self.version = 0
+        self._cached = None
+        self._cached_version = -1
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add_batch(self, batch):
+        ts = batch.ts
+        with self._lock:
+            self._samples.extend((ts, d, m, s) for d, m, s in batch)
+            self.version += 1
+
+    def columns(self):
+        """``(version, dists, movs)`` con el contenido actual."""
+        with self._lock:
+            version = self.version
+            samples = list(self._samples)
+        return version, [s[1] for s in samples], [s[2] for s in samples]
+
+    def snapshot(self):
+        """Frame binario con el contenido actual, o ``None`` si está vacío."""
+        with self._lock:
+            if self._cached_version == self.version:
+                return self._cached
+            version = self.version
+            samples = list(self._samples)
+        if samples:
+            ts, dist, mov, servo = zip(*samples)
+            cached = encode_samples(ts, dist, mov, servo)
+        else:
+            cached = None
+        with self._lock:
+            self._cached, self._cached_version = cached, version
+        return cached
+
+
+def decode_samples(payload):
+    """Inverso de :func:`encode_samples`: ``(ts, dist, mov, servo)`` como listas/arrays.
+
+    ``ts`` se devuelve en segundos epoch.
+    """
+    magic, version, n, _, base = HEADER.unpack_from(payload)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('frame binario desconocido')
+    off = HEADER.size
+    cols = []
+    for typecode in ('f', 'i', 'h', 'B'):
+        col = array(typecode)
+        size = col.itemsize * n
+        col.frombytes(payload[off:off + size])
+        if sys.byteorder != 'little':
+            col.byteswap()
+        cols.append(col)
+        off += size
+    t_off, dist, servo, mov = cols
+    base /= 1000.0
+    ts = [base + t / 1000.0 for t in t_off]
+    return ts, dist, mov, servo
@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pytest
+
+# Los módulos compartidos viven en Sketch_Porton/porton
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pty = pytest.importorskip('pty')  # sólo POSIX
+tty = pytest.importorskip('tty')
+
+
+class PtyArduino:
+    """Lado "Arduino" de un pty: lo que se escriba aquí se lee en ``path``."""
+
+    def __init__(self):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.master, view):]
+
+    def hangup(self):
+        """Como desenchufar el cable: el lector recibe ``EIO``."""
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self.master = self.slave = -1
+
+    close = hangup
+
+
+@pytest.fixture
+def arduino():
+    fake = PtyArduino()
+    yield fake
+    fake.close()
+
+
+@pytest.fixture
+def make_arduino():
+    fakes = []
+
+    def make():
+        fakes.append(PtyArduino())
+        return fakes[-1]
+
+    yield make
+    for fake in fakes:
+        fake.close()
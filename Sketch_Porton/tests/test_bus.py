@@ -0,0 +1,165 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from porton.bus import SUBSCRIBE, Broker, BusClient, decode_batch, encode_batch, pack
+from porton.frames import FrameBatch
+
+
+def wait_for(predicate, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+class Inbox:
+    """``on_message`` que apunta lo recibido; los ``*.sync`` de :func:`sync` aparte."""
+
+    def __init__(self):
+        self.messages = []
+        self.synced = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self, topic, payload):
+        if topic.endswith('.sync'):
+            self.synced.set()
+            return
+        with self._lock:
+            self.messages.append((topic, payload))
+
+    def topics(self):
+        with self._lock:
+            return [t for t, _ in self.messages]
+
+
+def start_broker(port=0, **kw):
+    broker = Broker('127.0.0.1', port, **kw)
+    thread = broker.start()
+    return broker, thread
+
+
+def sync(publisher, inbox, topic='batch.sync'):
+    """Publica hasta que el suscriptor recibe algo: su ``!sub`` ya llegó al broker."""
+    inbox.synced.clear()
+    assert wait_for(lambda: publisher.publish(topic, b'') and inbox.synced.wait(0.05))
+
+
+@pytest.fixture
+def bus():
+    broker, thread = start_broker()
+    url = 'tcp://%s:%d' % broker.address
+    clients = []
+
+    def client(topics=(), on_message=None):
+        c = BusClient(url, topics, on_message, retry_delay=0.05)
+        c.start()
+        clients.append(c)
+        assert c.connected.wait(2)
+        return c
+
+    yield broker, client
+    for c in clients:
+        c.close()
+    broker.stop()
+    thread.join(2)
+
+
+def test_publish_reaches_subscribed_prefixes_only(bus):
+    broker, client = bus
+    inbox = Inbox()
+    client(('batch.', 'state'), inbox)
+    publisher = client()
+    sync(publisher, inbox)
+
+    batch = FrameBatch(1700000000.5)
+    for i in range(5):
+        batch.append(i, i % 2, 90 if i % 2 else -1)
+    assert publisher.publish('batch.porton1', encode_batch(batch))
+    assert publisher.publish('event.porton1', b'{}')
+    assert publisher.publish_json('state', {'ok': 1})
+    assert wait_for(lambda: len(inbox.messages) == 2)
+    time.sleep(0.05)
+    assert inbox.topics() == ['batch.porton1', 'state']
+    decoded = decode_batch(inbox.messages[0][1])
+    assert decoded.ts == batch.ts
+    assert list(decoded) == list(batch)
+
+
+def test_publisher_does_not_receive_its_own_messages(bus):
+    broker, client = bus
+    own, other = Inbox(), Inbox()
+    a = client(('cmd.',), own)
+    client(('cmd.',), other)
+    sync(a, other, 'cmd.sync')
+    assert a.publish('cmd.porton1', b'90')
+    assert wait_for(lambda: other.messages)
+    time.sleep(0.05)
+    assert own.messages == []
+
+
+def test_worker_reconnects_after_broker_restart():
+    broker, thread = start_broker()
+    host, port = broker.address
+    url = f'tcp://{host}:{port}'
+    inbox = Inbox()
+    worker = BusClient(url, ('batch.',), inbox, retry_delay=0.05)
+    publisher = BusClient(url, retry_delay=0.05)
+    for c in (worker, publisher):
+        c.start()
+    try:
+        assert worker.connected.wait(2) and publisher.connected.wait(2)
+        sync(publisher, inbox)
+
+        broker.stop()
+        thread.join(2)
+        assert wait_for(lambda: not worker.connected.is_set())
+        # sin broker se pierde lo publicado, sin bloquear ni lanzar
+        assert wait_for(lambda: not publisher.publish('batch.x', b'perdido'))
+
+        broker, thread = start_broker(port)
+        assert worker.connected.wait(3) and publisher.connected.wait(3)
+        sync(publisher, inbox)
+        assert publisher.publish('batch.x', b'de nuevo')
+        assert wait_for(lambda: inbox.messages == [('batch.x', b'de nuevo')])
+        assert publisher.dropped >= 1
+    finally:
+        worker.close()
+        publisher.close()
+        broker.stop()
+        thread.join(2)
+
+
+def test_slow_subscriber_is_dropped_not_waited_for(bus):
+    broker, client = bus
+    broker.max_buffer = 256 * 1024
+    inbox = Inbox()
+    client(('batch.',), inbox)
+    publisher = client()
+    sync(publisher, inbox)
+
+    # suscriptor que nunca lee
+    slow = socket.create_connection(broker.address)
+    slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    slow.sendall(pack(SUBSCRIBE, b'batch.'))
+    assert wait_for(lambda: broker.stats()['clients'] == 3)
+    time.sleep(0.05)
+    slow_peer = next(p for p in list(broker._peers.values())
+                     if p.sock.getpeername() == slow.getsockname())
+    try:
+        payload = b'x' * 10000
+        burst = 20  # 200 KB por ráfaga: cabe entera en el búfer del worker rápido
+        n = 2000
+        t0 = time.monotonic()
+        for i in range(0, n, burst):
+            for _ in range(burst):
+                assert publisher.publish('batch.carga', payload)
+            # el worker rápido lo recibe todo aunque el lento se haya atascado
+            assert wait_for(lambda: len(inbox.messages) == i + burst)
+        elapsed = time.monotonic() - t0
+        assert slow_peer.dropped > 0
+        assert elapsed < 10
+    finally:
+        slow.close()
@@ -0,0 +1,100 @@
+import os
+import select
+import threading
+import time
+from collections import defaultdict
+
+from porton.devices import DeviceRegistry, device_name
+from porton.ingest import FdPort
+
+
+def open_fd(path, baud):
+    return FdPort(os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK))
+
+
+def wait_for(predicate, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+class Collector:
+    """Lotes y cambios de estado por portón, tal y como los entrega el registro."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.states = defaultdict(list)
+        self.threads = set()
+
+    def on_batch(self, name, batch):
+        self.threads.add(threading.get_ident())
+        self.samples[name].extend(batch)
+
+    def on_state(self, name, state):
+        self.states[name].append(state)
+
+
+def start_registry(ports, collector):
+    reg = DeviceRegistry(ports, 9600, collector.on_batch, opener=open_fd, on_state=collector.on_state)
+    stop = threading.Event()
+    thread = reg.start(stop)
+    return reg, stop, thread
+
+
+def read_master(fake, timeout=1.0):
+    ready, _, _ = select.select([fake.master], [], [], timeout)
+    return os.read(fake.master, 1024) if ready else b''
+
+
+def test_each_port_reaches_only_its_own_device(make_arduino):
+    a, b = make_arduino(), make_arduino()
+    name_a, name_b = device_name(a.path), device_name(b.path)
+    collector = Collector()
+    reg, stop, thread = start_registry([a.path, b.path], collector)
+    try:
+        for i in range(50):
+            a.write(b'D:%d,M:0\n' % i)
+            b.write(b'D:%d,M:1,S:90\n' % (1000 + i))
+        assert wait_for(lambda: len(collector.samples[name_a]) == 50 and len(collector.samples[name_b]) == 50)
+        assert collector.samples[name_a] == [(i, 0, -1) for i in range(50)]
+        assert collector.samples[name_b] == [(1000 + i, 1, 90) for i in range(50)]
+        # un único bucle para los dos puertos
+        assert len(collector.threads) == 1
+        health = reg.health()
+        assert health[name_a]['state'] == health[name_b]['state'] == 'live'
+        # los contadores son globales por nombre: un pty reutilizado ya trae cuenta
+        assert health[name_a]['samples'] >= 50 and health[name_b]['samples'] >= 50
+
+        # y los comandos salen sólo por el puerto de su portón
+        assert reg.submit_command(name_b, 45)
+        assert read_master(b) == b'45\n'
+        assert read_master(a, timeout=0.1) == b''
+        assert not reg.submit_command('no-existe', 45)
+    finally:
+        stop.set()
+        thread.join(2)
+
+
+def test_one_port_failing_does_not_stop_the_other(make_arduino):
+    a, b = make_arduino(), make_arduino()
+    name_a, name_b = device_name(a.path), device_name(b.path)
+    collector = Collector()
+    reg, stop, thread = start_registry([a.path, b.path], collector)
+    try:
+        a.write(b'D:1,M:0\n')
+        b.write(b'D:2,M:0\n')
+        assert wait_for(lambda: collector.samples[name_a] and collector.samples[name_b])
+        a.hangup()
+        assert wait_for(lambda: reg.devices[name_a].state == 'down')
+        for i in range(20):
+            b.write(b'D:%d,M:0\n' % (10 + i))
+        assert wait_for(lambda: len(collector.samples[name_b]) == 21)
+        assert collector.samples[name_b][-1] == (29, 0, -1)
+        assert reg.devices[name_b].state == 'live'
+        assert reg.devices[name_a].errors >= 1
+        assert collector.states[name_a][-1] == 'down'
+        assert 'down' not in collector.states[name_b]
+    finally:
+        stop.set()
+        thread.join(2)
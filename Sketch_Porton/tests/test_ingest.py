@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+
+import pytest
+
+from porton.binframe import encode_record
+from porton.frames import NO_SERVO
+from porton.ingest import FdPort, FrameDecoder, LineSplitter, SerialIngest
+
+
+class Reader:
+    """Un ``SerialIngest`` en un hilo que apunta las muestras y cómo terminó."""
+
+    def __init__(self, port):
+        self.samples = []
+        self.error = None
+        self.stop = threading.Event()
+        self.ingest = SerialIngest(port, self._on_batch, poll_timeout=0.05)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _on_batch(self, batch):
+        self.samples.extend(batch)
+
+    def _run(self):
+        try:
+            self.ingest.run(self.stop)
+        except Exception as e:
+            self.error = e
+
+    def wait_samples(self, n, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while len(self.samples) < n and time.monotonic() < deadline:
+            time.sleep(0.005)
+        return self.samples
+
+    def join(self, timeout=2.0):
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+
+def open_fd_port(path):
+    return FdPort(os.open(path, os.O_RDWR | os.O_NOCTTY))
+
+
+def test_frames_split_across_reads_are_reassembled(arduino):
+    port = open_fd_port(arduino.path)
+    reader = Reader(port)
+    try:
+        arduino.write(b'D:1,M:0\nD:2,')
+        assert reader.wait_samples(1) == [(1, 0, NO_SERVO)]
+        time.sleep(0.05)  # la segunda mitad llega en otro read()
+        arduino.write(b'M:1,S:90\nD:')
+        arduino.write(b'3,M:0\r\n')
+        assert reader.wait_samples(3) == [(1, 0, NO_SERVO), (2, 1, 90), (3, 0, NO_SERVO)]
+    finally:
+        reader.stop.set()
+        assert reader.join()
+        port.close()
+    assert reader.error is None
+
+
+def test_garbage_without_newline_is_dropped_at_max_pending():
+    splitter = LineSplitter(max_pending=64)
+    for _ in range(10):
+        assert splitter.feed(b'x' * 30) == b''
+        assert len(splitter._pending) <= 64
+    splitter.reset()
+    assert bytes(splitter.feed(b'D:5,M:1\n')) == b'D:5,M:1\n'
+
+
+def test_overflow_on_pty_recovers_on_next_frame(arduino):
+    port = open_fd_port(arduino.path)
+    reader = Reader(port)
+    try:
+        arduino.write(b'\xaa' * 20000)
+        time.sleep(0.1)
+        # lo que quede de la basura se pega a la primera línea: se ignora
+        arduino.write(b'\nD:7,M:1,S:45\n')
+        assert reader.wait_samples(1) == [(7, 1, 45)]
+        assert len(reader.ingest.decoder._lines._pending) == 0
+    finally:
+        reader.stop.set()
+        assert reader.join()
+        port.close()
+
+
+def test_unplugged_pty_raises_os_error(arduino):
+    port = open_fd_port(arduino.path)
+    reader = Reader(port)
+    arduino.write(b'D:1,M:0\n')
+    assert reader.wait_samples(1)
+    arduino.hangup()
+    assert reader.join()
+    assert isinstance(reader.error, OSError)
+    port.close()
+
+
+def test_eof_raises_connection_error():
+    rfd, wfd = os.pipe()
+    port = FdPort(rfd)
+    reader = Reader(port)
+    os.write(wfd, b'D:4,M:1\n')
+    assert reader.wait_samples(1) == [(4, 1, NO_SERVO)]
+    os.close(wfd)
+    assert reader.join()
+    assert isinstance(reader.error, ConnectionError)
+    port.close()
+
+
+def test_stop_ends_the_reader_cleanly(arduino):
+    port = open_fd_port(arduino.path)
+    reader = Reader(port)
+    reader.stop.set()
+    assert reader.join()
+    assert reader.error is None
+    port.close()
+
+
+def binary_frames(n, start=0):
+    return b''.join(encode_record(start + i, 100 + i, i % 2, 90) for i in range(n))
+
+
+class TestFrameDecoder:
+    def test_text(self):
+        decoder = FrameDecoder()
+        assert list(decoder.feed(b'D:12,M:0\nD:13,M:1,S:90\n')) == [(12, 0, NO_SERVO), (13, 1, 90)]
+        assert decoder.protocol == 'text'
+
+    def test_stray_nul_does_not_switch_to_binary(self):
+        decoder = FrameDecoder()
+        assert len(decoder.feed(b'D:12,M:0\n')) == 1
+        decoder.feed(b'\x00garbage\n')
+        for i in range(5):
+            assert list(decoder.feed(b'D:%d,M:0\n' % i)) == [(i, 0, NO_SERVO)]
+        assert decoder.protocol == 'text'
+
+    def test_boot_noise_before_text(self):
+        decoder = FrameDecoder()
+        assert list(decoder.feed(b'\xff\x00\xf0\nD:12,M:0\n')) == [(12, 0, NO_SERVO)]
+        assert list(decoder.feed(b'D:13,M:0\n')) == [(13, 0, NO_SERVO)]
+        assert decoder.protocol == 'text'
+
+    def test_binary_split_across_reads(self):
+        decoder = FrameDecoder()
+        data = binary_frames(20)
+        got = []
+        for i in range(0, len(data), 7):
+            batch = decoder.feed(data[i:i + 7])
+            if batch:
+                got.extend(batch)
+        assert got == [(100 + i, i % 2, 90) for i in range(20)]
+        assert decoder.protocol == 'binary'
+        assert decoder.stats()['crc_errors'] == 0
+
+    def test_corrupt_binary_is_counted_not_decoded(self):
+        decoder = FrameDecoder()
+        decoder.feed(binary_frames(3))
+        frame = bytearray(encode_record(3, 5, 0))
+        frame[3] ^= 0x40
+        assert not decoder.feed(bytes(frame))
+        assert len(decoder.feed(binary_frames(1, start=4))) == 1
+        stats = decoder.stats()
+        assert stats['crc_errors'] == 1
+        assert stats['lost'] == 1
+
+    def test_binary_with_newline_bytes_stays_binary(self):
+        decoder = FrameDecoder()
+        decoder.feed(binary_frames(3))
+        got = []
+        # dist=10 y servo=10 ponen dos 0x0A en el registro; cortando tras cada
+        # uno, el trozo del medio llega solo y sin ningún 0x00
+        for seq in range(3, 13):
+            frame = encode_record(seq, 10, 0, 10)
+            first = frame.index(b'\n') + 1
+            second = frame.index(b'\n', first) + 1
+            for part in (frame[:first], frame[first:second], frame[second:]):
+                batch = decoder.feed(part)
+                if batch:
+                    got.extend(batch)
+        assert got == [(10, 0, 10)] * 10
+        assert decoder.protocol == 'binary'
+        assert decoder.text.malformed == decoder.text.ignored == 0
+        assert decoder.stats()['crc_errors'] == 0
+
+    def test_binary_falls_back_to_text(self):
+        decoder = FrameDecoder()
+        decoder.feed(binary_frames(5))
+        assert decoder.protocol == 'binary'
+        got = []
+        for i in range(10):
+            batch = decoder.feed(b'D:%d,M:0\n' % i)
+            if batch:
+                got.extend(batch)
+        assert decoder.protocol == 'text'
+        assert got[-1] == (9, 0, NO_SERVO)
+
+    @pytest.mark.parametrize('first', [b'D:1,M:0\n', b'\x00'])
+    def test_reset_detects_again(self, first):
+        decoder = FrameDecoder()
+        decoder.feed(first)
+        decoder.reset()
+        assert decoder.protocol is None
+        assert len(decoder.feed(binary_frames(2))) == 2
@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+from porton.frames import NO_SERVO, FrameBatch
+from porton.rules import Rule, RuleEngine, RuleError, compile_expression
+
+
+class Commands:
+    """Lo que usa :class:`RuleEngine` de una ``CommandQueue``: apunta los envíos."""
+
+    def __init__(self):
+        self.sent = []
+
+    def target(self):
+        return NO_SERVO
+
+    def send_now(self, angle, hold=0.0):
+        self.sent.append(angle)
+        return True
+
+
+def batch_of(*dists):
+    batch = FrameBatch(time.time())
+    for dist in dists:
+        batch.append(dist, 0, 90)
+    return batch
+
+
+@pytest.mark.parametrize('source', ['min(dist) > 1', 'max(dist) > 1', 'abs() > 1', 'abs(dist, 1) > 1'])
+def test_bad_arity_is_rejected_at_compile_time(source):
+    with pytest.raises(RuleError, match='argumentos'):
+        compile_expression(source, 'mala')
+
+
+def test_valid_calls_still_compile():
+    fn = compile_expression('min(dist, 50, 40) < abs(ddist) + 35 and max(servo, target) == 90')
+    assert fn(30, 0, 90, -1, 0.0, 0.0, False, False)
+
+
+def test_failing_rule_is_counted_and_others_still_fire():
+    commands = Commands()
+    broken = Rule('rota', 'dist < 30', 0)
+    broken.when = lambda dist, *rest: min(dist) > 1  # TypeError en cada muestra
+    engine = RuleEngine('porton-test', [broken, Rule('cerca', 'dist < 30', 180, cooldown=0)], commands)
+    engine.evaluate(batch_of(10, 20, 40), time.perf_counter())
+    assert engine.errors == 3
+    assert commands.sent == [180, 180]
+    assert engine.evaluated == 3
+
+
+def test_angle_that_cannot_be_an_int_is_counted():
+    commands = Commands()
+    engine = RuleEngine('porton-test', [Rule('nan', 'dist < 30', '1e999 - 1e999')], commands)
+    engine.evaluate(batch_of(10), time.perf_counter())
+    assert engine.errors == 1
+    assert commands.sent == []
+    assert engine.fired == 0
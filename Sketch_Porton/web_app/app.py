@@ -1,15 +1,27 @@
+import json
 import os
+import sys
 import time
 import threading
-import random
-from flask import Flask, render_template
-from flask_socketio import SocketIO, emit
+from flask import Flask, Response, render_template, request, jsonify
+from flask_socketio import SocketIO, emit, join_room, leave_room
 
-# Intentamos importar pyserial; si no está disponible, usar simulador
-try:
-    import serial
-except Exception:
-    serial = None
+# Los módulos compartidos con dashboard.py viven en Sketch_Porton/porton
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from porton.analytics import GateAnalytics  # noqa: E402
+from porton.broadcast import Broadcaster  # noqa: E402
+from porton.chart_render import FORMATS as CHART_FORMATS, ChartCache  # noqa: E402
+from porton.bus import DEFAULT_URL as DEFAULT_BUS_URL, Broker, BusClient, decode_batch, encode_batch, parse_url  # noqa: E402
+from porton.devices import DeviceRegistry, device_name, open_port, resolve_ports  # noqa: E402
+from porton.export import FORMATS as EXPORT_FORMATS, export_chunks  # noqa: E402
+from porton.frames import NO_SERVO  # noqa: E402
+from porton.metrics import REGISTRY, serve as serve_metrics  # noqa: E402
+from porton.recording import parse_speed, recording_opener, replay_opener  # noqa: E402
+from porton.rules import load_rules  # noqa: E402
+from porton.shm_ring import STALE_AFTER as SHM_STALE_AFTER, RingReader, ring_name  # noqa: E402
+from porton.simulator import Simulator, batch_sink, load_script  # noqa: E402
+from porton.store import DEFAULT_POINTS, SampleStore  # noqa: E402
+from porton.wire import RecentSamples, SampleWindow, payload_base_ts  # noqa: E402
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'devkey')
@@ -19,85 +31,666 @@ socketio = SocketIO(app, cors_allowed_origins='*')
 # Config
 USE_SERIAL = os.environ.get('USE_SERIAL', 'false').lower() in ('1', 'true', 'yes')
 SERIAL_PORT = os.environ.get('SERIAL_PORT', 'COM4')
+# Varios portones: lista separada por comas, admite globs ("/dev/ttyACM*,COM5")
+# y 'auto' (placas Arduino conectadas); los que aparezcan después también se abren
+SERIAL_PORTS = os.environ.get('SERIAL_PORTS', '')
+# Texto o binario (COBS + CRC, porton/binframe.py) se detecta solo en cada puerto;
+# el binario admite hasta 1000000 baudios
 SERIAL_BAUD = int(os.environ.get('SERIAL_BAUD', '9600'))
 EMIT_INTERVAL = float(os.environ.get('EMIT_INTERVAL', '0.6'))
+# Simulador (sin USE_SERIAL ni REPLAY_FILE): portones virtuales, muestras/s de cada uno,
+# semilla, escenario (quiet, mixed, cars, pedestrians, dropouts, burst) y guion JSON opcional
+SIM_GATES = int(os.environ.get('SIM_GATES', '1'))
+SIM_RATE = float(os.environ.get('SIM_RATE', str(1 / EMIT_INTERVAL)))
+SIM_SEED = int(os.environ['SIM_SEED']) if os.environ.get('SIM_SEED') else None
+SIM_SCENARIO = os.environ.get('SIM_SCENARIO', 'mixed')
+SIM_SCRIPT = os.environ.get('SIM_SCRIPT', '')
+# 'batch': un frame binario 'sensor_batch' por ventana; 'json': un evento 'sensor' por muestra
+EMIT_MODE = os.environ.get('EMIT_MODE', 'batch').lower()
+EMIT_BATCH_MS = float(os.environ.get('EMIT_BATCH_MS', '100'))
+# Contrapresión por cliente: drop-oldest | latest-only | disconnect
+BROADCAST_POLICY = os.environ.get('BROADCAST_POLICY', 'drop-oldest').lower()
+CLIENT_QUEUE = int(os.environ.get('CLIENT_QUEUE', '32'))
+CLIENT_BACKLOG = int(os.environ.get('CLIENT_BACKLOG', '8'))
+# Historial persistente (SQLite WAL); HISTORY_DB vacío lo desactiva
+HISTORY_DB = os.environ.get('HISTORY_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'porton.sqlite3'))
+HISTORY_RAW_DAYS = float(os.environ.get('HISTORY_RAW_DAYS', '7'))
+# Grabación de los bytes crudos de cada puerto (un .prec por apertura); vacío la desactiva
+RECORD_DIR = os.environ.get('RECORD_DIR', '')
+# Reproducir grabaciones en lugar del simulador (lista separada por comas, admite globs)
+REPLAY_FILE = os.environ.get('REPLAY_FILE', '')
+# 1 = tiempo real, 10 = diez veces más rápido, max = sin esperas
+REPLAY_SPEED = parse_speed(os.environ.get('REPLAY_SPEED', '1'))
+# Portones a leer del demonio de memoria compartida (python -m porton.shm_ring)
+# en lugar de abrir los puertos; así dashboard.py puede usar el mismo Arduino
+SHM_RINGS = os.environ.get('SHM_RINGS', '')
+# Espera entre lecturas de los anillos cuando no hay muestras nuevas, y entre
+# intentos de abrirlos si el demonio aún no arrancó o se reinició
+SHM_POLL_MS = float(os.environ.get('SHM_POLL_MS', '20'))
+SHM_RETRY = float(os.environ.get('SHM_RETRY', '1.0'))
+# Ingesta separada de los workers web (ver porton/bus.py):
+#   ''       todo en este proceso (por defecto)
+#   ingest   abre los puertos o el simulador y publica en el bus (web_app/ingest.py)
+#   worker   no abre puertos: se suscribe al bus y sirve a los navegadores
+BUS_ROLE = os.environ.get('BUS_ROLE', '').lower()
+BUS_URL = os.environ.get('BUS_URL', DEFAULT_BUS_URL)
+# La ingesta lleva el broker dentro salvo BUS_BROKER=0 (broker aparte: python -m porton.bus)
+BUS_BROKER = os.environ.get('BUS_BROKER', '1').lower() in ('1', 'true', 'yes')
+# Puerto de /metrics del proceso de ingesta (0 = sin servidor)
+INGEST_METRICS_PORT = int(os.environ.get('INGEST_METRICS_PORT', '9100'))
+# Muestras que recibe un cliente al conectarse (igual que MAX_POINTS en main.js)
+SNAPSHOT_SIZE = int(os.environ.get('SNAPSHOT_SIZE', '120'))
+# Reglas de seguridad (porton/rules.py): archivo JSON o el JSON mismo. Se
+# evalúan en la ingesta y mueven el servo sin pasar por los navegadores
+RULES = os.environ.get('RULES', '')
+# Segundos mínimos entre dos renders de /chart.png (o .svg) del mismo portón
+CHART_INTERVAL = float(os.environ.get('CHART_INTERVAL', '1.0'))
 
 sensor_thread = None
+flush_thread = None
 thread_stop = threading.Event()
+registry = None
+store = None
+bus = None
+# nombre de dispositivo -> RingReader (con SHM_RINGS); None hasta que se abre
+rings = {}
 
 
-def serial_reader_loop():
-    """Lee desde el puerto serie y emite eventos socket.io con {dist, mov}."""
-    ser = None
+def _blocking_offload():
+    """Con eventlet/gevent, cómo ejecutar trabajo de CPU sin parar el hub."""
+    if socketio.async_mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute
+    if socketio.async_mode == 'gevent':
+        import gevent
+        return lambda fn, *args: gevent.get_hub().threadpool.apply(fn, args)
+    return None
+
+
+# Renders del gráfico y lecturas de /api/export van a un hilo real para no
+# bloquear a los clientes Socket.IO
+offload = _blocking_offload()
+# Imágenes del gráfico compartidas por todos los clientes (/chart.png)
+charts = ChartCache(SNAPSHOT_SIZE, CHART_INTERVAL, offload=offload)
+# Estado de los portones que publica la ingesta (sólo en los workers)
+remote_state = {'devices': {}, 'analytics': {}}
+# Nombre del dispositivo del simulador
+SIM_DEVICE = 'sim'
+
+
+class DeviceStream:
+    """Ventana de emisión y muestras recientes de un dispositivo."""
+
+    def __init__(self, name):
+        self.name = name
+        self.room = f'device:{name}'
+        # clientes que sólo quieren los eventos derivados, sin muestras
+        self.events_room = f'events:{name}'
+        self.analytics = GateAnalytics(name)
+        self.window = SampleWindow()
+        self.recent = RecentSamples(SNAPSHOT_SIZE)
+        self.m_emit = EMIT_SECONDS.labels(name)
+
+
+# nombre de dispositivo -> DeviceStream; el primero es el que ve un cliente nuevo
+streams = {}
+streams_lock = threading.Lock()
+# sid -> dispositivo al que está suscrito el cliente
+client_devices = {}
+
+
+def get_stream(name):
+    stream = streams.get(name)
+    if stream is None:
+        with streams_lock:
+            stream = streams.setdefault(name, DeviceStream(name))
+    return stream
+
+
+def default_device():
+    return next(iter(streams), SIM_DEVICE)
+
+
+def _send_to(sid, event, payload):
+    socketio.emit(event, payload, to=sid)
+
+
+def _transport_backlog(sid):
+    """Paquetes que engine.io aún no ha entregado a este cliente."""
     try:
-        if serial is None:
-            raise RuntimeError('pyserial no disponible')
-        ser = serial.Serial(SERIAL_PORT, SERIAL_BAUD, timeout=1)
-        # esperar a que Arduino reinicie si aplica
-        time.sleep(2.0)
-        while not thread_stop.is_set():
-            try:
-                if ser.in_waiting > 0:
-                    line = ser.readline().decode('utf-8', errors='ignore').strip()
-                    # formato esperado: D:<n>,M:<0|1>
-                    if line.startswith('D:') and ',M:' in line:
-                        parts = line.split(',')
-                        d = int(parts[0].split(':')[1])
-                        m = int(parts[1].split(':')[1])
-                        payload = {'dist': d, 'mov': m}
-                        socketio.emit('sensor', payload)
-                else:
-                    time.sleep(0.01)
-            except Exception:
-                time.sleep(0.2)
+        eio_sid = socketio.server.manager.eio_sid_from_sid(sid, '/')
+        return socketio.server.eio.sockets[eio_sid].queue.qsize()
     except Exception:
-        # fall back al simulador si el serial falla
-        simulator_loop()
-    finally:
-        if ser and ser.is_open:
-            ser.close()
+        return 0
+
+
+broadcaster = Broadcaster(_send_to, _transport_backlog,
+                          disconnect=lambda sid: socketio.server.disconnect(sid),
+                          policy=BROADCAST_POLICY, max_queue=CLIENT_QUEUE,
+                          max_backlog=CLIENT_BACKLOG)
+
+# --- Métricas (/metrics) ---
+EMIT_SECONDS = REGISTRY.histogram('porton_parse_to_emit_seconds',
+                                  'Tiempo desde el lote decodificado hasta su publicación a los clientes',
+                                  ('device',))
+REGISTRY.callback('porton_clients_connected', 'Clientes Socket.IO conectados', 'gauge',
+                  lambda: [({}, len(broadcaster))])
+REGISTRY.callback('porton_emit_queue_depth', 'Mensajes pendientes en las colas de los clientes', 'gauge',
+                  lambda: [({}, broadcaster.queue_depth())])
+REGISTRY.callback('porton_emit_dropped_total', 'Mensajes descartados por clientes lentos', 'counter',
+                  lambda: [({}, broadcaster.dropped_total)])
+if BUS_ROLE != 'worker':  # en los workers la analítica la calcula la ingesta
+    REGISTRY.callback('porton_motion_detections_total', 'Movimientos detectados (tras la histéresis)', 'counter',
+                      lambda: [({'device': s.name}, s.analytics.detections) for s in list(streams.values())])
+    REGISTRY.callback('porton_gate_open_seconds_total', 'Segundos que el portón ha estado abierto', 'counter',
+                      lambda: [({'device': s.name}, s.analytics.stats()['open_seconds_total'])
+                               for s in list(streams.values())])
+REGISTRY.callback('porton_window_dropped_total', 'Muestras descartadas por desbordar una ventana de emisión',
+                  'counter', lambda: [({'device': s.name}, s.window.dropped) for s in list(streams.values())])
+
+
+def publish_batch(batch, device=SIM_DEVICE):
+    """Ingesta de un lote: lo guarda, lo analiza y lo entrega a los clientes o al bus."""
+    stream = get_stream(device)
+    events = stream.analytics.update(batch)
+    if store is not None:
+        store.append_batch(batch, device)
+    if BUS_ROLE == 'ingest':
+        bus.publish(f'batch.{device}', encode_batch(batch))
+        _publish_events(stream, events)
+        return
+    _publish_events(stream, events)
+    deliver_batch(stream, batch)
+
+
+def deliver_batch(stream, batch):
+    """Entrega un lote a los clientes conectados a este proceso."""
+    stream.recent.add_batch(batch)
+    if EMIT_MODE == 'batch':
+        stream.window.add_batch(batch)
+    else:
+        _emit_json(batch, stream.room)
+        stream.m_emit.observe(time.time() - batch.ts)
+
+
+def _publish_events(stream, events):
+    """Los eventos van tanto a los clientes completos como a los de sólo eventos."""
+    for event in events:
+        if BUS_ROLE == 'ingest':
+            bus.publish_json(f'event.{stream.name}', event)
+            continue
+        broadcaster.publish('event', event, stream.room)
+        broadcaster.publish('event', event, stream.events_room)
+
+
+def _emit_json(batch, room):
+    """Emite un evento socket.io {dist, mov[, servo]} por cada muestra del lote."""
+    for d, m, s in batch:
+        payload = {'dist': d, 'mov': m}
+        if s != NO_SERVO:
+            payload['servo'] = s
+        broadcaster.publish('sensor', payload, room)
+    broadcaster.pump()
+
+
+def serial_reader_loop():
+    """Lee todos los puertos configurados en un único bucle asyncio."""
+    # formato esperado: D:<n>,M:<0|1>[,S:<n>]
+    registry.run(thread_stop)
+
+
+def _command_ack(device, angle, latency):
+    """El portón confirmó el ángulo: avisar a sus clientes con la latencia.
+
+    ``latency`` es None si el servo ya estaba en ese ángulo (no hubo movimiento).
+    """
+    ack = {'device': device, 'angle': angle,
+           'latency_ms': round(latency * 1000, 1) if latency is not None else None}
+    if BUS_ROLE == 'ingest':
+        bus.publish_json(f'ack.{device}', ack)
+    else:
+        socketio.emit('command_ack', ack, to=get_stream(device).room)
+
+
+def open_rings():
+    for name in (n.strip() for n in SHM_RINGS.split(',')):
+        if name and name not in rings:
+            rings[name] = _attach_ring(name)
+            get_stream(name)
+
+
+def _attach_ring(name, old=None):
+    """Abre el anillo de ``name`` o devuelve None si el demonio no lo ha creado.
+
+    Con ``old`` sólo vale un segmento de otro escritor (el demonio se reinició
+    y creó uno nuevo), que se lee desde el principio para no perder nada.
+    """
+    try:
+        reader = RingReader(name)
+    except (FileNotFoundError, ValueError) as e:
+        if old is None:
+            print(f'Anillo {ring_name(name)} no disponible: {e}')
+        return None
+    if old is not None:
+        if reader.writer_pid == old.writer_pid:
+            reader.close()  # el mismo demonio, que sigue sin latir
+            return None
+        reader.pos = max(0, reader.head - reader.capacity)
+    print(f'Anillo {ring_name(name)} abierto (demonio pid {reader.writer_pid})')
+    return reader
+
+
+def ring_reader_loop():
+    """Copia lo nuevo de cada anillo; si ninguno tiene muestras espera un poco.
+
+    Un anillo que aún no existe, o cuyo escritor dejó de latir, se vuelve a
+    abrir cada ``SHM_RETRY`` segundos.
+    """
+    retry_at = {}
+    while not thread_stop.is_set():
+        idle = True
+        for name, reader in list(rings.items()):
+            batch = reader.read() if reader is not None else None
+            if batch is not None:
+                idle = False
+                publish_batch(batch, name)
+                continue
+            if reader is not None and reader.writer_age() <= SHM_STALE_AFTER:
+                continue
+            now = time.monotonic()
+            if now < retry_at.get(name, 0.0):
+                continue
+            retry_at[name] = now + SHM_RETRY
+            fresh = _attach_ring(name, reader)
+            if fresh is not None:
+                if reader is not None:
+                    reader.close()
+                rings[name] = fresh
+        if idle:
+            thread_stop.wait(SHM_POLL_MS / 1000)
+
+
+def create_registry():
+    """Crea el registro de puertos (y sus streams) o None si no hay grabaciones.
+
+    Con USE_SERIAL el registro se crea aunque ahora no haya ningún puerto: los
+    reintenta en segundo plano en lugar de pasar al simulador.
+    """
+    if REPLAY_FILE:
+        # al acabar una grabación el registro la reabre: se reproduce en bucle
+        ports = resolve_ports(REPLAY_FILE)
+        if not ports:
+            return None
+        opener, spec = replay_opener(REPLAY_SPEED), None
+    else:
+        spec = SERIAL_PORTS or SERIAL_PORT
+        ports = resolve_ports(spec)
+        opener = open_port
+    if RECORD_DIR:
+        opener = recording_opener(opener, RECORD_DIR, device_name)
+    reg = DeviceRegistry(ports, SERIAL_BAUD, lambda name, batch: publish_batch(batch, name),
+                         opener=opener, on_command_ack=_command_ack, spec=spec,
+                         on_state=_device_state, rules=load_rules(RULES) if RULES else (),
+                         on_rule=_rule_fired)
+    for name in reg.names():
+        get_stream(name)
+    return reg
+
+
+def _rule_fired(info):
+    """Una regla ya movió el servo; ahora sí se avisa a los clientes (como evento)."""
+    event = {'type': 'rule', **info}
+    _publish_events(get_stream(info['device']), [event])
+
+
+def _device_state(device, state):
+    """Un puerto cambió de estado: avisar a sus clientes (o a los workers por el bus)."""
+    stream = get_stream(device)
+    payload = device_state(device)
+    if BUS_ROLE == 'ingest':
+        bus.publish_json(f'status.{device}', payload)
+    else:
+        socketio.emit('device_state', payload, to=stream.room)
+
+
+def device_state(device):
+    """``{device, state, error}`` de un portón para la cabecera de la web."""
+    if BUS_ROLE == 'worker':
+        health = remote_state['devices'].get(device, {})
+    else:
+        health = devices_health().get(device, {})
+    state = health.get('state', 'connecting')
+    return {'device': device, 'state': state, 'retry_in_s': health.get('retry_in_s'),
+            'error': health.get('last_error') if state == 'down' else None}
+
+
+def simulator_names():
+    return [SIM_DEVICE] if SIM_GATES == 1 else [f'{SIM_DEVICE}{i + 1}' for i in range(SIM_GATES)]
 
 
 def simulator_loop():
-    """Simulador: emite datos periódicamente; útil para pruebas sin hardware."""
-    base = 2500
+    """Simulador: portones virtuales en proceso; útil para pruebas sin hardware."""
+    sim = Simulator(SIM_GATES, SIM_RATE, SIM_SEED, SIM_SCENARIO,
+                    load_script(SIM_SCRIPT) if SIM_SCRIPT else None)
+    sim.run(thread_stop, batch_sink(publish_batch, simulator_names()))
+
+
+def batch_flush_loop():
+    """Cada EMIT_BATCH_MS envía lo acumulado como un único frame binario
+    y pasa a cada cliente lo que su transporte pueda aceptar."""
     while not thread_stop.is_set():
-        # pequeños ruidos alrededor de base
-        dist = max(0, base + random.randint(-50, 50))
-        # movimiento aleatorio con baja probabilidad
-        mov = 1 if random.random() < 0.05 else 0
-        socketio.emit('sensor', {'dist': dist, 'mov': mov})
-        time.sleep(EMIT_INTERVAL)
+        time.sleep(EMIT_BATCH_MS / 1000.0)
+        for stream in list(streams.values()):
+            try:
+                _publish_events(stream, stream.analytics.tick())
+                payload = stream.window.flush()
+                if payload:
+                    broadcaster.publish('sensor_batch', payload, stream.room)
+                    stream.m_emit.observe(time.time() - payload_base_ts(payload))
+            except Exception:
+                # un lote roto se pierde, pero la emisión sigue para todos
+                app.logger.exception('Error emitiendo el lote de %s', stream.name)
+        broadcaster.pump()
+
+
+# --- Bus (BUS_ROLE=ingest | worker) ---
+def _on_bus_message(topic, payload):
+    """Worker: lo que publica la ingesta se reparte a los clientes de este proceso."""
+    kind, _, device = topic.partition('.')
+    if kind == 'batch':
+        deliver_batch(get_stream(device), decode_batch(payload))
+    elif kind == 'event':
+        _publish_events(get_stream(device), [json.loads(payload)])
+    elif kind == 'ack':
+        socketio.emit('command_ack', json.loads(payload), to=get_stream(device).room)
+    elif kind == 'status':
+        status = json.loads(payload)
+        remote_state['devices'].setdefault(device, {}).update(
+            state=status['state'], last_error=status['error'], retry_in_s=status['retry_in_s'])
+        socketio.emit('device_state', status, to=get_stream(device).room)
+    elif kind == 'state':
+        state = json.loads(payload)
+        for name in state['devices']:
+            get_stream(name)
+        remote_state.update(state)
+
+
+def _on_bus_command(topic, payload):
+    """Ingesta: comandos que mandan los workers ('cmd.<dispositivo>')."""
+    if registry is not None:
+        registry.submit_command(topic.partition('.')[2], json.loads(payload)['angle'])
+
+
+def devices_health():
+    if BUS_ROLE == 'worker':
+        return remote_state['devices']
+    if rings:
+        return {name: reader.health() if reader is not None else {'port': ring_name(name), 'state': 'down'}
+                for name, reader in rings.items()}
+    if registry is None:
+        return {name: {'state': 'simulated'} for name in streams}
+    return registry.health()
+
+
+def analytics_stats(stream):
+    if BUS_ROLE == 'worker':
+        return remote_state['analytics'].get(stream.name, {})
+    return stream.analytics.stats()
+
+
+def run_ingest():
+    """Proceso de ingesta (BUS_ROLE=ingest): único dueño de los puertos; publica en el bus."""
+    global bus
+    if BUS_BROKER:
+        Broker(*parse_url(BUS_URL)).start()
+    bus = BusClient(BUS_URL, ('cmd.',), _on_bus_command)
+    bus.start()
+    if INGEST_METRICS_PORT:
+        serve_metrics(INGEST_METRICS_PORT)
+    start_sensor_thread()
+    print(f'Ingesta publicando en {BUS_URL}')
+    while not thread_stop.wait(1.0):
+        bus.publish_json('state', {
+            'devices': devices_health(),
+            'analytics': {name: stream.analytics.stats() for name, stream in list(streams.items())},
+        })
 
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    # con varios workers sólo websocket: el sondeo HTTP necesitaría sesiones fijas
+    transports = ['websocket'] if BUS_ROLE == 'worker' else None
+    return render_template('index.html', transports=transports)
+
+
+@app.route('/chart.<fmt>')
+def chart(fmt):
+    """Historial reciente como imagen: /chart.png o /chart.svg[?device=<nombre>].
+
+    Para pantallas que sólo refrescan una imagen; con If-None-Match responde
+    304 sin cuerpo si no ha cambiado.
+    """
+    if fmt not in CHART_FORMATS:
+        return jsonify({'error': 'formato no soportado'}), 404
+    stream = streams.get(request.args.get('device') or default_device())
+    if stream is None:
+        return jsonify({'error': 'dispositivo desconocido'}), 404
+    image = charts.get(stream.name, fmt, stream.recent.version, stream.recent.columns)
+    response = Response(image.body, mimetype=CHART_FORMATS[fmt])
+    response.set_etag(image.etag)
+    # el navegador puede guardarla pero debe revalidar cada vez
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.route('/api/history')
+def history():
+    """Historial agregado: /api/history?from=<epoch>&to=<epoch>&resolution=<s>&points=<n>."""
+    if store is None:
+        return jsonify({'error': 'historial desactivado'}), 404
+    try:
+        end = float(request.args.get('to', time.time()))
+        start = float(request.args.get('from', end - 3600))
+        resolution = request.args.get('resolution')
+        resolution = float(resolution) if resolution else None
+        points = max(10, int(request.args.get('points', DEFAULT_POINTS)))
+    except ValueError:
+        return jsonify({'error': 'parámetros inválidos'}), 400
+    device = request.args.get('device', default_device())
+    return jsonify(store.query(start, end, resolution, device, points))
+
+
+@app.route('/api/export.<fmt>')
+def export(fmt):
+    """Muestras crudas en streaming: /api/export.csv o .ndjson?from=<epoch>&to=<epoch>[&device=a,b][&gzip=1].
+
+    Sin ``device`` exporta todos los portones con historial. La respuesta se
+    genera por páginas mientras se envía (memoria constante); con
+    ``gzip=1`` llega como archivo .gz. Las muestras crudas caducan a los
+    ``HISTORY_RAW_DAYS`` días: ``X-Export-From`` dice desde cuándo cubre de
+    verdad la exportación y ``X-Export-Truncated: 1`` que se pidió más.
+    """
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'formato no soportado'}), 404
+    if store is None:
+        return jsonify({'error': 'historial desactivado'}), 404
+    try:
+        end = float(request.args.get('to', time.time()))
+        start = float(request.args.get('from', end - 86400))
+    except ValueError:
+        return jsonify({'error': 'parámetros inválidos'}), 400
+    devices = [d for d in request.args.get('device', '').split(',') if d] or store.devices()
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    retained = store.raw_retained_from()
+    truncated = retained is not None and start < retained
+    covered = retained if truncated else start
+    filename = f'porton-{int(covered)}-{int(end)}.{fmt}' + ('.gz' if compress else '')
+    chunks = export_chunks(store.iter_samples(covered, end, devices, offload=offload), fmt, compress)
+    return Response(chunks, mimetype='application/gzip' if compress else EXPORT_FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                             'Cache-Control': 'no-store',
+                             'X-Export-From': f'{covered:.3f}',
+                             'X-Export-To': f'{end:.3f}',
+                             'X-Export-Truncated': '1' if truncated else '0',
+                             # que un proxy (nginx) no acumule la respuesta entera
+                             'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/devices')
+def devices():
+    """Estado de salud de cada dispositivo."""
+    return jsonify(devices_health())
+
+
+@app.route('/api/analytics')
+def analytics():
+    """Distancia filtrada, movimiento, detecciones por hora y tiempo abierto de cada portón."""
+    return jsonify({name: analytics_stats(stream) for name, stream in list(streams.items())})
+
+
+@app.route('/metrics')
+def metrics():
+    """Métricas de ingesta y difusión en formato de texto de Prometheus."""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/clients')
+def clients_stats():
+    """Cola, retraso y pérdidas de cada cliente conectado."""
+    return jsonify(broadcaster.stats())
+
+
+def _send_snapshot(stream, events_only=False):
+    # Arranque en caliente: el gráfico se llena con el historial reciente
+    emit('analytics', analytics_stats(stream))
+    emit('device_state', device_state(stream.name))
+    if events_only:
+        return
+    snapshot = stream.recent.snapshot()
+    if snapshot:
+        emit('sensor_snapshot', snapshot)
+
+
+def _client_room(stream, events_only):
+    return stream.events_room if events_only else stream.room
 
 
 @socketio.on('connect')
 def handle_connect():
     print('Cliente conectado')
-    emit('connected', {'msg': 'OK'})
+    stream = get_stream(default_device())
+    # io({query: {stream: 'events'}}): sólo eventos, sin muestras
+    events_only = request.args.get('stream') == 'events'
+    join_room(stream.room)
+    broadcaster.add_client(request.sid, _client_room(stream, events_only))
+    client_devices[request.sid] = stream.name
+    emit('connected', {'msg': 'OK', 'device': stream.name, 'devices': list(streams)})
+    _send_snapshot(stream, events_only)
+
+
+@socketio.on('subscribe')
+def handle_subscribe(data):
+    """Cambia el portón que recibe el cliente: {'device': <nombre>[, 'stream': 'events']}."""
+    data = data or {}
+    name = data.get('device')
+    if name not in streams:
+        return
+    stream = streams[name]
+    events_only = data.get('stream') == 'events'
+    for room in list(streams):
+        leave_room(f'device:{room}')
+    join_room(stream.room)
+    broadcaster.subscribe(request.sid, _client_room(stream, events_only))
+    client_devices[request.sid] = stream.name
+    _send_snapshot(stream, events_only)
+
+
+@socketio.on('command')
+def handle_command(data):
+    """Mueve el servo del portón del cliente: {'angle': 0-180[, 'device': <nombre>]}."""
+    data = data or {}
+    try:
+        angle = int(data.get('angle'))
+    except (TypeError, ValueError):
+        return {'ok': False, 'error': 'ángulo inválido'}
+    if not 0 <= angle <= 180:
+        return {'ok': False, 'error': 'ángulo fuera de rango'}
+    device = data.get('device') or client_devices.get(request.sid, default_device())
+    if BUS_ROLE == 'worker':
+        # el puerto lo tiene la ingesta; la confirmación llega luego como 'command_ack'
+        if device not in streams:
+            return {'ok': False, 'error': 'dispositivo desconocido'}
+        if not bus.publish_json(f'cmd.{device}', {'angle': angle}):
+            return {'ok': False, 'error': 'sin conexión con la ingesta'}
+        return {'ok': True, 'device': device, 'angle': angle}
+    if rings:
+        # el demonio lo recoge del buzón del anillo y lo escribe en el puerto
+        if device not in rings:
+            return {'ok': False, 'error': 'dispositivo desconocido'}
+        ring = rings[device]
+        if ring is None:
+            return {'ok': False, 'error': 'sin conexión con el demonio'}
+        ring.send_command(angle)
+        return {'ok': True, 'device': device, 'angle': angle}
+    if registry is None:
+        return {'ok': False, 'error': 'sin puerto serie'}
+    if not registry.submit_command(device, angle):
+        return {'ok': False, 'error': 'dispositivo desconocido'}
+    return {'ok': True, 'device': device, 'angle': angle}
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
     print('Cliente desconectado')
+    broadcaster.remove_client(request.sid)
+    client_devices.pop(request.sid, None)
+
+
+def start_store(writer=True):
+    global store
+    if store is not None or not HISTORY_DB:
+        return
+    os.makedirs(os.path.dirname(HISTORY_DB) or '.', exist_ok=True)
+    store = SampleStore(HISTORY_DB, raw_retention_days=HISTORY_RAW_DAYS)
+    # los workers sólo consultan; escribe la ingesta
+    if writer:
+        store.start()
 
 
 def start_sensor_thread():
-    global sensor_thread
+    global sensor_thread, flush_thread, registry, bus
     if sensor_thread and sensor_thread.is_alive():
         return
     thread_stop.clear()
-    if USE_SERIAL and serial is not None:
+    start_store(writer=BUS_ROLE != 'worker')
+    # También drena las colas de los clientes en modo json
+    flush_thread = threading.Thread(target=batch_flush_loop, daemon=True)
+    flush_thread.start()
+    if BUS_ROLE == 'worker':
+        bus = BusClient(BUS_URL, ('batch.', 'event.', 'ack.', 'status.', 'state'), _on_bus_message)
+        sensor_thread = bus.start()
+        return
+    if SHM_RINGS:
+        open_rings()
+        sensor_thread = threading.Thread(target=ring_reader_loop, daemon=True)
+        sensor_thread.start()
+        return
+    if USE_SERIAL or REPLAY_FILE:
+        registry = registry or create_registry()
+    if registry is not None:
         sensor_thread = threading.Thread(target=serial_reader_loop, daemon=True)
     else:
+        for name in simulator_names():
+            get_stream(name)
         sensor_thread = threading.Thread(target=simulator_loop, daemon=True)
     sensor_thread.start()
 
 
+# Bajo gunicorn no se ejecuta __main__: cada worker se suscribe al importar la app
+if BUS_ROLE == 'worker':
+    start_sensor_thread()
+
+
 if __name__ == '__main__':
     start_sensor_thread()
     # Dev server (no para producción); Render usará gunicorn/eventlet
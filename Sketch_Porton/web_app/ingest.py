@@ -0,0 +1,17 @@
+"""Proceso de ingesta: abre los puertos (o el simulador) y publica en el bus.
+
+Uso (junto a uno o varios workers con BUS_ROLE=worker)::
+
+    BUS_ROLE=ingest python web_app/ingest.py
+"""
+import os
+
+os.environ.setdefault('BUS_ROLE', 'ingest')
+
+import app  # noqa: E402
+
+if __name__ == '__main__':
+    try:
+        app.run_ingest()
+    except KeyboardInterrupt:
+        pass
@@ -1,10 +1,24 @@
-const socket = io();
+// Con varios workers detrás (BUS_ROLE=worker) el servidor pide sólo websocket
+const socket = io(window.SOCKET_TRANSPORTS ? {transports: window.SOCKET_TRANSPORTS} : {});
 
 let chart;
 const MAX_POINTS = 120;
-let labels = [];
-let dataPoints = [];
-let movPoints = [];
+
+// Buffer circular preasignado: las muestras nuevas sobrescriben las viejas
+// sin shift()/filter()/map(); el gráfico se rehace como mucho una vez por frame.
+const ring = {
+  dist: new Int32Array(MAX_POINTS),
+  mov: new Uint8Array(MAX_POINTS),
+  labels: new Array(MAX_POINTS).fill(''),
+  head: 0,   // siguiente posición a escribir
+  count: 0
+};
+let labels = new Array(MAX_POINTS).fill('');
+let dataPoints = new Array(MAX_POINTS).fill(null);
+let movPoints = new Array(MAX_POINTS).fill(null);
+let redrawPending = false;
+let lastDist = null;
+let lastMov = 0;
 
 function createChart(){
   const ctx = document.getElementById('chart').getContext('2d');
@@ -20,9 +34,10 @@ function createChart(){
         tension: 0.2,
         pointRadius: 2
       }, {
+        // Misma escala x que la distancia: null donde no hubo movimiento
         label: 'Movimiento',
         data: movPoints,
-        type: 'scatter',
+        showLine: false,
         pointRadius: 6,
         pointBackgroundColor: '#ff5c7c'
       }]
@@ -38,32 +53,164 @@ function createChart(){
   });
 }
 
+function pushSample(t, dist, mov){
+  const i = ring.head;
+  ring.dist[i] = dist;
+  ring.mov[i] = mov;
+  ring.labels[i] = new Date(t).toLocaleTimeString();
+  ring.head = (i + 1) % MAX_POINTS;
+  if(ring.count < MAX_POINTS) ring.count++;
+  lastDist = dist;
+  lastMov = mov;
+}
+
+function scheduleRedraw(){
+  if(redrawPending) return;
+  redrawPending = true;
+  requestAnimationFrame(redraw);
+}
+
+function redraw(){
+  redrawPending = false;
+  // Copia el buffer circular en orden cronológico sobre los arrays del gráfico
+  const n = ring.count;
+  const start = (ring.head - n + MAX_POINTS) % MAX_POINTS;
+  labels.length = n;
+  dataPoints.length = n;
+  movPoints.length = n;
+  for(let k = 0; k < n; k++){
+    const i = (start + k) % MAX_POINTS;
+    labels[k] = ring.labels[i];
+    dataPoints[k] = ring.dist[i];
+    movPoints[k] = ring.mov[i] ? ring.dist[i] : null;
+  }
+  if(lastDist !== null){
+    document.getElementById('dist').textContent = lastDist + ' cm';
+    document.getElementById('mov').textContent = lastMov ? '¡DETECTADO!' : 'NO';
+  }
+  chart.update('none');
+}
+
+// Frame binario de porton/wire.py: cabecera de 16 bytes + columnas empaquetadas
+function decodeBatch(buf){
+  const view = new DataView(buf);
+  if(view.getUint8(0) !== 0x50) return;
+  const n = view.getUint16(2, true);
+  const base = view.getFloat64(8, true);
+  let off = 16;
+  const tOff = new Float32Array(buf, off, n); off += 4 * n;
+  const dist = new Int32Array(buf, off, n); off += 4 * n;
+  off += 2 * n;  // servo (no se muestra en la web)
+  const mov = new Uint8Array(buf, off, n);
+  for(let k = 0; k < n; k++){
+    pushSample(base + tOff[k], dist[k], mov[k]);
+  }
+}
+
 socket.on('connect', ()=>{
   console.log('Conectado al servidor');
 });
 
+// Lista de portones; el selector sólo se muestra si hay más de uno
+socket.on('connected', (info)=>{
+  const sel = document.getElementById('device');
+  const devices = info.devices || [];
+  sel.innerHTML = '';
+  for(const name of devices){
+    const opt = document.createElement('option');
+    opt.value = name;
+    opt.textContent = name;
+    opt.selected = name === info.device;
+    sel.appendChild(opt);
+  }
+  sel.style.display = devices.length > 1 ? '' : 'none';
+});
+
+// Estado del puerto del portón (porton/connection.py): connecting, live, stale, down
+const LINK_TEXT = {
+  connecting: 'Conectando...',
+  live: 'En vivo',
+  stale: 'Sin datos',
+  down: 'Desconectado',
+  simulated: 'Simulado'
+};
+
+socket.on('device_state', (s)=>{
+  const link = document.getElementById('link');
+  let text = LINK_TEXT[s.state] || s.state;
+  if(s.state === 'down' && s.retry_in_s != null) text += ' · reintento en ' + s.retry_in_s.toFixed(1) + ' s';
+  link.textContent = text;
+  link.title = s.error || '';
+  link.className = 'link ' + s.state;
+});
+
+socket.on('disconnect', ()=>{
+  const link = document.getElementById('link');
+  link.textContent = 'Sin servidor';
+  link.className = 'link down';
+});
+
+function selectDevice(name){
+  socket.emit('subscribe', {device: name});
+}
+
+// Al conectar, el servidor manda las últimas muestras en el mismo formato
+socket.on('sensor_snapshot', (buf)=>{
+  ring.head = 0;
+  ring.count = 0;
+  decodeBatch(buf);
+  scheduleRedraw();
+});
+
+socket.on('sensor_batch', (buf)=>{
+  decodeBatch(buf);
+  scheduleRedraw();
+});
+
+// Modo EMIT_MODE=json: un evento por muestra {dist, mov}
 socket.on('sensor', (d)=>{
-  // d: {dist, mov}
-  const t = new Date().toLocaleTimeString();
-  labels.push(t);
-  dataPoints.push(d.dist);
-  // Para scatter, añadimos objeto con x=index, y=value (Chart.js scatter uses x/y)
-  if(d.mov){
-    movPoints.push({x: labels.length-1, y: d.dist});
+  pushSample(Date.now(), d.dist, d.mov ? 1 : 0);
+  scheduleRedraw();
+});
+
+// Eventos derivados (porton/analytics.py): sólo llegan en las transiciones
+const EVENT_TEXT = {
+  motion_start: 'Movimiento detectado',
+  motion_stop: 'Fin del movimiento',
+  gate_open: 'Portón abierto',
+  gate_close: 'Portón cerrado',
+  rule: 'Regla de seguridad'
+};
+
+socket.on('analytics', (a)=>{
+  // un worker que aún no tiene el estado de la ingesta responde {}
+  if(a.detections_per_hour !== undefined){
+    document.getElementById('rate').textContent = a.detections_per_hour.toFixed(0);
   }
-  if(labels.length>MAX_POINTS){ labels.shift(); dataPoints.shift();
-    // ajustar movPoints: eliminar los que queden fuera
-    movPoints = movPoints.filter(p => p.x > labels.length-1 - MAX_POINTS);
-    // reindex movPoints x para el chart (simple solución: remap to new indices)
-    movPoints = movPoints.map((p,i)=>({x: p.x - 1, y: p.y}));
+});
+
+socket.on('event', (e)=>{
+  let text = new Date(e.ts * 1000).toLocaleTimeString() + ' — ' + (EVENT_TEXT[e.type] || e.type);
+  if(e.duration_s !== undefined) text += ' (' + e.duration_s.toFixed(1) + ' s)';
+  if(e.type === 'rule') text += ' "' + e.rule + '": servo a ' + e.angle + '° en ' + e.latency_ms + ' ms';
+  document.getElementById('events').textContent = text;
+  if(e.detections_per_hour !== undefined){
+    document.getElementById('rate').textContent = e.detections_per_hour.toFixed(0);
   }
-  document.getElementById('dist').textContent = d.dist + ' cm';
-  document.getElementById('mov').textContent = d.mov ? '¡DETECTADO!' : 'NO';
-  chart.update('none');
 });
 
 function sendCmd(pos){
-  socket.emit('command', {angle: pos});
+  const status = document.getElementById('cmd-status');
+  status.textContent = 'Enviando ' + pos + '°...';
+  socket.emit('command', {angle: pos}, (res)=>{
+    if(res && !res.ok) status.textContent = 'Error: ' + res.error;
+  });
 }
 
+// El portón confirmó el ángulo en S:; latencia ida y vuelta medida en el servidor
+socket.on('command_ack', (a)=>{
+  document.getElementById('cmd-status').textContent = 'Portón en ' + a.angle + '° ' +
+    (a.latency_ms === null ? '(ya estaba ahí)' : '(respuesta en ' + a.latency_ms + ' ms)');
+});
+
 createChart();